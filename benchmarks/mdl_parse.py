@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""
+    Compares the in place mdl parser with reading the model data through a stream, with recording a block map
+    and with loading the parsed models from their serialized form in the model cache (with and without
+    accessing the headers of all nodes, which are deserialized on first access).
+
+    usage: python -m benchmarks.mdl_parse [path [path ...]] [--repeat REPEAT]
+
+    The paths are mdl files or directories with mdl files. Without paths a corpus of synthetic models is parsed.
+"""
+
+import argparse
+import glob
+import os
+import time
+
+import kotor.model.mdl as mdl
+from kotor.cache import dump_objects, load_objects
+from kotor.tools import Block, NULL_BLOCK
+from tests.testutil import NodeSpec, model_data
+
+
+def synthetic_model(index, node_count=60, vertex_count=200):
+    vertices = [(float(i), float(i % 7), float(i % 13)) for i in range(vertex_count)]
+    faces = [((i, i + 1, i + 2), (0xFFFF, 0xFFFF, 0xFFFF), 1) for i in range(vertex_count - 2)]
+    controllers = [(8, [0.0, 0.5, 1.0], [(0.0, 0.0, 0.0), (1.0, 1.0, 1.0), (2.0, 2.0, 2.0)])]
+    children = [NodeSpec("node{}_{}".format(index, node), 0x21 if node % 2 else 0x1, vertices=vertices if node % 2 else [],
+                         faces=faces if node % 2 else [], controllers=controllers) for node in range(node_count)]
+    return model_data(NodeSpec("model{}".format(index), children=children))
+
+
+def corpus(paths):
+    if not paths:
+        return [synthetic_model(index) for index in range(20)]
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(sorted(glob.glob(os.path.join(path, "*.mdl"))))
+        else:
+            filenames.append(path)
+    models = []
+    for filename in filenames:
+        with open(filename, "rb") as file:
+            data = file.read()
+        mdx = mdl.open_mdx(filename)
+        models.append((data, bytes(mdx) if mdx is not None else None))
+    return models
+
+
+def benchmark(models, stream, repeat, trace=False):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for data, mdx in models:
+            mdl.read_model_data(data, mdx, Block("root", 0) if trace else NULL_BLOCK, stream=stream)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the mdl parser.')
+    parser.add_argument('paths', nargs='*', help='mdl files or directories (default: synthetic models)')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times the corpus is parsed (default: 5)')
+    parsed = parser.parse_args()
+
+    models = corpus(parsed.paths)
+    megabytes = sum(len(data) for data, mdx in models) / 1e6
+    print("{} models, {:.2f} MB".format(len(models), megabytes))
+    print("{:>8} {:>10} {:>10}".format('parser', 'time [s]', 'MB/s'))
+    results = {}
+    for name, stream, trace in [('stream', True, False), ('traced', False, True), ('in place', False, False)]:
+        results[name] = benchmark(models, stream, parsed.repeat, trace)
+        print("{:>8} {:>10.3f} {:>10.2f}".format(name, results[name], megabytes / results[name]))
+    print("speedup: {:.2f}x".format(results['stream'] / results['in place']))
+
+    cached = [dump_objects(mdl.read_model_data(data, mdx)) for data, mdx in models]
+    for name, touch in [('cached', False), ('+headers', True)]:
+        start = time.perf_counter()
+        for _ in range(parsed.repeat):
+            for data in cached:
+                model = load_objects(data)
+                if touch:
+                    # the headers of the node types are deserialized on first access
+                    for node in model.node_by_name.values():
+                        node.headers
+        elapsed = (time.perf_counter() - start) / parsed.repeat
+        print("{:>8} {:>10.3f} {:>10.2f}".format(name, elapsed, megabytes / elapsed))
+        print("cache speedup: {:.2f}x".format(results['in place'] / elapsed))
+    print("cache size: {:.2f} MB".format(sum(len(data) for data in cached) / 1e6))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""
+    Optimizes a synthetic triangle soup (each face with its own vertices, in random order) with the MeshOptimizer
+    and prints the time of each stage and the vertex, face and acmr statistics before and after.
+
+    usage: python -m benchmarks.mesh_optimize [--size SIZE] [--lod CELLS]
+"""
+
+import argparse
+import sys
+import time
+
+import numpy
+
+from kotor.model.optimize import MeshOptimizer, acmr, tipsify, weld_vertices
+
+
+def soup(size):
+    """Returns the vertices and faces of a wavy grid of size x size quads as triangle soup with shuffled faces."""
+    x, y = numpy.meshgrid(numpy.arange(size + 1), numpy.arange(size + 1), indexing="ij")
+    positions = numpy.column_stack([x.ravel(), y.ravel(), numpy.sin(x.ravel() * 0.3) * numpy.cos(y.ravel() * 0.2)]).astype('<f4')
+    corner = (numpy.arange(size)[:, None] * (size + 1) + numpy.arange(size)[None, :]).ravel()
+    faces = numpy.concatenate([numpy.column_stack([corner, corner + size + 1, corner + 1]),
+                               numpy.column_stack([corner + 1, corner + size + 1, corner + size + 2])])
+    faces = faces[numpy.random.RandomState(0).permutation(len(faces))]
+    return positions[faces.ravel()], numpy.arange(3 * len(faces)).reshape(-1, 3)
+
+
+def measure(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the mesh optimization.')
+    parser.add_argument('--size', type=int, default=100, help='quads along each side of the grid (default: 100)')
+    parser.add_argument('--lod', type=int, default=None, help='cells of the decimation grid (default: no decimation)')
+    parsed = parser.parse_args()
+
+    positions, indices = soup(parsed.size)
+    elapsed, (welded, welded_indices, attributes) = measure(lambda: weld_vertices(positions, indices))
+    print("weld {} vertices: {:.4f} s".format(len(positions), elapsed))
+    elapsed, order = measure(lambda: tipsify(welded_indices, len(welded)))
+    print("tipsify {} faces: {:.4f} s, acmr {:.3f} -> {:.3f}".format(len(order), elapsed, acmr(welded_indices), acmr(welded_indices[order])))
+
+    optimizer = MeshOptimizer(lod_cells=parsed.lod)
+    elapsed, result = measure(lambda: optimizer.optimize("grid", positions, indices))
+    print("optimize: {:.4f} s".format(elapsed))
+    optimizer.print_statistics(sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
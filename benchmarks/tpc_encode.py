@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+"""
+    Compares the speed and quality of the dxt compression presets.
+
+    usage: python -m benchmarks.tpc_encode [image] [--size SIZE]
+
+    Without image a synthetic texture (gradients and noise) is compressed.
+"""
+
+import argparse
+import time
+
+import numpy
+from PIL import Image
+
+import kotor.dxt as dxt
+
+
+def synthetic_image(size):
+    random = numpy.random.default_rng(42)
+    y, x = numpy.mgrid[0:size, 0:size]
+    pixels = numpy.stack([x * 255 // size, y * 255 // size, (x ^ y) & 0xFF, 255 - (x + y) * 127 // size], axis=-1)
+    pixels = pixels + random.integers(-12, 13, pixels.shape)
+    return numpy.clip(pixels, 0, 255).astype(numpy.uint8)
+
+
+def benchmark(pixels, encoding, preset, threads):
+    levels = dxt.mipmaps(pixels)
+    start = time.perf_counter()
+    data = dxt.compress(levels[0], encoding, preset, threads)
+    for level in levels[1:]:
+        dxt.compress(level, encoding, preset, threads)
+    elapsed = time.perf_counter() - start
+
+    height, width = pixels.shape[:2]
+    decoded = dxt.decompress(data, width, height, encoding).astype(numpy.float64)
+    channels = 4 if encoding == "dxt5" else 3
+    rmse = numpy.sqrt(((decoded - pixels)[:, :, :channels] ** 2).mean())
+    megapixels = sum(level.shape[0] * level.shape[1] for level in levels) / 1e6
+    return elapsed, megapixels / elapsed, rmse
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dxt compression presets.')
+    parser.add_argument('image', nargs='?', help='image to compress (default: synthetic texture)')
+    parser.add_argument('--size', type=int, default=1024, help='size of the synthetic texture (default: 1024)')
+    parser.add_argument('--threads', type=int, default=None, help='number of threads (default: number of cpus)')
+    parsed = parser.parse_args()
+
+    if parsed.image:
+        pixels = numpy.asarray(Image.open(parsed.image).convert('RGBA'))
+    else:
+        pixels = synthetic_image(parsed.size)
+
+    print("{:>8} {:>8} {:>10} {:>12} {:>8}".format('encoding', 'preset', 'time [s]', 'MPixel/s', 'rmse'))
+    for encoding in sorted(dxt.BLOCK_SIZES):
+        for preset in dxt.PRESETS:
+            elapsed, throughput, rmse = benchmark(pixels, encoding, preset, parsed.threads)
+            print("{:>8} {:>8} {:>10.3f} {:>12.2f} {:>8.2f}".format(encoding, preset, elapsed, throughput, rmse))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+    Compares the recursive tree traversal (nested generators) with the explicit stack traversal of kotor.tools
+    on synthetic trees, and reads a deep synthetic model hierarchy.
+
+    usage: python -m benchmarks.tree_traversal [--nodes NODES] [--repeat REPEAT]
+
+    The recursive traversal yields each node through all generators above it, so it is O(depth) per node,
+    and it fails with a RecursionError on trees deeper than the recursion limit.
+"""
+
+import argparse
+import sys
+import time
+
+import kotor.model.mdl as mdl
+from kotor.tools import BREADTH_FIRST, POST_ORDER, PRE_ORDER, iterate_tree, walk_tree
+from tests.testutil import NodeSpec, model_data
+
+
+class TreeNode:
+
+    __slots__ = ("children",)
+
+    def __init__(self):
+        self.children = []
+
+    def get_childs(self):
+        return self.children
+
+
+def recursive_iterate_tree(node, get_childs_function):
+    yield node
+    for child in get_childs_function(node):
+        yield from recursive_iterate_tree(child, get_childs_function)
+
+
+def chain(node_count):
+    root = node = TreeNode()
+    for _ in range(node_count - 1):
+        child = TreeNode()
+        node.children.append(child)
+        node = child
+    return root
+
+
+def balanced(node_count, fanout=4):
+    nodes = [TreeNode()]
+    for index in range(1, node_count):
+        node = TreeNode()
+        nodes[(index - 1) // fanout].children.append(node)
+        nodes.append(node)
+    return nodes[0]
+
+
+def measure(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def count(iterator):
+    return sum(1 for _ in iterator)
+
+
+def recursive_time(tree, repeat):
+    try:
+        return "{:.4f}".format(measure(lambda: count(recursive_iterate_tree(tree, TreeNode.get_childs)), repeat))
+    except RecursionError:
+        return "RecursionError"
+
+
+def deep_model(depth):
+    root = node = NodeSpec("node0")
+    for index in range(1, depth):
+        child = NodeSpec("node{}".format(index))
+        node.children.append(child)
+        node = child
+    # the test writer is recursive
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(4 * depth + 1000)
+    try:
+        return model_data(root)
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the tree traversal.')
+    parser.add_argument('--nodes', type=int, default=20000, help='number of nodes of the synthetic trees (default: 20000)')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times each tree is traversed (default: 5)')
+    parsed = parser.parse_args()
+
+    print("{:>10} {:>16} {:>10} {:>10} {:>10} {:>14}".format('tree', 'recursive [s]', 'pre [s]', 'post [s]', 'bfs [s]', 'iterate [s]'))
+    for name, tree in [('balanced', balanced(parsed.nodes)), ('chain 900', chain(900)), ('chain', chain(parsed.nodes))]:
+        times = [measure(lambda: count(walk_tree(tree, TreeNode.get_childs, order)), parsed.repeat)
+                 for order in (PRE_ORDER, POST_ORDER, BREADTH_FIRST)]
+        iterate = measure(lambda: count(iterate_tree(tree, TreeNode.get_childs)), parsed.repeat)
+        print("{:>10} {:>16} {:>10.4f} {:>10.4f} {:>10.4f} {:>14.4f}".format(name, recursive_time(tree, parsed.repeat), *times, iterate))
+
+    depth = min(parsed.nodes, 5000)
+    data, mdx = deep_model(depth)
+    elapsed = measure(lambda: mdl.read_model_data(data, mdx), parsed.repeat)
+    print("model with a hierarchy of depth {} read in {:.4f} s".format(depth, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+import hashlib
+import io
+import os
+import pickle
+import struct
+import tempfile
+
+import numpy
+
+
+# default size limit of a cache directory: 1 GB
+DEFAULT_MAX_SIZE = 1 << 30
+
+# eviction deletes entries until the cache is this fraction of max_size, so it doesn't run on every put
+EVICTION_TARGET = 0.9
+
+# serialized objects: magic, length of the pickled metadata and number of buffers, followed by (offset, size) of each buffer
+OBJECTS_HEADER = struct.Struct("<4sII")
+OBJECTS_MAGIC = b"KOBJ"
+# buffers are aligned, so the arrays loaded from them are aligned too
+BUFFER_ALIGNMENT = 16
+
+
+def content_key(*parts):
+    """Returns a hex digest over all parts (bytes-like or str). Use it as key for DiskCache."""
+    digest = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        # length prefix, so ("ab", "c") and ("a", "bc") get different keys
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def align(offset):
+    return offset + -offset % BUFFER_ALIGNMENT
+
+
+def restore_recarray(array):
+    return array.view(numpy.recarray)
+
+
+class ArrayPickler(pickle.Pickler):
+
+    """Pickles numpy record arrays as plain arrays, subclasses of numpy.ndarray are otherwise stored in band."""
+
+    def reducer_override(self, obj):
+        if type(obj) is numpy.recarray:
+            return restore_recarray, (obj.view(numpy.ndarray),)
+        return NotImplemented
+
+
+def dump_objects(obj):
+    """
+        Serializes the object into a small pickled metadata record and the raw data of its (contiguous) numpy arrays.
+        The arrays are stored out of band, so load_objects creates them on the serialized data without copying.
+    """
+    buffers = []
+    stream = io.BytesIO()
+    ArrayPickler(stream, protocol=5, buffer_callback=buffers.append).dump(obj)
+    metadata = stream.getbuffer()
+    raws = [buffer.raw() for buffer in buffers]
+    table = struct.Struct("<{}Q".format(2 * len(raws)))
+    offset = align(OBJECTS_HEADER.size + table.size + len(metadata))
+    locations = []
+    for raw in raws:
+        locations += [offset, raw.nbytes]
+        offset = align(offset + raw.nbytes)
+
+    data = bytearray(offset)
+    OBJECTS_HEADER.pack_into(data, 0, OBJECTS_MAGIC, len(metadata), len(raws))
+    table.pack_into(data, OBJECTS_HEADER.size, *locations)
+    data[OBJECTS_HEADER.size + table.size:OBJECTS_HEADER.size + table.size + len(metadata)] = metadata
+    for raw, offset in zip(raws, locations[0::2]):
+        data[offset:offset + raw.nbytes] = raw
+    return bytes(data)
+
+
+def load_objects(data):
+    """Loads an object serialized with dump_objects. The arrays of the object are read only views on data."""
+    magic, metadata_size, buffer_count = OBJECTS_HEADER.unpack_from(data)
+    if magic != OBJECTS_MAGIC:
+        raise ValueError("not a serialized object: {}".format(magic))
+    table = struct.Struct("<{}Q".format(2 * buffer_count))
+    locations = table.unpack_from(data, OBJECTS_HEADER.size)
+    view = memoryview(data)
+    buffers = [view[offset:offset + size] for offset, size in zip(locations[0::2], locations[1::2])]
+    metadata_start = OBJECTS_HEADER.size + table.size
+    return pickle.loads(view[metadata_start:metadata_start + metadata_size], buffers=buffers)
+
+
+class DiskCache:
+
+    """
+        Content addressed cache of byte blobs in a directory. Each entry is a file named by its key.
+        When the size of all entries exceeds max_size, the least recently used entries are deleted.
+        The modification time of an entry file is its last access time. Multiple processes can
+        share the same directory, entries are written atomically.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, suffix=".bin"):
+        self.directory = directory
+        self.max_size = max_size
+        self.suffix = suffix
+        os.makedirs(directory, exist_ok=True)
+        # size of the cache as seen by this instance. the directory is only scanned when it exceeds max_size
+        self.estimated_size = None
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def lookup(self, key):
+        """Returns the path of the entry and marks it as used, or None if the entry is not in the cache."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get(self, key):
+        """Returns the data of the entry or None if the entry is not in the cache."""
+        path = self.lookup(key)
+        if not path:
+            return None
+        try:
+            with open(path, "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            # evicted by another process
+            return None
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as file:
+                file.write(data)
+            # an existing entry is replaced, its size doesn't count anymore
+            try:
+                replaced_size = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced_size = 0
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        if self.estimated_size is None:
+            self.estimated_size = self.size()
+        else:
+            self.estimated_size += len(data) - replaced_size
+        if self.estimated_size > self.max_size:
+            self.evict()
+        return path
+
+    def entries(self):
+        """Returns (access time, size, path) for all entries."""
+        entries = []
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                if entry.name.endswith(self.suffix):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for mtime, size, path in self.entries())
+
+    def evict(self):
+        """Deletes least recently used entries if the cache is larger than max_size."""
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        if total > self.max_size:
+            entries.sort()
+            for mtime, size, path in entries:
+                if total <= self.max_size * EVICTION_TARGET:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self.estimated_size = total
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.estimated_size = 0
+
+
+# cache of the current worker process. A process pool opens it once per process with open_worker_cache as
+# initializer, so each worker scans the size of the cache directory once and not once per task.
+worker_cache = None
+
+
+def open_worker_cache(directory, max_size=DEFAULT_MAX_SIZE):
+    """Pool initializer: opens the DiskCache of the worker process, no cache without directory."""
+    global worker_cache
+    worker_cache = DiskCache(directory, max_size) if directory else None
+
+
+def get_worker_cache():
+    return worker_cache
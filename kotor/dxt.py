@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+"""
+    DXT1 and DXT5 block compression.
+
+    All blocks of a texture are compressed at once with numpy. Images are numpy arrays of
+    shape (height, width, 4) with rgba channels, rows are compressed in array order.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+
+# bytes per compressed 4x4 block
+BLOCK_SIZES = {
+    "dxt1": 8,
+    "dxt5": 16
+}
+
+# textures with more blocks than this are split into chunks and compressed on multiple threads
+THREAD_CHUNK_BLOCKS = 16384
+
+# weights of the palette entries for endpoint 0 in 4 color mode (index 0, 1, 2, 3)
+PALETTE_WEIGHTS = numpy.array([1.0, 0.0, 2.0 / 3.0, 1.0 / 3.0], dtype=numpy.float32)
+
+# bit shift of each of the 16 pixel indices in a color block and an alpha block
+COLOR_INDEX_SHIFTS = numpy.arange(16, dtype=numpy.uint32) * 2
+ALPHA_INDEX_SHIFTS = numpy.arange(16, dtype=numpy.uint64) * 3
+
+
+class Preset:
+    """Compression settings: how the endpoints are selected and how often they are refined."""
+
+    def __init__(self, name, endpoint_function, refine_iterations):
+        self.name = name
+        self.endpoint_function = endpoint_function
+        self.refine_iterations = refine_iterations
+
+
+def image_blocks(pixels):
+    """Returns the 4x4 blocks of the image as float32 array of shape (blocks, 16, 4). The image is padded by repeating the edges."""
+    height, width = pixels.shape[:2]
+    padded = numpy.pad(pixels, ((0, -height % 4), (0, -width % 4), (0, 0)), mode="edge")
+    rows = padded.shape[0] // 4
+    columns = padded.shape[1] // 4
+    blocks = padded.reshape(rows, 4, columns, 4, 4).transpose(0, 2, 1, 3, 4)
+    return blocks.reshape(rows * columns, 16, 4).astype(numpy.float32)
+
+
+def bounds_endpoints(colors):
+    """Fast endpoints: the corners of the bounding box of the block colors."""
+    return colors.max(axis=1), colors.min(axis=1)
+
+
+def principal_axis_endpoints(colors):
+    """Endpoints at the extreme projections of the block colors onto their principal axis."""
+    mean = colors.mean(axis=1, keepdims=True)
+    centered = colors - mean
+    covariance = numpy.einsum("npi,npj->nij", centered, centered)
+    # power iteration, starting with the bounding box diagonal
+    axis = colors.max(axis=1) - colors.min(axis=1) + 1e-3
+    for iteration in range(4):
+        axis = numpy.einsum("nij,nj->ni", covariance, axis)
+        axis /= numpy.linalg.norm(axis, axis=1, keepdims=True) + 1e-12
+    projection = numpy.einsum("npi,ni->np", centered, axis)
+    mean = mean[:, 0]
+    return mean + projection.max(axis=1)[:, None] * axis, mean + projection.min(axis=1)[:, None] * axis
+
+
+def quantize_565(colors):
+    """Converts rgb colors (0..255) to 16 bit rgb565."""
+    colors = numpy.clip(numpy.rint(colors), 0, 255).astype(numpy.uint16)
+    return ((colors[:, 0] >> 3) << 11) | ((colors[:, 1] >> 2) << 5) | (colors[:, 2] >> 3)
+
+
+def expand_565(values):
+    """Converts rgb565 colors to rgb (0..255) the way the hardware does: by replicating the high bits."""
+    values = values.astype(numpy.uint16)
+    r = values >> 11
+    g = (values >> 5) & 0x3F
+    b = values & 0x1F
+    return numpy.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1).astype(numpy.float32)
+
+
+def color_palette(color0, color1):
+    """Returns the 4 color palette (blocks, 4, 3) for endpoints in 4 color mode."""
+    weights = PALETTE_WEIGHTS[None, :, None]
+    return weights * color0[:, None, :] + (1.0 - weights) * color1[:, None, :]
+
+
+def nearest_index(values, palette):
+    """Returns the index of the nearest palette entry for each value. values: (blocks, 16, c), palette: (blocks, k, c)."""
+    distances = ((values[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=-1)
+    return distances.argmin(axis=-1)
+
+
+def refine_endpoints(colors, indices):
+    """Least squares fit of the endpoints for the given palette indices."""
+    alpha = PALETTE_WEIGHTS[indices]
+    beta = 1.0 - alpha
+    aa = (alpha * alpha).sum(axis=1)
+    bb = (beta * beta).sum(axis=1)
+    ab = (alpha * beta).sum(axis=1)
+    ax = (alpha[:, :, None] * colors).sum(axis=1)
+    bx = (beta[:, :, None] * colors).sum(axis=1)
+    determinant = aa * bb - ab * ab
+    solvable = numpy.abs(determinant) > 1e-6
+    determinant = numpy.where(solvable, determinant, 1.0)[:, None]
+    color0 = (ax * bb[:, None] - bx * ab[:, None]) / determinant
+    color1 = (bx * aa[:, None] - ax * ab[:, None]) / determinant
+    return color0, color1, solvable
+
+
+def block_error(colors, packed0, packed1, indices):
+    palette = color_palette(expand_565(packed0), expand_565(packed1))
+    selected = numpy.take_along_axis(palette, indices[:, :, None], axis=1)
+    return ((selected - colors) ** 2).sum(axis=(1, 2))
+
+
+def compress_color_blocks(colors, preset):
+    """Compresses (blocks, 16, 3) colors to dxt1 color blocks. Returns uint8 array (blocks, 8)."""
+    color0, color1 = preset.endpoint_function(colors)
+    packed0 = quantize_565(color0)
+    packed1 = quantize_565(color1)
+    indices = nearest_index(colors, color_palette(expand_565(packed0), expand_565(packed1)))
+
+    for iteration in range(preset.refine_iterations):
+        refined0, refined1, solvable = refine_endpoints(colors, indices)
+        refined0 = quantize_565(refined0)
+        refined1 = quantize_565(refined1)
+        refined_indices = nearest_index(colors, color_palette(expand_565(refined0), expand_565(refined1)))
+        # keep the refined endpoints only where they reduce the error
+        old_error = block_error(colors, packed0, packed1, indices)
+        new_error = block_error(colors, refined0, refined1, refined_indices)
+        better = solvable & (new_error < old_error)
+        packed0 = numpy.where(better, refined0, packed0)
+        packed1 = numpy.where(better, refined1, packed1)
+        indices = numpy.where(better[:, None], refined_indices, indices)
+
+    # 4 color mode requires color0 > color1. swapping the endpoints swaps index 0<->1 and 2<->3
+    swap = packed0 < packed1
+    packed0, packed1 = numpy.where(swap, packed1, packed0), numpy.where(swap, packed0, packed1)
+    indices = numpy.where(swap[:, None], indices ^ 1, indices)
+    # equal endpoints would select 3 color mode: only use index 0
+    indices = numpy.where((packed0 == packed1)[:, None], 0, indices)
+
+    result = numpy.empty(len(colors), dtype=[("color0", "<u2"), ("color1", "<u2"), ("indices", "<u4")])
+    result["color0"] = packed0
+    result["color1"] = packed1
+    result["indices"] = (indices.astype(numpy.uint32) << COLOR_INDEX_SHIFTS).sum(axis=1, dtype=numpy.uint32)
+    return result.view(numpy.uint8).reshape(len(colors), 8)
+
+
+def alpha_palette(alpha0, alpha1):
+    """Returns the 8 alpha palette (blocks, 8) for alpha0 > alpha1."""
+    alpha0 = alpha0.astype(numpy.int32)[:, None]
+    alpha1 = alpha1.astype(numpy.int32)[:, None]
+    weights = numpy.arange(1, 7, dtype=numpy.int32)[None, :]
+    interpolated = ((7 - weights) * alpha0 + weights * alpha1 + 3) // 7
+    return numpy.concatenate([alpha0, alpha1, interpolated], axis=1).astype(numpy.float32)
+
+
+def alpha6_palette(alpha0, alpha1):
+    """Returns the alpha palette (blocks, 8) for alpha0 <= alpha1: 4 interpolated values, 0 and 255."""
+    alpha0 = alpha0.astype(numpy.int32)[:, None]
+    alpha1 = alpha1.astype(numpy.int32)[:, None]
+    weights = numpy.arange(1, 5, dtype=numpy.int32)[None, :]
+    interpolated = ((5 - weights) * alpha0 + weights * alpha1 + 2) // 5
+    count = len(alpha0)
+    return numpy.concatenate([alpha0, alpha1, interpolated, numpy.zeros((count, 1), numpy.int32), numpy.full((count, 1), 255, numpy.int32)], axis=1).astype(numpy.float32)
+
+
+def compress_alpha_blocks(alpha):
+    """Compresses (blocks, 16) alpha values to dxt5 alpha blocks. Returns uint8 array (blocks, 8)."""
+    alpha = numpy.clip(numpy.rint(alpha), 0, 255)
+    alpha0 = alpha.max(axis=1).astype(numpy.uint8)
+    alpha1 = alpha.min(axis=1).astype(numpy.uint8)
+    indices = nearest_index(alpha[:, :, None], alpha_palette(alpha0, alpha1)[:, :, None])
+    # equal alpha values select 6 alpha mode: only use index 0
+    indices = numpy.where((alpha0 == alpha1)[:, None], 0, indices)
+    bits = (indices.astype(numpy.uint64) << ALPHA_INDEX_SHIFTS).sum(axis=1, dtype=numpy.uint64)
+
+    result = numpy.empty((len(alpha), 8), dtype=numpy.uint8)
+    result[:, 0] = alpha0
+    result[:, 1] = alpha1
+    result[:, 2:] = bits.astype("<u8").view(numpy.uint8).reshape(len(alpha), 8)[:, :6]
+    return result
+
+
+def compress_blocks(blocks, encoding, preset):
+    color_blocks = compress_color_blocks(blocks[:, :, :3], preset)
+    if encoding == "dxt1":
+        return color_blocks
+    return numpy.concatenate([compress_alpha_blocks(blocks[:, :, 3]), color_blocks], axis=1)
+
+
+def compress(pixels, encoding="dxt1", preset="normal", threads=None):
+    """
+        Compresses an image to dxt1 or dxt5.
+
+        @param pixels numpy array (height, width, 4) with rgba values
+        @param encoding "dxt1" or "dxt5"
+        @param preset name of the preset (see PRESETS)
+        @param threads number of threads for large images (None: number of cpus)
+        @return the compressed blocks as bytes
+    """
+    if encoding not in BLOCK_SIZES:
+        raise ValueError("unknown encoding '{}'".format(encoding))
+    preset = PRESETS[preset]
+    blocks = image_blocks(pixels)
+    if len(blocks) <= THREAD_CHUNK_BLOCKS or threads == 1:
+        return compress_blocks(blocks, encoding, preset).tobytes()
+
+    chunks = [blocks[start:start + THREAD_CHUNK_BLOCKS] for start in range(0, len(blocks), THREAD_CHUNK_BLOCKS)]
+    with ThreadPoolExecutor(threads) as executor:
+        compressed = executor.map(lambda chunk: compress_blocks(chunk, encoding, preset), chunks)
+        return b"".join(chunk.tobytes() for chunk in compressed)
+
+
+def downsample(pixels):
+    """Halves width and height of the image with a box filter. Odd last rows or columns are dropped."""
+    height, width = pixels.shape[:2]
+    pixels = pixels.astype(numpy.float32)
+    if height > 1:
+        pixels = (pixels[0:height // 2 * 2:2] + pixels[1:height // 2 * 2:2]) * 0.5
+    if width > 1:
+        pixels = (pixels[:, 0:width // 2 * 2:2] + pixels[:, 1:width // 2 * 2:2]) * 0.5
+    return pixels
+
+
+def mipmaps(pixels, count=None):
+    """Returns the mipmap chain of the image, starting with the image itself and ending at 1x1 (or after count levels)."""
+    levels = [pixels]
+    while levels[-1].shape[0] > 1 or levels[-1].shape[1] > 1:
+        if count is not None and len(levels) >= count:
+            break
+        levels.append(downsample(levels[-1]))
+    return levels
+
+
+def decompress(data, width, height, encoding):
+    """Decompresses dxt1 or dxt5 blocks to a numpy array (height, width, 4)."""
+    rows = (height + 3) // 4
+    columns = (width + 3) // 4
+    blocks = numpy.frombuffer(data, dtype=numpy.uint8, count=rows * columns * BLOCK_SIZES[encoding]).reshape(rows * columns, -1)
+    if encoding == "dxt5":
+        alpha_blocks = blocks[:, :8]
+        color_blocks = blocks[:, 8:]
+    else:
+        alpha_blocks = None
+        color_blocks = blocks
+
+    color0 = color_blocks[:, 0:2].copy().view("<u2")[:, 0]
+    color1 = color_blocks[:, 2:4].copy().view("<u2")[:, 0]
+    bits = color_blocks[:, 4:8].copy().view("<u4")
+    indices = (bits >> COLOR_INDEX_SHIFTS) & 3
+    palette = color_palette(expand_565(color0), expand_565(color1))
+    # only dxt1 has the 3 color mode with transparent black, the color block of dxt5 always has 4 colors
+    if encoding == "dxt1":
+        three_color = color0 <= color1
+    else:
+        three_color = numpy.zeros(len(blocks), dtype=bool)
+    if three_color.any():
+        half = (expand_565(color0[three_color]) + expand_565(color1[three_color])) * 0.5
+        palette[three_color, 2] = half
+        palette[three_color, 3] = 0
+    rgb = numpy.take_along_axis(palette, indices[:, :, None].astype(numpy.intp), axis=1)
+
+    if alpha_blocks is None:
+        alpha = numpy.where((three_color[:, None]) & (indices == 3), 0, 255)
+    else:
+        alpha_bits = numpy.zeros((len(blocks), 8), dtype=numpy.uint8)
+        alpha_bits[:, :6] = alpha_blocks[:, 2:]
+        alpha_bits = alpha_bits.view("<u8")
+        alpha_indices = (alpha_bits >> ALPHA_INDEX_SHIFTS) & 7
+        alpha_palette8 = alpha_palette(alpha_blocks[:, 0], alpha_blocks[:, 1])
+        alpha_palette6 = alpha6_palette(alpha_blocks[:, 0], alpha_blocks[:, 1])
+        eight = (alpha_blocks[:, 0] > alpha_blocks[:, 1])[:, None]
+        alpha_palettes = numpy.where(eight, alpha_palette8, alpha_palette6)
+        alpha = numpy.take_along_axis(alpha_palettes, alpha_indices.astype(numpy.intp), axis=1)
+
+    pixels = numpy.concatenate([rgb, alpha[:, :, None]], axis=2)
+    pixels = numpy.clip(numpy.rint(pixels), 0, 255).astype(numpy.uint8)
+    pixels = pixels.reshape(rows, columns, 4, 4, 4).transpose(0, 2, 1, 3, 4).reshape(rows * 4, columns * 4, 4)
+    return pixels[:height, :width]
+
+
+def flip_blocks(data, width, height, encoding):
+    """
+        Flips compressed blocks vertically without decoding them: the rows of blocks are reversed and the index
+        rows inside each block. Images lower than a block keep their rows in the top of the block. The flip is
+        exact if the height is a multiple of 4 or lower than 4, which is the case for all power of two textures.
+    """
+    rows = (height + 3) // 4
+    columns = (width + 3) // 4
+    block_size = BLOCK_SIZES[encoding]
+    blocks = numpy.frombuffer(data, dtype=numpy.uint8, count=rows * columns * block_size).reshape(rows, columns, block_size)
+    blocks = blocks[::-1].copy()
+    valid = min(height, 4)
+    order = list(range(valid - 1, -1, -1)) + list(range(valid, 4))
+    # the color indices are one byte per row
+    color_rows = blocks[:, :, block_size - 4:]
+    color_rows[:] = color_rows[:, :, order]
+    if encoding == "dxt5":
+        # the alpha indices are 12 bits per row in 6 bytes
+        alpha_bits = numpy.zeros(blocks.shape[:2] + (8,), dtype=numpy.uint8)
+        alpha_bits[:, :, :6] = blocks[:, :, 2:8]
+        alpha_bits = alpha_bits.view("<u8")[:, :, 0]
+        flipped = numpy.zeros_like(alpha_bits)
+        for row, source in enumerate(order):
+            flipped |= ((alpha_bits >> numpy.uint64(12 * source)) & numpy.uint64(0xFFF)) << numpy.uint64(12 * row)
+        blocks[:, :, 2:8] = flipped[:, :, None].view(numpy.uint8)[:, :, :6]
+    return blocks.tobytes()
+
+
+PRESETS = {
+    "fast": Preset("fast", bounds_endpoints, 0),
+    "normal": Preset("normal", principal_axis_endpoints, 0),
+    "high": Preset("high", principal_axis_endpoints, 2),
+}
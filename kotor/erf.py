@@ -115,5 +115,6 @@ def parse_command_line():
 def main():
     parse_command_line()
 
-main()
+if __name__ == "__main__":
+    main()
 
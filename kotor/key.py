@@ -140,6 +140,24 @@ def get_absolute_bif_filename(keyFile, bifFile):
     return os.path.join(path, bifFile)
     
 
+def find_resources(keyFile, bifFiles, extension=None):
+    """
+        Returns an iterator over (keyEntry, bif path, bif FileEntry) tuples for all ressources in the bif files.
+
+        @param keyFile the KeyFile which references the bif files
+        @param bifFiles names of the bif files as referenced in the key file
+        @param extension only return ressources with this extension (i.e. 'tpc'). None returns all ressources.
+    """
+    for bifFile in bifFiles:
+        if bifFile not in keyFile.fileDirectory:
+            raise ValueError("bif file '{}' not found in {}".format(bifFile, keyFile.path))
+        bif_path = get_absolute_bif_filename(keyFile, bifFile)
+        bifDirectory = bif.read_bif_directory(bif_path)
+        for entry in keyFile.fileDirectory[bifFile]:
+            if extension is None or entry.type.extension == extension:
+                yield entry, bif_path, bifDirectory[entry.bifIndex]
+
+
 def list_bif_contents(keyFile, bifFile):
     bifEntries = keyFile.fileDirectory[bifFile]
     bifPath =  get_absolute_bif_filename(keyFile, bifFile)
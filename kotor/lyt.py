@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import argparse
+
+
+class Room:
+    def __init__(self, name, position):
+        self.name = name
+        self.position = position
+
+    def __str__(self):
+        return "Room: {{name: {name}, position: {position}}}".format(**vars(self))
+
+
+class DoorHook:
+    def __init__(self, room, name, position, orientation):
+        self.room = room
+        self.name = name
+        self.position = position
+        # quaternion (x, y, z, w)
+        self.orientation = orientation
+
+    def __str__(self):
+        return "DoorHook: {{room: {room}, name: {name}, position: {position}, orientation: {orientation}}}".format(**vars(self))
+
+
+class Layout:
+
+    """Room layout of an area (.lyt). The rooms are the models (and walkmeshes) of the area at their positions."""
+
+    def __init__(self):
+        self.rooms = []
+        self.tracks = []
+        self.obstacles = []
+        self.door_hooks = []
+
+
+def floats(values):
+    return tuple(float(value) for value in values)
+
+
+def read_lyt(file):
+    """Reads a layout from a text file (or any iterable of lines)."""
+    layout = Layout()
+    lines = (line.split() for line in file)
+    for parts in lines:
+        if len(parts) != 2 or not parts[0].endswith("count"):
+            continue
+        section = parts[0]
+        for index in range(int(parts[1])):
+            entry = next(lines)
+            if section == "roomcount":
+                layout.rooms.append(Room(entry[0], floats(entry[1:4])))
+            elif section == "trackcount":
+                layout.tracks.append(Room(entry[0], floats(entry[1:4])))
+            elif section == "obstaclecount":
+                layout.obstacles.append(Room(entry[0], floats(entry[1:4])))
+            elif section == "doorhookcount":
+                # room, door, unknown, position, orientation
+                layout.door_hooks.append(DoorHook(entry[0], entry[1], floats(entry[3:6]), floats(entry[6:10])))
+    return layout
+
+
+def read_lyt_file(filename):
+    with open(filename, encoding="latin-1") as file:
+        return read_lyt(file)
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='Process LYT files.')
+    parser.add_argument('input', help='path to lyt file')
+    parsed = parser.parse_args()
+
+    layout = read_lyt_file(parsed.input)
+    for entry in layout.rooms + layout.door_hooks:
+        print(entry)
+
+
+def main():
+    parse_command_line()
+
+
+if __name__ == "__main__":
+    main()
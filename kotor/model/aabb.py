@@ -0,0 +1,264 @@
+import struct
+
+from collections import OrderedDict
+
+import numpy
+
+from kotor.tools import *
+
+
+AABB_ENTRY_STRUCT = struct.Struct("<6fIIiI")
+
+# number of queries traversed at once. bounds the memory of the (query, node) pairs.
+QUERY_CHUNK = 1 << 16
+
+
+def read_aabb_tree(file, root_offset, parent_block=NULL_BLOCK):
+    """
+        Reads the aabb tree starting at root_offset breadth first into an AabbTree. The nodes of the
+        binary model reference their children by offset, 0 means no child.
+    """
+    offsets = [root_offset]
+    index_by_offset = {root_offset: 0}
+    rows = []
+    with parent_block.block("AABB_Nodes"):
+        while len(rows) < len(offsets):
+            file.seek(offsets[len(rows)])
+            values = unpack(file, AABB_ENTRY_STRUCT)
+            rows.append(values)
+            for child_offset in values[6:8]:
+                if child_offset and child_offset not in index_by_offset:
+                    index_by_offset[child_offset] = len(offsets)
+                    offsets.append(child_offset)
+
+    table = numpy.array([row[0:6] for row in rows], dtype=numpy.float32).reshape(-1, 6)
+    children = numpy.array([[index_by_offset.get(offset, -1) if offset else -1 for offset in row[6:8]] for row in rows], dtype=numpy.int32).reshape(-1, 2)
+    faces = numpy.array([row[8] for row in rows], dtype=numpy.int32)
+    planes = numpy.array([row[9] for row in rows], dtype=numpy.uint32)
+    return AabbTree(table[:, 0:3], table[:, 3:6], children, faces, planes)
+
+
+def dot(a, b):
+    return numpy.einsum('...i,...i->...', a, b)
+
+
+def safe_divide(numerator, denominator):
+    return numerator / numpy.where(denominator == 0, 1.0, denominator)
+
+
+def intersect_triangles(origins, directions, triangles, epsilon=1e-9):
+    """
+        Moeller-Trumbore intersection of each ray with the triangle in the same row.
+        Returns the ray parameter t of the hit (in units of the direction), inf if the ray misses.
+    """
+    edge1 = triangles[:, 1] - triangles[:, 0]
+    edge2 = triangles[:, 2] - triangles[:, 0]
+    p = numpy.cross(directions, edge2)
+    determinant = dot(edge1, p)
+    valid = numpy.abs(determinant) > epsilon
+    inverse = safe_divide(1.0, numpy.where(valid, determinant, 0.0))
+    s = origins - triangles[:, 0]
+    u = dot(s, p) * inverse
+    q = numpy.cross(s, edge1)
+    v = dot(directions, q) * inverse
+    t = dot(edge2, q) * inverse
+    hit = valid & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+    return numpy.where(hit, t, numpy.inf)
+
+
+def closest_points_on_triangles(points, triangles):
+    """Returns the point of the triangle in the same row which is closest to each point (see Ericson, Real-Time Collision Detection)."""
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    ab = b - a
+    ac = c - a
+    ap = points - a
+    d1 = dot(ab, ap)
+    d2 = dot(ac, ap)
+    bp = points - b
+    d3 = dot(ab, bp)
+    d4 = dot(ac, bp)
+    cp = points - c
+    d5 = dot(ab, cp)
+    d6 = dot(ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    # inside of the triangle, then the edge and vertex regions with increasing priority
+    denominator = va + vb + vc
+    result = a + ab * safe_divide(vb, denominator)[:, None] + ac * safe_divide(vc, denominator)[:, None]
+    regions = [
+        ((va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0), b + (c - b) * safe_divide(d4 - d3, (d4 - d3) + (d5 - d6))[:, None]),
+        ((vb <= 0) & (d2 >= 0) & (d6 <= 0), a + ac * safe_divide(d2, d2 - d6)[:, None]),
+        ((d6 >= 0) & (d5 <= d6), c),
+        ((vc <= 0) & (d1 >= 0) & (d3 <= 0), a + ab * safe_divide(d1, d1 - d3)[:, None]),
+        ((d3 >= 0) & (d4 <= d3), b),
+        ((d1 <= 0) & (d2 <= 0), a),
+    ]
+    for condition, region_points in regions:
+        result = numpy.where(condition[:, None], region_points, result)
+    return result
+
+
+def box_distances(points, minimum, maximum):
+    """Distance of each point to the box in the same row, 0 inside of the box."""
+    return numpy.linalg.norm(numpy.maximum(numpy.maximum(minimum - points, points - maximum), 0.0), axis=-1)
+
+
+class AabbTree:
+
+    """
+        Axis aligned bounding box tree in flat arrays. Node i has the box minimum[i]..maximum[i] and the
+        child nodes children[i] (-1 for no child). Leaf nodes reference the face faces[i], inner nodes have -1.
+        Node 0 is the root. The queries need the triangles of the faces, see set_triangles.
+    """
+
+    def __init__(self, minimum, maximum, children, faces, planes=None, triangles=None):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.children = children
+        self.faces = faces
+        self.planes = planes if planes is not None else numpy.zeros(len(faces), dtype=numpy.uint32)
+        # (face count, 3, 3) array with the corners of each face
+        self.triangles = triangles
+
+    def set_triangles(self, vertices, vertex_indices):
+        """Sets the triangles of the faces from a (count, 3) vertex array and the (face count, 3) vertex indices of the faces."""
+        self.triangles = numpy.asarray(vertices, dtype=numpy.float64)[numpy.asarray(vertex_indices, dtype=numpy.int64)]
+
+    def traverse(self, count, box_test):
+        """
+            Walks the tree for count queries at once. box_test(queries, nodes) returns a boolean array which
+            (query, node) pairs to descend into. Returns the query and face ids of the reached leaves.
+        """
+        leaf_queries = []
+        leaf_faces = []
+        queries = numpy.arange(count)
+        nodes = numpy.zeros(count, dtype=numpy.int64)
+        if not len(self.faces):
+            queries = queries[:0]
+        while len(queries):
+            keep = box_test(queries, nodes)
+            queries = queries[keep]
+            nodes = nodes[keep]
+            faces = self.faces[nodes]
+            leaf = faces >= 0
+            leaf_queries.append(queries[leaf])
+            leaf_faces.append(faces[leaf])
+            children = self.children[nodes[~leaf]].ravel()
+            valid = children >= 0
+            queries = numpy.repeat(queries[~leaf], 2)[valid]
+            nodes = children[valid].astype(numpy.int64)
+        if not leaf_queries:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int32)
+        return numpy.concatenate(leaf_queries), numpy.concatenate(leaf_faces)
+
+    def boxes_containing(self, points):
+        """Returns the (point ids, face ids) of all leaf boxes which contain the points."""
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+
+        def inside(queries, nodes):
+            query_points = points[queries]
+            return numpy.all((query_points >= self.minimum[nodes]) & (query_points <= self.maximum[nodes]), axis=-1)
+
+        return self.traverse(len(points), inside)
+
+    def raycast(self, origins, directions, max_distance=numpy.inf):
+        """
+            Returns the distance (in units of the direction, inf if nothing is hit) and the face (-1 if nothing is hit)
+            of the first hit of each ray within max_distance.
+        """
+        origins = numpy.asarray(origins, dtype=numpy.float64).reshape(-1, 3)
+        directions = numpy.asarray(directions, dtype=numpy.float64).reshape(-1, 3)
+        max_distance = numpy.broadcast_to(numpy.asarray(max_distance, dtype=numpy.float64), (len(origins),))
+        distances = numpy.full(len(origins), numpy.inf)
+        faces = numpy.full(len(origins), -1, dtype=numpy.int32)
+        for start in range(0, len(origins), QUERY_CHUNK):
+            chunk = slice(start, start + QUERY_CHUNK)
+            distances[chunk], faces[chunk] = self._raycast(origins[chunk], directions[chunk], max_distance[chunk])
+        return distances, faces
+
+    def _raycast(self, origins, directions, max_distance):
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            inverse_directions = 1.0 / directions
+
+            def slab(queries, nodes):
+                low = (self.minimum[nodes] - origins[queries]) * inverse_directions[queries]
+                high = (self.maximum[nodes] - origins[queries]) * inverse_directions[queries]
+                # nan (0 * inf) for rays in the plane of a slab is ignored by fmin/fmax
+                enter = numpy.fmax.reduce(numpy.fmin(low, high), axis=-1)
+                leave = numpy.fmin.reduce(numpy.fmax(low, high), axis=-1)
+                return (leave >= numpy.maximum(enter, 0.0)) & (enter <= max_distance[queries])
+
+            queries, faces = self.traverse(len(origins), slab)
+        hits = intersect_triangles(origins[queries], directions[queries], self.triangles[faces])
+        hits = numpy.where(hits <= max_distance[queries], hits, numpy.inf)
+        distances = numpy.full(len(origins), numpy.inf)
+        numpy.minimum.at(distances, queries, hits)
+        first_faces = numpy.full(len(origins), -1, dtype=numpy.int32)
+        nearest = numpy.isfinite(hits) & (hits == distances[queries])
+        first_faces[queries[nearest]] = faces[nearest]
+        return distances, first_faces
+
+    def line_of_sight(self, starts, ends):
+        """Returns True for each pair of points without a face between them."""
+        starts = numpy.asarray(starts, dtype=numpy.float64).reshape(-1, 3)
+        ends = numpy.asarray(ends, dtype=numpy.float64).reshape(-1, 3)
+        distances, faces = self.raycast(starts, ends - starts, 1.0)
+        return faces < 0
+
+    def nearest_faces(self, points):
+        """Returns the distance, the nearest face and the closest point on that face for each point."""
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+        distances = numpy.full(len(points), numpy.inf)
+        faces = numpy.full(len(points), -1, dtype=numpy.int32)
+        closest = numpy.zeros((len(points), 3))
+        for start in range(0, len(points), QUERY_CHUNK):
+            chunk = slice(start, start + QUERY_CHUNK)
+            distances[chunk], faces[chunk], closest[chunk] = self._nearest_faces(points[chunk])
+        return distances, faces, closest
+
+    def _nearest_faces(self, points):
+        count = len(points)
+        if not len(self.faces) or not count:
+            return numpy.full(count, numpy.inf), numpy.full(count, -1, dtype=numpy.int32), numpy.zeros((count, 3))
+        # upper bound: descend to the child with the nearer box
+        nodes = numpy.zeros(count, dtype=numpy.int64)
+        inner = self.faces[nodes] < 0
+        while inner.any():
+            children = self.children[nodes[inner]]
+            left = children[:, 0].astype(numpy.int64)
+            right = children[:, 1].astype(numpy.int64)
+            inner_points = points[inner]
+            left_distance = numpy.where(left >= 0, box_distances(inner_points, self.minimum[left], self.maximum[left]), numpy.inf)
+            right_distance = numpy.where(right >= 0, box_distances(inner_points, self.minimum[right], self.maximum[right]), numpy.inf)
+            nodes[inner] = numpy.where(left_distance <= right_distance, left, right)
+            # an inner node without children ends the descent (-1 would index the last node)
+            inner &= nodes >= 0
+            inner[inner] = self.faces[nodes[inner]] < 0
+        # points which reached no leaf have no bound
+        found = nodes >= 0
+        bound = numpy.full(count, numpy.inf)
+        bound[found] = numpy.linalg.norm(closest_points_on_triangles(points[found], self.triangles[self.faces[nodes[found]]]) - points[found], axis=-1)
+
+        # all leaves whose box is not farther away than the bound
+        def near(queries, nodes):
+            return box_distances(points[queries], self.minimum[nodes], self.maximum[nodes]) <= bound[queries]
+
+        queries, faces = self.traverse(count, near)
+        closest = closest_points_on_triangles(points[queries], self.triangles[faces])
+        candidate_distances = numpy.linalg.norm(closest - points[queries], axis=-1)
+        distances = numpy.full(count, numpy.inf)
+        numpy.minimum.at(distances, queries, candidate_distances)
+        nearest = candidate_distances == distances[queries]
+        nearest_faces = numpy.full(count, -1, dtype=numpy.int32)
+        nearest_points = numpy.zeros((count, 3))
+        nearest_faces[queries[nearest]] = faces[nearest]
+        nearest_points[queries[nearest]] = closest[nearest]
+        return distances, nearest_faces, nearest_points
+
+    def __len__(self):
+        return len(self.faces)
+
+    def __serialize__(self):
+        return OrderedDict([('minimum', self.minimum), ('maximum', self.maximum), ('children', self.children), ('faces', self.faces), ('planes', self.planes)])
@@ -0,0 +1,115 @@
+from collections import OrderedDict
+
+import numpy
+
+from kotor.tools import *
+from .nodes import Node, POSITION_CONTROLLER, ORIENTATION_CONTROLLER, SCALE_CONTROLLER
+
+
+# sampled controller types and their value columns. orientations are (x, y, z, w) quaternions.
+TRACK_TYPES = OrderedDict([
+    ("position", (POSITION_CONTROLLER, 3)),
+    ("orientation", (ORIENTATION_CONTROLLER, 4)),
+    ("scale", (SCALE_CONTROLLER, 1)),
+])
+
+
+def animation_tracks(animation):
+    """Returns the (node name, controller) pairs of all position, orientation and scale controllers of the animation."""
+    controller_types = set(controller_type for controller_type, columns in TRACK_TYPES.values())
+    tracks = []
+    for node in iterate_tree(animation.animation_node, Node.get_childs):
+        if node.node_header:
+            for controller in node.node_header.controllers.data:
+                if controller.controller_type_id in controller_types and controller.row_count:
+                    tracks.append((node.name, controller))
+    return tracks
+
+
+def slerp(start, end, fraction):
+    """Spherical linear interpolation between the quaternions in the rows of start and end (arrays of shape (..., 4))."""
+    dot = numpy.sum(start * end, axis=-1)
+    # take the shorter arc
+    end = numpy.where(dot[..., None] < 0, -end, end)
+    dot = numpy.abs(dot)
+    angle = numpy.arccos(numpy.clip(dot, -1.0, 1.0))
+    sin_angle = numpy.sin(angle)
+    # nearly identical quaternions are interpolated linearly
+    linear = sin_angle < 1e-6
+    safe_sin = numpy.where(linear, 1.0, sin_angle)
+    start_weight = numpy.where(linear, 1.0 - fraction, numpy.sin((1.0 - fraction) * angle) / safe_sin)
+    end_weight = numpy.where(linear, fraction, numpy.sin(fraction * angle) / safe_sin)
+    result = start * start_weight[..., None] + end * end_weight[..., None]
+    return result / numpy.linalg.norm(result, axis=-1, keepdims=True)
+
+
+class TrackGroup:
+
+    """
+        The keys of all controllers of one type in flat arrays. The times of controller k are shifted
+        by k * span, so the keys of all controllers can be searched with one searchsorted.
+    """
+
+    def __init__(self, names, controllers, columns):
+        self.names = names
+        self.columns = columns
+        counts = numpy.array([controller.row_count for controller in controllers], dtype=numpy.int64)
+        self.starts = numpy.concatenate([[0], numpy.cumsum(counts)[:-1]]).astype(numpy.int64)
+        self.ends = self.starts + counts - 1
+        times = [numpy.asarray(controller.times, dtype=numpy.float64) for controller in controllers]
+        self.first_times = numpy.array([track_times[0] for track_times in times])
+        self.last_times = numpy.array([track_times[-1] for track_times in times])
+        self.span = float(self.last_times.max() - self.first_times.min()) + 1.0
+        self.offsets = numpy.arange(len(controllers)) * self.span
+        self.times = numpy.concatenate([track_times + offset for track_times, offset in zip(times, self.offsets)])
+        self.values = numpy.concatenate([numpy.asarray(controller.values, dtype=numpy.float64)[:, :columns] for controller in controllers])
+
+    def sample(self, times):
+        """Returns the values of all controllers at the times, an array of shape (controllers, len(times), columns)."""
+        # clamp to the keys of each controller and move to its time range
+        query = numpy.clip(times[None, :], self.first_times[:, None], self.last_times[:, None]) + self.offsets[:, None]
+        index = numpy.searchsorted(self.times, query, side='right') - 1
+        index = numpy.clip(index, self.starts[:, None], self.ends[:, None])
+        next_index = numpy.minimum(index + 1, self.ends[:, None])
+        duration = self.times[next_index] - self.times[index]
+        fraction = numpy.where(duration > 0, (query - self.times[index]) / numpy.where(duration > 0, duration, 1.0), 0.0)
+        start = self.values[index]
+        end = self.values[next_index]
+        if self.columns == 4:
+            return slerp(start, end, fraction)
+        return start + (end - start) * fraction[..., None]
+
+
+class AnimationSampler:
+
+    """
+        Evaluates the position, orientation and scale controllers of an animation at arbitrary times.
+        Values are interpolated linearly (quaternions with slerp), tangents of bezier controllers are ignored.
+    """
+
+    def __init__(self, tracks):
+        self.groups = OrderedDict()
+        for track_type, (controller_type, columns) in TRACK_TYPES.items():
+            selected = [(name, controller) for name, controller in tracks if controller.controller_type_id == controller_type]
+            if selected:
+                self.groups[track_type] = TrackGroup([name for name, controller in selected],
+                                                     [controller for name, controller in selected], columns)
+
+    def sample(self, times):
+        """
+            Returns an OrderedDict track type -> (node names, values) for the times. values has the shape
+            (len(node names), len(times), columns).
+        """
+        times = numpy.asarray(times, dtype=numpy.float64).reshape(-1)
+        return OrderedDict((track_type, (group.names, group.sample(times))) for track_type, group in self.groups.items())
+
+
+def sample_animation(animation, times):
+    """Samples the animation at the times, see AnimationSampler.sample."""
+    return AnimationSampler(animation_tracks(animation)).sample(times)
+
+
+def bake_animation(animation, fps=30):
+    """Samples the animation in fixed steps of 1/fps from 0 to animation.length. Returns the times and the samples."""
+    times = numpy.arange(int(numpy.floor(animation.length * fps + 1e-6)) + 1) / fps
+    return times, sample_animation(animation, times)
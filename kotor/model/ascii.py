@@ -0,0 +1,412 @@
+import numpy
+
+from kotor.tools import *
+from .base import vectors
+from .nodes import Node, CONTROLLER_TYPES, ORIENTATION_CONTROLLER, BEZIER_FLAG
+from .obj import format_rows, WRITE_BUFFER_SIZE
+
+
+# ascii node types and their node type bitfields. a node is written with the first type whose bits it has.
+NODE_TYPE_NAMES = [
+    ("aabb", 0x221),
+    ("lightsaber", 0x821),
+    ("danglymesh", 0x121),
+    ("animmesh", 0xA1),
+    ("skin", 0x61),
+    ("trimesh", 0x21),
+    ("reference", 0x11),
+    ("camera", 0x9),
+    ("emitter", 0x5),
+    ("light", 0x3),
+    ("dummy", 0x1),
+]
+NODE_TYPE_BITS = dict(NODE_TYPE_NAMES)
+
+CLASSIFICATIONS = {0x00: "other", 0x01: "effect", 0x02: "tile", 0x04: "character", 0x08: "door", 0x10: "lightsaber", 0x20: "placeable", 0x40: "flyer"}
+CLASSIFICATION_IDS = dict((name, classification) for classification, name in CLASSIFICATIONS.items())
+
+# keywords of the light header and the attribute of LightHeader
+LIGHT_PROPERTIES = [
+    ("lightpriority", "light_priority"),
+    ("ambientonly", "ambient_only"),
+    ("ndynamictype", "dynamic_type"),
+    ("affectdynamic", "affect_dynamic_flag"),
+    ("shadow", "shadow_flag"),
+    ("flare", "generate_flare_flag"),
+    ("fadinglight", "fading_flag"),
+]
+
+# keywords followed by a list of rows
+LIST_KEYWORDS = {"verts", "faces", "tverts", "tverts1", "normals", "weights", "constraints"}
+
+NULL_NAME = "NULL"
+ASCII_EXTENSION = ".ascii"
+
+
+def node_type_name(node_type_id):
+    for name, bits in NODE_TYPE_NAMES:
+        if node_type_id & bits == bits:
+            return name
+    return "dummy"
+
+
+def controller_keyword(controller_type_id):
+    """Returns the ascii keyword of the controller type, i.e. "position" or "controller99" for unknown types."""
+    controller_type = CONTROLLER_TYPES.get(controller_type_id)
+    return controller_type.name.replace(" ", "") if controller_type else "controller{}".format(controller_type_id)
+
+
+CONTROLLER_IDS = dict((controller_keyword(controller_type_id), controller_type_id) for controller_type_id in CONTROLLER_TYPES)
+
+
+def controller_key(keyword):
+    """Returns (controller type, bezier) of a key list keyword like "positionkey" or "positionbezierkey", or None."""
+    for suffix, bezier in (("bezierkey", True), ("key", False)):
+        if keyword.endswith(suffix):
+            type_id = controller_id(keyword[:-len(suffix)])
+            if type_id is not None:
+                return type_id, bezier
+    return None
+
+
+def controller_id(keyword):
+    """Returns the controller type of the ascii keyword or None."""
+    if keyword in CONTROLLER_IDS:
+        return CONTROLLER_IDS[keyword]
+    if keyword.startswith("controller") and keyword[len("controller"):].isdigit():
+        return int(keyword[len("controller"):])
+    return None
+
+
+def axis_angles(quaternions):
+    """Converts (x, y, z, w) quaternions to the (x, y, z, angle) axis angle rotations of ascii models."""
+    quaternions = numpy.asarray(quaternions, dtype=numpy.float64).reshape(-1, 4)
+    length = numpy.linalg.norm(quaternions, axis=1, keepdims=True)
+    quaternions = quaternions / numpy.where(length > 0, length, 1.0)
+    w = numpy.clip(quaternions[:, 3], -1.0, 1.0)
+    sine = numpy.sqrt(numpy.maximum(1.0 - w * w, 0.0))
+    axes = numpy.where(sine[:, None] > 1e-8, quaternions[:, :3] / numpy.where(sine > 1e-8, sine, 1.0)[:, None], 0.0)
+    return numpy.column_stack([axes, 2.0 * numpy.arccos(w)])
+
+
+def axis_angle_quaternions(rotations):
+    """Converts (x, y, z, angle) axis angle rotations to (x, y, z, w) quaternions. A zero axis is no rotation."""
+    rotations = numpy.asarray(rotations, dtype=numpy.float64).reshape(-1, 4)
+    length = numpy.linalg.norm(rotations[:, :3], axis=1, keepdims=True)
+    axes = rotations[:, :3] / numpy.where(length > 0, length, 1.0)
+    half = numpy.where(length[:, 0] > 0, rotations[:, 3] / 2.0, 0.0)
+    return numpy.column_stack([axes * numpy.sin(half)[:, None], numpy.cos(half)])
+
+
+class AsciiWriter:
+
+    """
+        Writes a model as ascii mdl. Vertex, face and key lists are formatted with one string operation
+        per list, see format_rows.
+    """
+
+    def __init__(self, file, precision=7):
+        self.file = file
+        self.value = "%.{}g".format(precision)
+        # names of the model nodes by node id, the bones of skins are written by name
+        self.names = []
+
+    def values(self, count):
+        return " ".join([self.value] * count)
+
+    def write_rows(self, keyword, row_format, rows):
+        self.file.write("  {} {}\n".format(keyword, len(rows)))
+        self.file.write(format_rows("    {}\n".format(row_format), rows))
+
+    def write_property(self, keyword, *values):
+        self.file.write("  {} {}\n".format(keyword, " ".join(self.value % value if isinstance(value, float) else str(value) for value in values)))
+
+    def write_model(self, model):
+        name = model.geometry_header.name
+        model_header = model.model_header
+        self.names = model.names_header.names
+        write = self.file.write
+        write("# ascii mdl\n")
+        write("newmodel {}\n".format(name))
+        write("setsupermodel {} {}\n".format(name, model_header.super_model or NULL_NAME))
+        write("classification {}\n".format(CLASSIFICATIONS.get(model_header.classification, model_header.classification)))
+        write("setanimationscale {}\n".format(self.value % model_header.scale))
+        write("beginmodelgeom {}\n".format(name))
+        self.write_nodes(model.root_node)
+        write("endmodelgeom {}\n".format(name))
+        for animation in model.model_header.animations:
+            self.write_animation(animation, name)
+        write("donemodel {}\n".format(name))
+
+    def write_animation(self, animation, model_name):
+        name = animation.animation_name
+        write = self.file.write
+        write("newanim {} {}\n".format(name, model_name))
+        write("  length {}\n".format(self.value % animation.length))
+        write("  transtime {}\n".format(self.value % animation.transition_time))
+        # the name in the animation header is the root node of the animation
+        write("  animroot {}\n".format(animation.name or NULL_NAME))
+        for event in animation.events.data:
+            write("  event {} {}\n".format(self.value % event.time, event.name))
+        self.write_nodes(animation.animation_node)
+        write("doneanim {} {}\n".format(name, model_name))
+
+    def write_nodes(self, root):
+        # the nodes are written in pre-order, each with the name of its parent
+        parents = {id(root): NULL_NAME}
+        for node in iterate_tree(root, Node.get_childs):
+            for child in node.childs:
+                parents[id(child)] = node.name
+            self.write_node(node, parents[id(node)])
+
+    def write_node(self, node, parent_name):
+        write = self.file.write
+        headers = node.headers
+        write("node {} {}\n".format(node_type_name(node.node_type_id), node.name))
+        write("  parent {}\n".format(parent_name))
+        header = node.node_header
+        if header:
+            self.write_property("position", header.position.x, header.position.y, header.position.z)
+            rotation = axis_angles([(header.rotation.x, header.rotation.y, header.rotation.z, header.rotation.w)])[0]
+            self.write_property("orientation", *rotation.tolist())
+            for controller in header.controllers.data:
+                self.write_controller(controller)
+        if "LIGHT" in headers:
+            self.write_light(headers["LIGHT"])
+        if "MESH" in headers:
+            self.write_mesh(headers["MESH"])
+        if "SKIN" in headers and "MESH" in headers:
+            self.write_skin(headers["SKIN"])
+        if "DANGLY" in headers:
+            self.write_dangly(headers["DANGLY"])
+        write("endnode\n")
+
+    def write_controller(self, controller):
+        keyword = controller_keyword(controller.controller_type_id)
+        times = numpy.asarray(controller.times, dtype=numpy.float64).reshape(-1, 1)
+        if controller.bezier:
+            # value, in and out tangent of each key
+            values = controller.raw_values
+            keyword += "bezierkey"
+        elif controller.controller_type_id == ORIENTATION_CONTROLLER and controller.columns == 4:
+            values = axis_angles(controller.values)
+            keyword += "key"
+        else:
+            values = controller.values
+            keyword += "key"
+        rows = numpy.hstack([times, numpy.asarray(values, dtype=numpy.float64).reshape(len(times), -1)])
+        self.write_rows(keyword, self.values(rows.shape[1]), rows)
+
+    def write_light(self, light):
+        self.write_property("flareradius", float(light.flare_radius))
+        for keyword, attribute in LIGHT_PROPERTIES:
+            self.write_property(keyword, getattr(light, attribute))
+
+    def write_mesh(self, mesh):
+        self.write_property("diffuse", *[float(value) for value in mesh.diffuse])
+        self.write_property("ambient", *[float(value) for value in mesh.ambient])
+        self.write_property("transparencyhint", mesh.transparency_hint)
+        self.write_property("bitmap", mesh.texture_name or NULL_NAME)
+        if mesh.texture_name2:
+            self.write_property("bitmap2", mesh.texture_name2)
+        self.write_property("render", int(mesh.render))
+        self.write_property("shadow", int(mesh.shadow))
+        self.write_rows("verts", self.values(3), vectors(mesh.vertices))
+        faces = mesh.faces.data
+        if len(faces):
+            # the uvs are stored per vertex, so the texture indices are the vertex indices
+            indices = faces.vertex_indices.astype(numpy.int64)
+            rows = numpy.column_stack([indices, numpy.ones(len(faces), dtype=numpy.int64), indices, faces.surface.astype(numpy.int64)])
+        else:
+            rows = numpy.zeros((0, 8), dtype=numpy.int64)
+        self.write_rows("faces", " ".join(["%d"] * 8), rows)
+        if mesh.uvs is not None:
+            self.write_rows("tverts", self.values(2), mesh.uvs)
+        if mesh.uvs2 is not None:
+            self.write_rows("tverts1", self.values(2), mesh.uvs2)
+        if mesh.normals is not None:
+            self.write_rows("normals", self.values(3), mesh.normals)
+
+    def write_skin(self, skin):
+        if skin.bone_weights is None or skin.bone_indices is None:
+            return
+        names = self.names
+        node_ids = skin.bone_node_ids()
+        self.file.write("  weights {}\n".format(len(skin.bone_weights)))
+        lines = []
+        for weights, indices in zip(skin.bone_weights.tolist(), skin.bone_indices.tolist()):
+            influences = ["{} {}".format(names[node_ids[int(index)]], self.value % weight)
+                          for weight, index in zip(weights, indices) if weight > 0 and 0 <= index < len(node_ids) and node_ids[int(index)] >= 0]
+            lines.append("    {}\n".format(" ".join(influences)))
+        self.file.write("".join(lines))
+
+    def write_dangly(self, dangly):
+        self.write_property("displacement", float(dangly.displacement))
+        self.write_property("tightness", float(dangly.tightness))
+        self.write_property("period", float(dangly.period))
+        self.write_rows("constraints", self.value, numpy.asarray(dangly.constraints.data, dtype=numpy.float64).reshape(-1, 1))
+
+
+def write_ascii(file, model, precision=7):
+    """Writes the model (read with LOAD_ALL) as ascii mdl to the text file."""
+    AsciiWriter(file, precision).write_model(model)
+
+
+def export_ascii(model, filename, precision=7):
+    with open(filename, "w", buffering=WRITE_BUFFER_SIZE) as file:
+        write_ascii(file, model, precision)
+
+
+class AsciiNode:
+
+    """A node of an ascii model. Properties and lists are kept as tokens, controllers as float arrays."""
+
+    def __init__(self, node_type, name):
+        self.node_type = node_type
+        self.name = name
+        self.parent = None
+        # keyword -> list of tokens
+        self.properties = {}
+        # keyword -> list of rows (lists of tokens)
+        self.lists = {}
+        # (controller type, column count, times, values) tuples. values has the row layout of the controller data.
+        self.controllers = []
+
+    def floats(self, keyword, default):
+        values = self.properties.get(keyword)
+        return [float(value) for value in values] if values else list(default)
+
+    def number(self, keyword, default):
+        values = self.properties.get(keyword)
+        return float(values[0]) if values else default
+
+    def text(self, keyword, default=""):
+        values = self.properties.get(keyword)
+        if not values or values[0].upper() == NULL_NAME:
+            return default
+        return values[0]
+
+    def array(self, keyword, columns):
+        """Returns the rows of the list as (count, columns) float array or None if the node has no such list."""
+        rows = self.lists.get(keyword)
+        if rows is None:
+            return None
+        return numpy.array([[float(value) for value in row[:columns]] for row in rows], dtype=numpy.float64).reshape(len(rows), columns)
+
+
+class AsciiAnimation:
+
+    def __init__(self, name):
+        self.name = name
+        self.length = 0.0
+        self.transition_time = 0.0
+        self.root = ""
+        # (time, name) tuples
+        self.events = []
+        self.nodes = []
+
+
+class AsciiModel:
+
+    def __init__(self):
+        self.name = ""
+        self.super_model = NULL_NAME
+        self.classification = 0
+        self.scale = 1.0
+        self.nodes = []
+        self.animations = []
+
+
+def tokenize(lines):
+    """Returns the tokens of each line of the ascii model without comments and empty lines."""
+    for line in lines:
+        tokens = line.split("#", 1)[0].split()
+        if tokens:
+            yield tokens
+
+
+def read_rows(tokens, lines):
+    """Reads the rows of a list. The keyword is followed by the row count or the list ends with endlist."""
+    if len(tokens) > 1:
+        return [next(lines) for _ in range(int(tokens[1]))]
+    rows = []
+    for row in lines:
+        if row[0].lower() == "endlist":
+            break
+        rows.append(row)
+    return rows
+
+
+def read_controller(node, type_id, bezier, rows):
+    keys = numpy.array([[float(value) for value in row] for row in rows], dtype=numpy.float64)
+    if not len(keys):
+        return
+    times, values = keys[:, 0], keys[:, 1:]
+    if bezier:
+        column_count = values.shape[1] // 3 | BEZIER_FLAG
+    elif type_id == ORIENTATION_CONTROLLER:
+        values = axis_angle_quaternions(values)
+        column_count = 4
+    else:
+        column_count = values.shape[1]
+    node.controllers.append((type_id, column_count, times.astype('<f4'), values.astype('<f4')))
+
+
+def read_node(tokens, lines):
+    node = AsciiNode(NODE_TYPE_BITS.get(tokens[1].lower(), 0x1), tokens[2])
+    for tokens in lines:
+        keyword = tokens[0].lower()
+        if keyword == "endnode":
+            return node
+        if keyword == "parent":
+            node.parent = None if tokens[1].upper() == NULL_NAME else tokens[1]
+        elif keyword in LIST_KEYWORDS:
+            node.lists[keyword] = read_rows(tokens, lines)
+        elif controller_key(keyword):
+            type_id, bezier = controller_key(keyword)
+            read_controller(node, type_id, bezier, read_rows(tokens, lines))
+        else:
+            node.properties[keyword] = tokens[1:]
+    raise ValueError("node {} has no endnode".format(node.name))
+
+
+def read_ascii(lines):
+    """Reads an ascii model from the lines of a text file. Returns an AsciiModel."""
+    lines = tokenize(lines)
+    model = AsciiModel()
+    animation = None
+    for tokens in lines:
+        keyword = tokens[0].lower()
+        if keyword == "newmodel":
+            model.name = tokens[1]
+        elif keyword == "setsupermodel":
+            model.super_model = tokens[2] if len(tokens) > 2 else NULL_NAME
+        elif keyword == "classification":
+            value = tokens[1].lower()
+            model.classification = CLASSIFICATION_IDS[value] if value in CLASSIFICATION_IDS else int(value, 0)
+        elif keyword == "setanimationscale":
+            model.scale = float(tokens[1])
+        elif keyword == "node":
+            (animation.nodes if animation else model.nodes).append(read_node(tokens, lines))
+        elif keyword == "newanim":
+            animation = AsciiAnimation(tokens[1])
+            model.animations.append(animation)
+        elif keyword == "doneanim":
+            animation = None
+        elif animation and keyword == "length":
+            animation.length = float(tokens[1])
+        elif animation and keyword == "transtime":
+            animation.transition_time = float(tokens[1])
+        elif animation and keyword == "animroot":
+            animation.root = tokens[1]
+        elif animation and keyword == "event":
+            animation.events.append((float(tokens[1]), tokens[2]))
+        # beginmodelgeom, endmodelgeom, donemodel, filedependancy, ... carry no data
+    if not model.nodes:
+        raise ValueError("ascii model {} has no nodes".format(model.name))
+    return model
+
+
+def read_ascii_file(filename):
+    with open(filename, "r") as file:
+        return read_ascii(file)
@@ -1,14 +1,91 @@
+import hashlib
+import struct
+
+import numpy
+
 from kotor.tools import *
 
+
+# record layouts for reading whole arrays at once. the records have the same fields as the classes below.
+VERTEX = numpy.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4')])
+QUATERNION = numpy.dtype([('w', '<f4'), ('x', '<f4'), ('y', '<f4'), ('z', '<f4')])
+FACE = numpy.dtype([
+    ('plane_normal', VERTEX),
+    ('plane_distance', '<f4'),
+    ('surface', '<u4'),
+    ('adjected_faces', '<u2', (3,)),
+    ('vertex_indices', '<u2', (3,))
+])
+
+
+# precompiled structs of the classes below
+ARRAY_STRUCT = struct.Struct("<3I")
+VERTEX_STRUCT = struct.Struct("<3f")
+QUATERNION_STRUCT = struct.Struct("<4f")
+FACE_STRUCT = struct.Struct("<4fI3H3H")
+
+
+def read_records(file, dtype, count):
+    """
+        Reads count records with one read. Returns a numpy.recarray, so the fields
+        are available as attributes of the array (columns) and of each record.
+    """
+    return read_array(file, dtype, count).view(numpy.recarray)
+
+
+def strided_view(buffer, offset, stride, count, columns):
+    """
+        Returns a (count, columns) float32 array over interleaved records in the buffer without copying.
+        Record i starts at offset + i * stride.
+    """
+    if count and offset + (count - 1) * stride + columns * 4 > len(buffer):
+        raise ValueError("records at offset {} with stride {} exceed buffer of size {}".format(offset, stride, len(buffer)))
+    # an array from frombuffer holds an export of the buffer, so a memory map can't be closed under the view
+    # (numpy.ndarray on the buffer itself only keeps a reference to it)
+    data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+    return numpy.ndarray((count, columns), dtype='<f4', buffer=data, offset=offset, strides=(stride, 4))
+
+
+def empty_records(dtype):
+    return numpy.zeros(0, dtype=dtype).view(numpy.recarray)
+
+
+def vectors(records):
+    """Returns an array of vertex (or quaternion) records as float array of shape (count, 3) (or (count, 4))."""
+    return records.view('<f4').reshape(len(records), -1)
+
+
+def buffer_digest(*arrays):
+    """
+        Returns a hash of the bytes of the arrays as hex string. The dtype and shape are part of the hash, so equal
+        bytes of differently shaped arrays do not collide. None stands for a missing array.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        if array is None:
+            digest.update(b"none;")
+            continue
+        array = numpy.ascontiguousarray(array)
+        digest.update("{}{};".format(array.dtype.str, array.shape).encode("ascii"))
+        digest.update(array)
+    return digest.hexdigest()
+
+
 class Array:
     def __init__(self, file):
-        self.offset = readu32(file)
-        self.used_entries = readu32(file)
-        self.allocated_entries= readu32(file)
+        self.offset, self.used_entries, self.allocated_entries = unpack(file, ARRAY_STRUCT)
         # read later
         self.data = []
-        
-    def read_data(self,  file,  read_element_function,  block = Block("doof", 0)):
+
+    @classmethod
+    def from_values(cls, values):
+        """Creates the array from the (offset, used_entries, allocated_entries) values of an unpacked header."""
+        array = cls.__new__(cls)
+        array.offset, array.used_entries, array.allocated_entries = values
+        array.data = []
+        return array
+
+    def read_data(self,  file,  read_element_function,  block=NULL_BLOCK):
         if self.allocated_entries:
             file.seek(self.offset)
             with block:
@@ -16,17 +93,40 @@ class Array:
                 # read unused but allocated data
                 readlist(read_element_function, file, self.allocated_entries - self.used_entries)
 
+    def read_values(self, file, value_format, block=NULL_BLOCK):
+        """Reads the data as list of numbers with one unpack. value_format is a struct format character, i.e. 'I' or 'f'."""
+        if self.allocated_entries:
+            file.seek(self.offset)
+            with block:
+                values = unpack(file, struct.Struct("<{}{}".format(self.allocated_entries, value_format)))
+                self.data = list(values[:self.used_entries])
+
+    def read_array(self, file, dtype, block=NULL_BLOCK):
+        """Reads the data as (read only) numpy array with one read."""
+        if self.allocated_entries:
+            file.seek(self.offset)
+            with block:
+                self.data = read_array(file, dtype, self.allocated_entries)[:self.used_entries]
+
+    def read_records(self, file, dtype, block=NULL_BLOCK):
+        """Reads the data as numpy records, see read_records."""
+        if self.allocated_entries:
+            file.seek(self.offset)
+            with block:
+                self.data = read_records(file, dtype, self.allocated_entries)[:self.used_entries]
+
     def __serialize__(self):
         return object_attributes_to_ordered_dict(self,  ['offset', 'used_entries','allocated_entries'])
 
 
 class Face:
     def __init__(self, file):
-        self.plane_normal = Vertex(file)
-        self.plane_distance = readfloat(file)
-        self.surface = readu32(file)
-        self.adjected_faces = readlist(readu16, file, 3)
-        self.vertex_indices = readlist(readu16, file, 3)
+        values = unpack(file, FACE_STRUCT)
+        self.plane_normal = Vertex.from_values(values[0:3])
+        self.plane_distance = values[3]
+        self.surface = values[4]
+        self.adjected_faces = list(values[5:8])
+        self.vertex_indices = list(values[8:11])
 
     def __serialize__(self):
         return object_attributes_to_ordered_dict(self,  ['plane_normal', 'plane_distance', 'adjected_faces',  'vertex_indices'])
@@ -34,9 +134,13 @@ class Face:
 
 class Vertex:
     def __init__(self, file):
-        self.x = readfloat(file)
-        self.y = readfloat(file)
-        self.z = readfloat(file)
+        self.x, self.y, self.z = unpack(file, VERTEX_STRUCT)
+
+    @classmethod
+    def from_values(cls, values):
+        vertex = cls.__new__(cls)
+        vertex.x, vertex.y, vertex.z = values
+        return vertex
 
     def __serialize__(self):
         return object_attributes_to_ordered_dict(self,  ['x', 'y','z'])
@@ -44,10 +148,14 @@ class Vertex:
 
 class Quaternion:
     def __init__(self, file):
-        self.w = readfloat(file)  # real part
-        self.x = readfloat(file)  # imaginary
-        self.y = readfloat(file)  # imaginary
-        self.z = readfloat(file)  # imaginary
+        # w is the real part, x, y and z the imaginary parts
+        self.w, self.x, self.y, self.z = unpack(file, QUATERNION_STRUCT)
+
+    @classmethod
+    def from_values(cls, values):
+        quaternion = cls.__new__(cls)
+        quaternion.w, quaternion.x, quaternion.y, quaternion.z = values
+        return quaternion
 
     def __serialize__(self):
         return object_attributes_to_ordered_dict(self,  ['w','x', 'y','z'])
@@ -0,0 +1,537 @@
+import os
+
+import numpy
+
+from kotor.tools import *
+from .aabb import AABB_ENTRY_STRUCT
+from .ascii import NULL_NAME, ASCII_EXTENSION, LIGHT_PROPERTIES, axis_angle_quaternions, read_ascii
+from .base import FACE
+from .nodes import (NODE_TYPE_STRUCT, NODE_HEADER_STRUCT, CONTROLLER_STRUCT, LIGHT_HEADER_STRUCT, MESH_HEADER_STRUCT,
+                    SKIN_MESH_HEADER_STRUCT, DANGLY_MESH_HEADER_STRUCT, AABB_HEADER_STRUCT, FILE_HEADER_STRUCT,
+                    GEOMETRY_HEADER_STRUCT, MODEL_HEADER_STRUCT, ANIMATION_HEADER_STRUCT, EVENT_STRUCT, NAMES_HEADER_STRUCT)
+from .nodetable import transform_matrices, transform_points, matrix_quaternions
+
+
+# types of the geometry header
+MODEL_GEOMETRY = 2
+ANIMATION_GEOMETRY = 5
+
+# headers of the node types in the order they follow the node header, see NODE_TYPES
+HEADER_BLOCKS = [
+    ("light", 0x2, LIGHT_HEADER_STRUCT),
+    ("mesh", 0x20, MESH_HEADER_STRUCT),
+    ("skin", 0x40, SKIN_MESH_HEADER_STRUCT),
+    ("dangly", 0x100, DANGLY_MESH_HEADER_STRUCT),
+    ("aabb", 0x200, AABB_HEADER_STRUCT),
+]
+MESH_BIT = 0x20
+SKIN_BIT = 0x40
+DANGLY_BIT = 0x100
+AABB_BIT = 0x200
+
+NO_NODE = 0xFFFF
+NO_OFFSET = 0xFFFFFFFF
+# number of bone node ids in the skin header
+SKIN_BONE_NODES = 17
+
+
+def face_adjacency(indices):
+    """
+        Returns the adjacent face of each edge of the faces, a (face count, 3) array. Edge i goes from corner i
+        to corner i + 1. Edges without adjacent face have NO_NODE.
+    """
+    indices = numpy.asarray(indices, dtype=numpy.int64).reshape(-1, 3)
+    edges = numpy.stack([indices, numpy.roll(indices, -1, axis=1)], axis=-1).reshape(-1, 2)
+    keys = edges.min(axis=1) * (int(indices.max(initial=0)) + 1) + edges.max(axis=1)
+    order = numpy.argsort(keys, kind='stable')
+    shared = keys[order[1:]] == keys[order[:-1]]
+    first, second = order[:-1][shared], order[1:][shared]
+    adjacency = numpy.full(len(edges), NO_NODE, dtype=numpy.int64)
+    adjacency[first] = second // 3
+    adjacency[second] = first // 3
+    return adjacency.reshape(-1, 3)
+
+
+def face_planes(vertices, indices):
+    """Returns the normals (face count, 3) and the plane distances (face count) of the faces."""
+    triangles = numpy.asarray(vertices, dtype=numpy.float64)[indices]
+    normals = numpy.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    length = numpy.linalg.norm(normals, axis=1, keepdims=True)
+    normals = normals / numpy.where(length > 0, length, 1.0)
+    return normals, -numpy.einsum('ij,ij->i', normals, triangles[:, 0])
+
+
+def aabb_nodes(vertices, indices):
+    """
+        Builds an aabb tree over the faces, split at the median of the face centers along the longest axis.
+        Returns the nodes in pre-order as lists [minimum, maximum, left, right, face, plane] with the indices
+        of the child nodes (-1 for none). Inner nodes have face -1 and the split axis as plane (1 x, 2 y, 4 z).
+    """
+    triangles = numpy.asarray(vertices, dtype=numpy.float64)[indices]
+    if not len(triangles):
+        return [[numpy.zeros(3), numpy.zeros(3), -1, -1, -1, 0]]
+    lows = triangles.min(axis=1)
+    highs = triangles.max(axis=1)
+    centers = triangles.mean(axis=1)
+    nodes = []
+    stack = [(numpy.arange(len(triangles)), -1, 0)]
+    while stack:
+        faces, parent, side = stack.pop()
+        index = len(nodes)
+        if parent >= 0:
+            nodes[parent][2 + side] = index
+        minimum = lows[faces].min(axis=0)
+        maximum = highs[faces].max(axis=0)
+        if len(faces) == 1:
+            nodes.append([minimum, maximum, -1, -1, int(faces[0]), 0])
+            continue
+        axis = int(numpy.argmax(maximum - minimum))
+        faces = faces[numpy.argsort(centers[faces, axis], kind='stable')]
+        nodes.append([minimum, maximum, -1, -1, -1, 1 << axis])
+        half = len(faces) // 2
+        # the left half is popped first, so the nodes are in pre-order
+        stack.append((faces[half:], index, 1))
+        stack.append((faces[:half], index, 0))
+    return nodes
+
+
+class MeshData:
+
+    """
+        The arrays of a compiled mesh. The binary model stores the texture coordinates per vertex, so vertices
+        which are used with different texture coordinates are split.
+    """
+
+    def __init__(self, node, node_ids):
+        vertices = node.array("verts", 3)
+        vertices = vertices if vertices is not None else numpy.zeros((0, 3))
+        rows = [[int(value) for value in row] for row in node.lists.get("faces", [])]
+        faces = numpy.array([row[:3] + (row[4:7] if len(row) >= 8 else row[:3]) + [row[7] if len(row) >= 8 else 0] for row in rows],
+                            dtype=numpy.int64).reshape(len(rows), 7)
+        uvs = node.array("tverts", 2)
+        uvs2 = node.array("tverts1", 2)
+
+        source = numpy.arange(len(vertices))
+        uv_source = source
+        indices = faces[:, 0:3]
+        if uvs is not None and len(faces) and (len(uvs) != len(vertices) or numpy.any(faces[:, 3:6] != faces[:, 0:3])):
+            corners = numpy.stack([faces[:, 0:3].ravel(), faces[:, 3:6].ravel()], axis=1)
+            pairs, inverse = numpy.unique(corners, axis=0, return_inverse=True)
+            source, uv_source = pairs[:, 0], pairs[:, 1]
+            indices = inverse.reshape(-1, 3)
+        if len(indices) and (indices.max() >= len(source) or source.max(initial=0) >= len(vertices)):
+            raise ValueError("faces of node {} reference missing vertices".format(node.name))
+
+        self.vertices = vertices[source]
+        self.indices = indices
+        self.surfaces = faces[:, 6]
+        self.uvs = uvs[uv_source] if uvs is not None else None
+        if uvs2 is not None:
+            self.uvs2 = uvs2[uv_source] if uvs is not None and len(uvs2) == len(uvs) else uvs2[source]
+        else:
+            self.uvs2 = None
+        normals = node.array("normals", 3)
+        self.normals = normals[source] if normals is not None else None
+        constraints = node.array("constraints", 1)
+        self.constraints = constraints[source, 0] if constraints is not None else numpy.zeros(len(source))
+        self.adjacency = face_adjacency(indices)
+        self.plane_normals, self.plane_distances = face_planes(self.vertices, indices)
+
+        # skin: up to 4 bones per vertex. bone_ids are the node ids of the bones by bone index.
+        self.bone_ids = []
+        self.weights = None
+        self.bones = None
+        if "weights" in node.lists:
+            self.read_weights(node, node_ids, source)
+
+        self.diffuse = node.floats("diffuse", (0.8, 0.8, 0.8))
+        self.ambient = node.floats("ambient", (0.2, 0.2, 0.2))
+        self.transparency_hint = int(node.number("transparencyhint", 0))
+        self.texture = node.text("bitmap")
+        self.texture2 = node.text("bitmap2")
+        self.render = int(node.number("render", 1))
+        self.shadow = int(node.number("shadow", 0))
+
+    def read_weights(self, node, node_ids, source):
+        rows = node.lists["weights"]
+        weights = numpy.zeros((len(rows), 4))
+        bones = numpy.full((len(rows), 4), -1.0)
+        bone_index = {}
+        for vertex, row in enumerate(rows):
+            influences = [(float(row[i + 1]), row[i]) for i in range(0, len(row) - 1, 2)]
+            if len(influences) > 4:
+                # keep the strongest bones
+                influences = sorted(influences, key=lambda influence: -influence[0])[:4]
+            for slot, (weight, name) in enumerate(influences):
+                if name not in node_ids:
+                    raise ValueError("skin {} has unknown bone {}".format(node.name, name))
+                weights[vertex, slot] = weight
+                bones[vertex, slot] = bone_index.setdefault(node_ids[name], len(bone_index))
+        if len(rows) <= source.max(initial=-1):
+            raise ValueError("skin {} has {} weights for {} vertices".format(node.name, len(rows), len(source)))
+        self.bone_ids = list(bone_index)
+        self.weights = weights[source]
+        self.bones = bones[source]
+
+    def record_layout(self, skin):
+        """Returns the mdx record size and the offsets of normals, uvs, uvs2 and bone weights in the record."""
+        size = 12
+        offsets = {}
+        for name, columns in (("normals", 3), ("uvs", 2), ("uvs2", 2)):
+            if getattr(self, name) is not None:
+                offsets[name] = size
+                size += 4 * columns
+        if skin:
+            offsets["weights"] = size
+            offsets["bones"] = size + 16
+            size += 32
+        return size, offsets
+
+    def records(self, skin):
+        """Returns the mdx records of the vertices as float array (vertex count, record size / 4)."""
+        columns = [self.vertices]
+        for array in (self.normals, self.uvs, self.uvs2):
+            if array is not None:
+                columns.append(array)
+        if skin:
+            columns += [self.weights if self.weights is not None else numpy.zeros((len(self.vertices), 4)),
+                        self.bones if self.bones is not None else numpy.full((len(self.vertices), 4), -1.0)]
+        return numpy.hstack(columns).astype('<f4')
+
+
+class CompiledNode:
+
+    """A node of the binary model: the ascii node, its node id and the offsets of its blocks in the model data."""
+
+    def __init__(self, source):
+        self.source = source
+        self.name = source.name
+        self.node_type = source.node_type | 0x1
+        self.node_id = 0
+        self.parent = None
+        self.children = []
+        # times and values of all controllers in one float array
+        self.controller_data = numpy.concatenate([numpy.concatenate([times, values.ravel()]) for type_id, column_count, times, values
+                                                  in source.controllers]).astype('<f4') if source.controllers else numpy.zeros(0, dtype='<f4')
+        self.mesh = None
+        self.aabb = None
+        self.offsets = {}
+
+    def get_childs(self):
+        return self.children
+
+
+def node_tree(ascii_nodes):
+    """Links the ascii nodes by their parent names. Returns the CompiledNodes in pre-order."""
+    nodes = [CompiledNode(node) for node in ascii_nodes]
+    by_name = {}
+    for node in nodes:
+        by_name.setdefault(node.name, node)
+    roots = []
+    for node in nodes:
+        parent_name = node.source.parent
+        if parent_name is None:
+            roots.append(node)
+            continue
+        parent = by_name.get(parent_name)
+        if parent is None:
+            raise ValueError("node {} has unknown parent {}".format(node.name, parent_name))
+        node.parent = parent
+        parent.children.append(node)
+    if len(roots) != 1:
+        raise ValueError("expected one root node, found {}".format(len(roots)))
+    ordered = list(iterate_tree(roots[0], CompiledNode.get_childs))
+    if len(ordered) != len(nodes):
+        raise ValueError("{} nodes are not connected to the root node".format(len(nodes) - len(ordered)))
+    return ordered
+
+
+class MdlCompiler:
+
+    """
+        Compiles an AsciiModel to the content of a binary mdl and mdx file. The offsets of all blocks are
+        computed first (layout), so each block is written once at its final position into preallocated
+        buffers (write). The layout follows the one of the binary models read by kotor.model.nodes.
+        The function pointers of the geometry headers are not written.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.nodes = node_tree(model.nodes)
+        for node_id, node in enumerate(self.nodes):
+            node.node_id = node_id
+        self.names = [node.name for node in self.nodes]
+        # the first node with a name wins
+        self.node_ids = dict((name, node_id) for node_id, name in reversed(list(enumerate(self.names))))
+        self.animations = [(animation, node_tree(animation.nodes)) for animation in model.animations]
+        for animation, nodes in self.animations:
+            for node in nodes:
+                if node.name not in self.node_ids:
+                    raise ValueError("animation {} has node {} which is not in the model".format(animation.name, node.name))
+                node.node_id = self.node_ids[node.name]
+        self.world = self.rest_pose()
+        for node in self.all_nodes():
+            if node.node_type & MESH_BIT:
+                node.mesh = MeshData(node.source, self.node_ids)
+                if node.node_type & AABB_BIT:
+                    node.aabb = aabb_nodes(node.mesh.vertices, node.mesh.indices)
+        self.size = 0
+        self.mdx_size = 0
+        self.data = None
+        self.mdx = None
+
+    def all_nodes(self):
+        yield from self.nodes
+        for animation, nodes in self.animations:
+            yield from nodes
+
+    def rest_pose(self):
+        """Returns the world matrices of the model nodes."""
+        positions = [node.source.floats("position", (0.0, 0.0, 0.0)) for node in self.nodes]
+        rotations = [node.source.floats("orientation", (0.0, 0.0, 0.0, 0.0)) for node in self.nodes]
+        local = transform_matrices(positions, axis_angle_quaternions(rotations))
+        world = local.copy()
+        # parents come before their children
+        for node in self.nodes[1:]:
+            world[node.node_id] = world[node.parent.node_id] @ local[node.node_id]
+        return world
+
+    def allocate(self, size):
+        offset = self.size
+        self.size += size
+        return offset
+
+    def allocate_mdx(self, size):
+        offset = self.mdx_size
+        self.mdx_size += size
+        return offset
+
+    def compile(self):
+        """Returns the content of the mdl file and of the mdx file."""
+        self.layout()
+        self.data = bytearray(self.size)
+        self.mdx = bytearray(self.mdx_size)
+        self.write()
+        return FILE_HEADER_STRUCT.pack(self.size, self.mdx_size) + bytes(self.data), bytes(self.mdx)
+
+    def layout(self):
+        self.offsets = {"headers": self.allocate(GEOMETRY_HEADER_STRUCT.size + MODEL_HEADER_STRUCT.size + NAMES_HEADER_STRUCT.size)}
+        self.offsets["name_offsets"] = self.allocate(4 * len(self.names))
+        self.name_offsets = []
+        for name in self.names:
+            self.name_offsets.append(self.allocate(len(name.encode("utf-8")) + 1))
+        self.offsets["animation_offsets"] = self.allocate(4 * len(self.animations))
+        for node in self.nodes:
+            self.layout_node(node)
+        self.animation_offsets = []
+        for animation, nodes in self.animations:
+            self.animation_offsets.append((self.allocate(GEOMETRY_HEADER_STRUCT.size + ANIMATION_HEADER_STRUCT.size),
+                                           self.allocate(EVENT_STRUCT.size * len(animation.events))))
+            for node in nodes:
+                self.layout_node(node)
+
+    def layout_node(self, node):
+        offsets = node.offsets
+        offsets["node"] = self.allocate(NODE_TYPE_STRUCT.size + NODE_HEADER_STRUCT.size)
+        for name, bits, header_struct in HEADER_BLOCKS:
+            if node.node_type & bits:
+                offsets[name] = self.allocate(header_struct.size)
+        offsets["controllers"] = self.allocate(CONTROLLER_STRUCT.size * len(node.source.controllers))
+        offsets["controller_data"] = self.allocate(4 * len(node.controller_data))
+        mesh = node.mesh
+        if mesh:
+            vertex_count = len(mesh.vertices)
+            offsets["faces"] = self.allocate(FACE.itemsize * len(mesh.indices))
+            offsets["vertex_count"] = self.allocate(4)
+            offsets["vertices"] = self.allocate(12 * vertex_count)
+            offsets["indices"] = self.allocate(6 * len(mesh.indices))
+            offsets["vertex_offset"] = self.allocate(4)
+            record_size, record_offsets = mesh.record_layout(node.node_type & SKIN_BIT)
+            offsets["mdx"] = self.allocate_mdx(record_size * vertex_count)
+            if node.node_type & SKIN_BIT:
+                offsets["bone_map"] = self.allocate(4 * len(self.names))
+                offsets["bone_quaternions"] = self.allocate(16 * len(self.names))
+                offsets["bone_vertices"] = self.allocate(12 * len(self.names))
+            if node.node_type & DANGLY_BIT:
+                offsets["constraints"] = self.allocate(4 * vertex_count)
+                offsets["dangly_vertices"] = self.allocate(12 * vertex_count)
+        if node.aabb:
+            offsets["aabb_nodes"] = self.allocate(AABB_ENTRY_STRUCT.size * len(node.aabb))
+        offsets["children"] = self.allocate(4 * len(node.children))
+
+    def write(self):
+        model = self.model
+        root = self.nodes[0].offsets["node"]
+        offset = self.offsets["headers"]
+        GEOMETRY_HEADER_STRUCT.pack_into(self.data, offset, bytes(8), model.name.encode("utf-8"), root, len(self.nodes), bytes(28), MODEL_GEOMETRY, bytes(3))
+        offset += GEOMETRY_HEADER_STRUCT.size
+        minimum, maximum = self.bounding_box()
+        radius = float(numpy.linalg.norm(maximum - minimum)) / 2.0
+        MODEL_HEADER_STRUCT.pack_into(self.data, offset, 1, model.classification, 0, bytes(4),
+                                      self.offsets["animation_offsets"], len(self.animations), len(self.animations), bytes(4),
+                                      *minimum.tolist(), *maximum.tolist(), radius, model.scale, model.super_model.encode("utf-8"))
+        offset += MODEL_HEADER_STRUCT.size
+        NAMES_HEADER_STRUCT.pack_into(self.data, offset, root, 0, self.mdx_size, 0, self.offsets["name_offsets"], len(self.names), len(self.names))
+        self.write_array(self.offsets["name_offsets"], numpy.array(self.name_offsets, dtype='<u4'))
+        for name, name_offset in zip(self.names, self.name_offsets):
+            encoded = name.encode("utf-8")
+            self.data[name_offset:name_offset + len(encoded)] = encoded
+
+        for node in self.nodes:
+            self.write_node(node)
+        self.write_array(self.offsets["animation_offsets"], numpy.array([header for header, events in self.animation_offsets], dtype='<u4'))
+        for (animation, nodes), (header, events) in zip(self.animations, self.animation_offsets):
+            GEOMETRY_HEADER_STRUCT.pack_into(self.data, header, bytes(8), animation.name.encode("utf-8"), nodes[0].offsets["node"], len(nodes),
+                                             bytes(28), ANIMATION_GEOMETRY, bytes(3))
+            ANIMATION_HEADER_STRUCT.pack_into(self.data, header + GEOMETRY_HEADER_STRUCT.size, animation.length, animation.transition_time,
+                                              (animation.root or NULL_NAME).encode("utf-8"), events, len(animation.events), len(animation.events))
+            for index, (time, name) in enumerate(animation.events):
+                EVENT_STRUCT.pack_into(self.data, events + index * EVENT_STRUCT.size, time, name.encode("utf-8"))
+            for node in nodes:
+                self.write_node(node)
+
+    def bounding_box(self):
+        """Returns the minimum and maximum of the mesh vertices of the model in the rest pose."""
+        vertices = [transform_points(self.world[node.node_id], node.mesh.vertices) for node in self.nodes if node.mesh and len(node.mesh.vertices)]
+        if not vertices:
+            return numpy.zeros(3), numpy.zeros(3)
+        vertices = numpy.concatenate(vertices)
+        return vertices.min(axis=0), vertices.max(axis=0)
+
+    def write_array(self, offset, array):
+        data = numpy.ascontiguousarray(array).tobytes()
+        self.data[offset:offset + len(data)] = data
+
+    def write_node(self, node):
+        offsets = node.offsets
+        source = node.source
+        parent = node.parent
+        position = source.floats("position", (0.0, 0.0, 0.0))
+        x, y, z, w = axis_angle_quaternions([source.floats("orientation", (0.0, 0.0, 0.0, 0.0))])[0].tolist()
+        NODE_TYPE_STRUCT.pack_into(self.data, offsets["node"], node.node_type)
+        NODE_HEADER_STRUCT.pack_into(self.data, offsets["node"] + NODE_TYPE_STRUCT.size,
+                                     parent.node_id if parent else NO_NODE, node.node_id, bytes(6), parent.offsets["node"] if parent else 0,
+                                     *position, w, x, y, z,
+                                     offsets["children"], len(node.children), len(node.children),
+                                     offsets["controllers"], len(source.controllers), len(source.controllers),
+                                     offsets["controller_data"], len(node.controller_data), len(node.controller_data))
+        self.write_controllers(node)
+        if "light" in offsets:
+            self.write_light(node)
+        if node.mesh:
+            self.write_mesh(node)
+        if node.aabb:
+            self.write_aabb(node)
+        self.write_array(offsets["children"], numpy.array([child.offsets["node"] for child in node.children], dtype='<u4'))
+
+    def write_controllers(self, node):
+        start = 0
+        for index, (type_id, column_count, times, values) in enumerate(node.source.controllers):
+            if start + len(times) + values.size > 0xFFFF:
+                raise ValueError("controllers of node {} have more than 65535 values".format(node.name))
+            CONTROLLER_STRUCT.pack_into(self.data, node.offsets["controllers"] + index * CONTROLLER_STRUCT.size,
+                                        type_id, b"\xff\xff", len(times), start, start + len(times), column_count, bytes(3))
+            start += len(times) + values.size
+        self.write_array(node.offsets["controller_data"], node.controller_data)
+
+    def write_light(self, node):
+        source = node.source
+        flags = [int(source.number(keyword, 0)) for keyword, attribute in LIGHT_PROPERTIES]
+        LIGHT_HEADER_STRUCT.pack_into(self.data, node.offsets["light"], source.number("flareradius", 0.0), *([0] * 15), *flags)
+
+    def write_mesh(self, node):
+        offsets = node.offsets
+        mesh = node.mesh
+        skin = node.node_type & SKIN_BIT
+        vertex_count = len(mesh.vertices)
+        face_count = len(mesh.indices)
+
+        faces = numpy.zeros(face_count, dtype=FACE)
+        for axis, name in enumerate("xyz"):
+            faces['plane_normal'][name] = mesh.plane_normals[:, axis]
+        faces['plane_distance'] = mesh.plane_distances
+        faces['surface'] = mesh.surfaces
+        faces['adjected_faces'] = mesh.adjacency
+        faces['vertex_indices'] = mesh.indices
+        self.write_array(offsets["faces"], faces)
+        self.write_array(offsets["vertex_count"], numpy.array([3 * face_count], dtype='<u4'))
+        self.write_array(offsets["vertices"], mesh.vertices.astype('<f4'))
+        self.write_array(offsets["indices"], mesh.indices.astype('<u2'))
+        self.write_array(offsets["vertex_offset"], numpy.array([offsets["indices"]], dtype='<u4'))
+
+        record_size, record_offsets = mesh.record_layout(skin)
+        records = mesh.records(skin).tobytes()
+        self.mdx[offsets["mdx"]:offsets["mdx"] + len(records)] = records
+
+        if vertex_count:
+            minimum, maximum = mesh.vertices.min(axis=0), mesh.vertices.max(axis=0)
+            average = mesh.vertices.mean(axis=0)
+            radius = float(numpy.linalg.norm(mesh.vertices - average, axis=1).max())
+        else:
+            minimum = maximum = average = numpy.zeros(3)
+            radius = 0.0
+        texture_count = sum(1 for uvs in (mesh.uvs, mesh.uvs2) if uvs is not None)
+        MESH_HEADER_STRUCT.pack_into(
+            self.data, offsets["mesh"], bytes(8), offsets["faces"], face_count, face_count,
+            *minimum.tolist(), *maximum.tolist(), radius, *average.tolist(), *mesh.diffuse, *mesh.ambient, mesh.transparency_hint,
+            mesh.texture.encode("utf-8"), mesh.texture2.encode("utf-8"), bytes(24),
+            offsets["vertex_count"], 1, 1, offsets["vertex_offset"], 1, 1, 0, 0, 0, bytes(40),
+            record_size, bytes(8), record_offsets.get("normals", NO_OFFSET), bytes(4), record_offsets.get("uvs", -1), record_offsets.get("uvs2", -1),
+            bytes(24), vertex_count, texture_count, bytes(2), mesh.shadow, mesh.render, bytes(10), bytes(8), offsets["mdx"], offsets["vertices"])
+
+        if skin:
+            self.write_skin(node, record_offsets)
+        if node.node_type & DANGLY_BIT:
+            source = node.source
+            self.write_array(offsets["constraints"], mesh.constraints.astype('<f4'))
+            self.write_array(offsets["dangly_vertices"], mesh.vertices.astype('<f4'))
+            DANGLY_MESH_HEADER_STRUCT.pack_into(self.data, offsets["dangly"], offsets["constraints"], vertex_count, vertex_count,
+                                                source.number("displacement", 0.0), source.number("tightness", 0.0), source.number("period", 0.0),
+                                                offsets["dangly_vertices"])
+
+    def write_skin(self, node, record_offsets):
+        offsets = node.offsets
+        mesh = node.mesh
+        node_count = len(self.names)
+        bone_map = numpy.full(node_count, -1.0, dtype='<f4')
+        bone_map[mesh.bone_ids] = numpy.arange(len(mesh.bone_ids))
+        self.write_array(offsets["bone_map"], bone_map)
+        # transforms from the mesh into the space of each node in the rest pose, rotations as (w, x, y, z)
+        bind = numpy.linalg.inv(self.world) @ self.world[node.node_id]
+        quaternions = matrix_quaternions(bind)
+        self.write_array(offsets["bone_quaternions"], quaternions[:, [3, 0, 1, 2]].astype('<f4'))
+        self.write_array(offsets["bone_vertices"], bind[:, :3, 3].astype('<f4'))
+        bone_nodes = (mesh.bone_ids + [NO_NODE] * SKIN_BONE_NODES)[:SKIN_BONE_NODES]
+        SKIN_MESH_HEADER_STRUCT.pack_into(self.data, offsets["skin"], 0, 0, 0, record_offsets["weights"], record_offsets["bones"],
+                                          offsets["bone_map"], node_count, offsets["bone_quaternions"], node_count, node_count,
+                                          offsets["bone_vertices"], node_count, node_count, 0, 0, 0, *bone_nodes, bytes(2))
+
+    def write_aabb(self, node):
+        start = node.offsets["aabb_nodes"]
+        AABB_HEADER_STRUCT.pack_into(self.data, node.offsets["aabb"], start)
+        size = AABB_ENTRY_STRUCT.size
+        for index, (minimum, maximum, left, right, face, plane) in enumerate(node.aabb):
+            AABB_ENTRY_STRUCT.pack_into(self.data, start + index * size, *minimum.tolist(), *maximum.tolist(),
+                                        start + left * size if left >= 0 else 0, start + right * size if right >= 0 else 0, face, plane)
+
+
+def compile_ascii(lines):
+    """Compiles the lines of an ascii model. Returns the content of the mdl and the mdx file."""
+    return MdlCompiler(read_ascii(lines)).compile()
+
+
+def compile_file(filename, output=None):
+    """
+        Compiles the ascii model file to a binary mdl and mdx file. Returns the name of the mdl file.
+
+        @param output name of the mdl file. Defaults to the name of the ascii file without ".ascii" or with ".mdl".
+    """
+    if output is None:
+        output = filename[:-len(ASCII_EXTENSION)] if filename.lower().endswith(ASCII_EXTENSION) else os.path.splitext(filename)[0] + ".mdl"
+    with open(filename, "r") as file:
+        data, mdx = compile_ascii(file)
+    with open(output, "wb") as file:
+        file.write(data)
+    with open(os.path.splitext(output)[0] + ".mdx", "wb") as file:
+        file.write(mdx)
+    return output
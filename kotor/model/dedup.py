@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+    Finds meshes with the same geometry in all models of an installation. The vertex and face buffers of each mesh
+    are hashed as array bytes, meshes with the same hash are one geometry group. Many placeables and creatures
+    share their meshes, the groups show how much of the geometry is stored more than once.
+"""
+
+import argparse
+import csv
+import fnmatch
+import time
+
+from collections import OrderedDict
+
+from kotor.tools import run_tasks
+from .base import buffer_digest, vectors
+from .mdl import LOAD_GEOMETRY, load_model, read_archive_data
+from .supermodel import ModelSource
+
+
+# columns of the duplicate groups, one row per group
+COLUMNS = ["digest", "vertices", "faces", "bytes", "count", "saved_bytes", "meshes"]
+
+
+def mesh_buffers(mesh):
+    """Returns the vertex (count, 3) and face (count, 3) buffers of the mesh header."""
+    return vectors(mesh.vertices), mesh.faces.data.vertex_indices
+
+
+def mesh_digest(mesh):
+    return buffer_digest(*mesh_buffers(mesh))
+
+
+def model_geometry(model):
+    """Returns (node name, digest, vertex count, face count, bytes of the buffers) of each mesh of the model."""
+    meshes = []
+    for node in model.node_by_name.values():
+        mesh = node.headers.get("MESH")
+        if mesh is None or not mesh.vertex_count:
+            continue
+        vertices, faces = mesh_buffers(mesh)
+        meshes.append((node.name, buffer_digest(vertices, faces), len(vertices), len(faces), vertices.nbytes + faces.nbytes))
+    return meshes
+
+
+def scan_geometry(task):
+    """
+        Hashes the meshes of one model. Runs in a worker process.
+
+        @param task tuple (ressource name, mdl (path, offset, size), mdx (path, offset, size) or None)
+        @return tuple (ressource name, meshes of model_geometry or None, error message or None)
+    """
+    name, mdl_location, mdx_location = task
+    try:
+        data = read_archive_data(mdl_location)
+        mdx = read_archive_data(mdx_location) if mdx_location else None
+        return name, model_geometry(load_model(data, mdx, LOAD_GEOMETRY)), None
+    except Exception as e:
+        return name, None, "{}: {}".format(type(e).__name__, e)
+
+
+def geometry_groups(geometry):
+    """
+        Groups the meshes by their digest.
+
+        @param geometry iterable of (model name, meshes of model_geometry)
+        @return list of OrderedDict with the COLUMNS for each digest used by more than one mesh, the groups which
+                save the most bytes first. "meshes" is the list of (model name, node name).
+    """
+    groups = OrderedDict()
+    for model_name, meshes in geometry:
+        for node_name, digest, vertex_count, face_count, size in meshes:
+            group = groups.get(digest)
+            if group is None:
+                group = groups[digest] = OrderedDict([("digest", digest), ("vertices", vertex_count), ("faces", face_count),
+                                                      ("bytes", size), ("count", 0), ("saved_bytes", 0), ("meshes", [])])
+            group["meshes"].append((model_name, node_name))
+    duplicates = []
+    for group in groups.values():
+        group["meshes"].sort()
+        group["count"] = len(group["meshes"])
+        group["saved_bytes"] = group["bytes"] * (group["count"] - 1)
+        if group["count"] > 1:
+            duplicates.append(group)
+    duplicates.sort(key=lambda group: (-group["saved_bytes"], group["digest"]))
+    return duplicates
+
+
+def find_duplicate_geometry(source, jobs=None, pattern=None):
+    """
+        Hashes the meshes of the models of the ModelSource in a process pool. Returns the duplicate groups of
+        geometry_groups, the number of hashed meshes and the (name, error) tuples of the models which cannot be parsed.
+    """
+    tasks = [(name, mdl_location, mdx_location) for name, (mdl_location, mdx_location) in source.locations.items()
+             if not pattern or fnmatch.fnmatch(name, pattern)]
+    results, failed, elapsed = run_tasks(scan_geometry, tasks, jobs, chunksize=8)
+    geometry = [(name, meshes) for name, meshes, error in results]
+    failed.sort()
+    return geometry_groups(geometry), sum(len(meshes) for name, meshes in geometry), failed
+
+
+def write_csv(file, groups):
+    writer = csv.DictWriter(file, COLUMNS, lineterminator="\n")
+    writer.writeheader()
+    for group in groups:
+        row = dict(group)
+        row["meshes"] = " ".join("{}/{}".format(model_name, node_name) for model_name, node_name in group["meshes"])
+        writer.writerow(row)
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='Find meshes with the same geometry in the models of bif files and directories.')
+    parser.add_argument('--dir', action='append', dest='directories', default=[], help='directory with mdl and mdx files (can be repeated)')
+    parser.add_argument('--key', help='path to key file (i.e. chitin.key)')
+    parser.add_argument('--bif', action='append', dest='bif_files', default=[], help='bif file referenced from key file (i.e. data/models.bif, can be repeated)')
+    parser.add_argument('--filter', help='only scan models matching this pattern (i.e. "plc_*")')
+    parser.add_argument('-o', dest='output', default='duplicate_geometry.csv', help='csv file with one row per group of equal meshes (default: duplicate_geometry.csv)')
+    parser.add_argument('-j', dest='jobs', type=int, default=None, help='number of worker processes (default: number of cpus)')
+    parsed = parser.parse_args()
+
+    source = ModelSource()
+    if parsed.key:
+        source.add_bif_files(parsed.key, parsed.bif_files)
+    for directory in parsed.directories:
+        source.add_directory(directory)
+
+    start = time.perf_counter()
+    groups, mesh_count, failed = find_duplicate_geometry(source, parsed.jobs, parsed.filter)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    with open(parsed.output, "w", newline="") as file:
+        write_csv(file, groups)
+
+    print("{} meshes hashed in {:.2f}s, {} groups of equal meshes written to {}".format(mesh_count, elapsed, len(groups), parsed.output))
+    print("{} duplicate meshes, {:.2f} MB of vertex and face buffers stored more than once".format(
+        sum(group["count"] - 1 for group in groups), sum(group["saved_bytes"] for group in groups) / 1e6))
+    for group in groups[:10]:
+        print("  {:>4} x {:>6} vertices {:>6} faces: {}".format(group["count"], group["vertices"], group["faces"],
+                                                               ", ".join("{}/{}".format(*mesh) for mesh in group["meshes"][:4])))
+    for name, error in failed:
+        print("error: cannot parse {}: {}".format(name, error))
+
+
+def main():
+    parse_command_line()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import json
+import struct
+
+from collections import OrderedDict
+
+import numpy
+
+from kotor.tools import *
+from .animation import animation_tracks, TRACK_TYPES
+from .base import buffer_digest, vectors
+from .nodetable import NodeTable
+
+
+# binary gltf container: header (magic, version, length) followed by the json and the binary chunk
+GLB_HEADER_STRUCT = struct.Struct("<III")
+GLB_CHUNK_STRUCT = struct.Struct("<II")
+GLB_MAGIC = 0x46546C67
+GLB_VERSION = 2
+JSON_CHUNK = 0x4E4F534A
+BIN_CHUNK = 0x004E4942
+
+COMPONENT_TYPES = {
+    numpy.dtype('u1'): 5121,
+    numpy.dtype('<u2'): 5123,
+    numpy.dtype('<u4'): 5125,
+    numpy.dtype('<f4'): 5126,
+}
+ACCESSOR_TYPES = {1: "SCALAR", 2: "VEC2", 3: "VEC3", 4: "VEC4", 16: "MAT4"}
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+TRIANGLES = 4
+
+# the models are z up, gltf is y up. the scene root is rotated by -90 degrees around the x axis.
+Z_UP_TO_Y_UP = [-0.5 ** 0.5, 0.0, 0.0, 0.5 ** 0.5]
+ANIMATION_PATHS = {"position": "translation", "orientation": "rotation", "scale": "scale"}
+
+
+class GlbBuilder:
+
+    """
+        Collects the json document and the binary buffer of a glb file. The arrays of the binary buffer
+        are kept as they are and written one after another, so contiguous arrays are never copied.
+
+        With share the arrays are hashed and equal arrays are written once, all accessors of them use
+        the same buffer view. Meshes with the same accessors are added once, too.
+    """
+
+    def __init__(self, share=False):
+        self.document = OrderedDict()
+        self.document["asset"] = OrderedDict([("version", "2.0"), ("generator", "kotor mdl.py")])
+        self.chunks = []
+        self.length = 0
+        self.share = share
+        # accessor index by (digest, target, bounds) and mesh index by primitives
+        self.shared_accessors = {}
+        self.shared_meshes = {}
+        self.materials = {}
+
+    def add(self, key, entry):
+        """Appends the entry to the top level list key of the document and returns its index."""
+        entries = self.document.setdefault(key, [])
+        entries.append(entry)
+        return len(entries) - 1
+
+    def add_buffer_view(self, array, target=None):
+        # strided views (i.e. normals in the interleaved mdx records) are copied, everything else is referenced
+        array = numpy.ascontiguousarray(array)
+        padding = -self.length % 4
+        if padding:
+            self.chunks.append(bytes(padding))
+            self.length += padding
+        view = OrderedDict([("buffer", 0), ("byteOffset", self.length), ("byteLength", array.nbytes)])
+        if target:
+            view["target"] = target
+        self.chunks.append(array)
+        self.length += array.nbytes
+        return self.add("bufferViews", view)
+
+    def add_accessor(self, array, target=None, bounds=False):
+        """Adds the array as accessor. The rows of the array are the elements, bounds adds their minimum and maximum."""
+        array = numpy.asarray(array)
+        if self.share:
+            key = (buffer_digest(array), target, bounds)
+            if key not in self.shared_accessors:
+                self.shared_accessors[key] = self.new_accessor(array, target, bounds)
+            return self.shared_accessors[key]
+        return self.new_accessor(array, target, bounds)
+
+    def new_accessor(self, array, target, bounds):
+        count = len(array)
+        columns = int(numpy.prod(array.shape[1:], dtype=numpy.int64))
+        accessor = OrderedDict([
+            ("bufferView", self.add_buffer_view(array, target)),
+            ("componentType", COMPONENT_TYPES[array.dtype]),
+            ("count", count),
+            ("type", ACCESSOR_TYPES[columns]),
+        ])
+        if bounds and count:
+            rows = array.reshape(count, columns)
+            accessor["min"] = rows.min(axis=0).tolist()
+            accessor["max"] = rows.max(axis=0).tolist()
+        return self.add("accessors", accessor)
+
+    def add_material(self, texture_name):
+        if texture_name not in self.materials:
+            self.materials[texture_name] = self.add("materials", OrderedDict([("name", texture_name)]))
+        return self.materials[texture_name]
+
+    def add_mesh(self, name, primitives):
+        """Adds a mesh with the primitives. With share, a mesh with the same primitives is added once (with the first name)."""
+        if not self.share:
+            return self.add("meshes", OrderedDict([("name", name), ("primitives", primitives)]))
+        key = json.dumps(primitives)
+        if key not in self.shared_meshes:
+            self.shared_meshes[key] = self.add("meshes", OrderedDict([("name", name), ("primitives", primitives)]))
+        return self.shared_meshes[key]
+
+    def write(self, file):
+        if self.length:
+            self.document["buffers"] = [{"byteLength": self.length + -self.length % 4}]
+        json_data = json.dumps(self.document, separators=(",", ":")).encode("utf-8")
+        json_data += b" " * (-len(json_data) % 4)
+        binary_padding = bytes(-self.length % 4)
+        binary_length = self.length + len(binary_padding)
+        total_length = GLB_HEADER_STRUCT.size + GLB_CHUNK_STRUCT.size + len(json_data)
+        if binary_length:
+            total_length += GLB_CHUNK_STRUCT.size + binary_length
+
+        file.write(GLB_HEADER_STRUCT.pack(GLB_MAGIC, GLB_VERSION, total_length))
+        file.write(GLB_CHUNK_STRUCT.pack(len(json_data), JSON_CHUNK))
+        file.write(json_data)
+        if binary_length:
+            file.write(GLB_CHUNK_STRUCT.pack(binary_length, BIN_CHUNK))
+            for chunk in self.chunks:
+                file.write(memoryview(chunk).cast('B'))
+            file.write(binary_padding)
+
+
+class GltfExporter:
+
+    """
+        Converts a model to gltf: the node hierarchy with the rest pose, the meshes (with skins) and the position,
+        orientation and scale controllers of the animations. Vertex buffers are written from the arrays of the
+        mesh headers.
+
+        Several models are exported to one file with the same builder, each model becomes a scene. The meshes
+        are optimized with the MeshOptimizer before they are added.
+    """
+
+    def __init__(self, model, y_up=True, builder=None, optimizer=None):
+        self.model = model
+        self.y_up = y_up
+        self.optimizer = optimizer
+        self.builder = builder or GlbBuilder()
+        # index of the first node of the model in the document
+        self.node_offset = len(self.builder.document.get("nodes", []))
+        self.table = NodeTable.from_model(model)
+        self.nodes = self.table.nodes
+        self.node_index = dict((name, index + self.node_offset) for name, index in self.table.index_by_name.items())
+        self.world_matrices = self.table.world_matrices()
+
+    def export(self):
+        self.add_nodes()
+        for index, node in enumerate(self.nodes):
+            if "MESH" in node.headers:
+                self.add_mesh(index, node)
+        for animation in self.model.model_header.animations:
+            self.add_animation(animation)
+
+        scene_nodes = [self.node_offset] if self.nodes else []
+        if self.y_up and self.nodes:
+            scene_nodes = [self.builder.add("nodes", OrderedDict([("name", "z_up"), ("rotation", Z_UP_TO_Y_UP), ("children", [self.node_offset])]))]
+        self.builder.document["scene"] = 0
+        self.builder.add("scenes", OrderedDict([("name", self.model.geometry_header.name), ("nodes", scene_nodes)]))
+        return self.builder
+
+    def add_nodes(self):
+        """Adds the nodes in the order of the node table with the local transforms of the rest pose."""
+        table = self.table
+        entries = []
+        for index, node in enumerate(self.nodes):
+            entry = OrderedDict([("name", node.name)])
+            if node.node_header:
+                entry["translation"] = table.positions[index].tolist()
+                entry["rotation"] = table.rotations[index].tolist()
+            entries.append(entry)
+            self.builder.add("nodes", entry)
+        for index, parent in enumerate(table.parents.tolist()):
+            if parent >= 0:
+                entries[parent].setdefault("children", []).append(index + self.node_offset)
+
+    def add_mesh(self, index, node):
+        mesh = node.headers["MESH"]
+        faces = mesh.faces.data
+        if not mesh.vertex_count or not len(faces):
+            return
+        builder = self.builder
+        positions = vectors(mesh.vertices)
+        # the arrays of the vertices by attribute
+        vertex_data = OrderedDict()
+        if mesh.normals is not None:
+            vertex_data["NORMAL"] = mesh.normals
+        if mesh.uvs is not None:
+            # texture coordinates of gltf start at the top of the image
+            vertex_data["TEXCOORD_0"] = numpy.column_stack([mesh.uvs[:, 0], 1.0 - mesh.uvs[:, 1]]).astype('<f4')
+        skin = node.headers.get("SKIN")
+        joints = None
+        if skin is not None and skin.bone_weights is not None and skin.bone_indices is not None:
+            joints, vertex_data["JOINTS_0"], vertex_data["WEIGHTS_0"] = self.skin_vertices(index, skin)
+
+        if self.optimizer:
+            positions, indices, vertex_data = self.optimizer.optimize(node.name, positions, faces.vertex_indices, vertex_data)
+            indices = indices.astype('<u2' if len(positions) <= 0xFFFF else '<u4').reshape(-1)
+        # the vertex indices array contains the indices of all faces
+        elif len(mesh.vertex_indices) == 3 * len(faces):
+            indices = mesh.vertex_indices
+        else:
+            indices = faces.vertex_indices.astype('<u2').reshape(-1)
+
+        attributes = OrderedDict()
+        attributes["POSITION"] = builder.add_accessor(positions, ARRAY_BUFFER, bounds=True)
+        for name in ("NORMAL", "TEXCOORD_0"):
+            if name in vertex_data:
+                attributes[name] = builder.add_accessor(vertex_data[name], ARRAY_BUFFER)
+        primitive = OrderedDict([("attributes", attributes), ("indices", builder.add_accessor(indices, ELEMENT_ARRAY_BUFFER)), ("mode", TRIANGLES)])
+        if mesh.texture_name and mesh.texture_name.lower() != "null":
+            primitive["material"] = builder.add_material(mesh.texture_name)
+
+        entry = builder.document["nodes"][index + self.node_offset]
+        if joints is not None:
+            attributes["JOINTS_0"] = builder.add_accessor(vertex_data["JOINTS_0"], ARRAY_BUFFER)
+            attributes["WEIGHTS_0"] = builder.add_accessor(vertex_data["WEIGHTS_0"], ARRAY_BUFFER)
+            entry["skin"] = self.add_skin(index, joints)
+        entry["mesh"] = builder.add_mesh(node.name, [primitive])
+
+    def skin_vertices(self, index, skin):
+        """
+            Returns the joints of the skin of the mesh node and the joint indices and weights of the vertices. The
+            joints are the nodes of the bone map ordered by their bone index.
+        """
+        joints = [self.table.find_id(node_id) for node_id in skin.bone_node_ids().tolist()]
+        joints = [joint if joint >= 0 else index for joint in joints]
+        if not joints:
+            joints = [index]
+
+        bone_indices = numpy.asarray(skin.bone_indices)
+        valid = (bone_indices >= 0) & (bone_indices < len(joints))
+        weights = numpy.where(valid, skin.bone_weights, 0.0)
+        totals = weights.sum(axis=1, keepdims=True)
+        weights = numpy.where(totals > 0, weights / numpy.where(totals > 0, totals, 1.0), weights)
+        return joints, numpy.where(valid, bone_indices, 0).astype('<u2'), weights.astype('<f4')
+
+    def add_skin(self, index, joints):
+        """Adds the skin of the mesh node. The inverse bind matrices are calculated from the rest pose."""
+        world = self.world_matrices
+        inverse_binds = numpy.linalg.inv(world[joints]) @ world[index]
+        # gltf matrices are column major
+        matrices = self.builder.add_accessor(inverse_binds.transpose(0, 2, 1).astype('<f4'))
+        joints = [joint + self.node_offset for joint in joints]
+        return self.builder.add("skins", OrderedDict([("inverseBindMatrices", matrices), ("joints", joints)]))
+
+    def add_animation(self, animation):
+        builder = self.builder
+        paths = dict((controller_type, ANIMATION_PATHS[track_type]) for track_type, (controller_type, columns) in TRACK_TYPES.items())
+        samplers = []
+        channels = []
+        # controllers with the same keys share the input accessor
+        inputs = {}
+        for name, controller in animation_tracks(animation):
+            if name not in self.node_index:
+                continue
+            times = numpy.asarray(controller.times, dtype='<f4')
+            key = times.tobytes()
+            if key not in inputs:
+                inputs[key] = builder.add_accessor(times, bounds=True)
+            values = numpy.asarray(controller.values, dtype='<f4')
+            path = paths[controller.controller_type_id]
+            if path == "scale":
+                values = numpy.repeat(values[:, :1], 3, axis=1)
+            elif path == "rotation":
+                values = values / numpy.linalg.norm(values, axis=1, keepdims=True)
+            samplers.append(OrderedDict([("input", inputs[key]), ("output", builder.add_accessor(values)), ("interpolation", "LINEAR")]))
+            target = OrderedDict([("node", self.node_index[name]), ("path", path)])
+            channels.append(OrderedDict([("sampler", len(samplers) - 1), ("target", target)]))
+        if channels:
+            builder.add("animations", OrderedDict([("name", animation.animation_name), ("samplers", samplers), ("channels", channels)]))
+
+
+def write_glb(file, model, y_up=True, optimizer=None):
+    """Writes the model as binary gltf to the (binary) file."""
+    GltfExporter(model, y_up, optimizer=optimizer).export().write(file)
+
+
+def export_glb(model, filename, y_up=True, optimizer=None):
+    with open(filename, "wb") as file:
+        write_glb(file, model, y_up, optimizer)
+
+
+def write_glb_library(file, models, y_up=True, optimizer=None):
+    """
+        Writes the models to one binary gltf file, one scene per model. Buffers and meshes which are equal in
+        several models are written once.
+    """
+    builder = GlbBuilder(share=True)
+    for model in models:
+        GltfExporter(model, y_up, builder, optimizer).export()
+    builder.write(file)
+
+
+def export_glb_library(models, filename, y_up=True, optimizer=None):
+    with open(filename, "wb") as file:
+        write_glb_library(file, models, y_up, optimizer)
@@ -1,84 +1,194 @@
 #!/usr/bin/env python3
 
 import argparse
+import fnmatch
 import os
 import json
 import io
+import mmap
+import sys
 
-from functools import partial
 from collections import OrderedDict
 
+import kotor.key as key
+from kotor.cache import DiskCache, content_key, dump_objects, get_worker_cache, load_objects, open_worker_cache
 from kotor.tools import *
 from .nodes import *
+from .obj import export_obj, write_obj
+from .gltf import export_glb, export_glb_library
+from .ascii import ASCII_EXTENSION, export_ascii, write_ascii
+from .compiler import compile_file
+from .optimize import MeshOptimizer
 
-# TODO: evaluate part numbers for models with super models. @see: http://web.archive.org/web/20050213205343/torlack.com/index.html?topics=nwndata_binmdl
+# super models and the part numbers of their nodes are resolved in supermodel.py. @see: http://web.archive.org/web/20050213205343/torlack.com/index.html?topics=nwndata_binmdl
 
 # based on xoreos/src/graphics/aurora/model_kotor.cpp from https://github.com/xoreos/xoreos
 
 
-class Model:
-    pass
+# load levels of read_model_file. each level includes the previous levels.
+LOAD_HEADERS = 0  # file, geometry, model and names header
+LOAD_NAMES = 1  # node names and hierarchy. the payload of the nodes is read on first access
+LOAD_GEOMETRY = 2  # payload of all nodes: mesh data, controllers, aabb trees
+LOAD_ANIMATIONS = 3  # index of the animations. each animation is parsed on first access
+LOAD_ALL = LOAD_ANIMATIONS
 
 
-def update_node_name(names, node, depth):
-    node.name = names[node.headers["HEADER"].node_id]
+# increment when the parsed models change, so old cache entries are not used anymore
+MODEL_CACHE_VERSION = 2
 
 
-def read_model_file(filename, block):
-    def put_node_in_dict(node_by_name,  node_by_id,  node,  depth):
-        node_by_name[node.name] = node
-        node_by_id[node.headers["HEADER"].node_id] = node
-        
+class Model:
+    def __getstate__(self):
+        # the mdx buffer is not stored with a serialized model, the arrays of the meshes keep their data
+        state = dict(vars(self))
+        state["mdx"] = None
+        return state
+
+    def close(self):
+        """
+            Closes the memory map of the mdx file (see open_mdx). The nodes are released with it, the arrays of
+            their meshes are views on the map. Arrays which are still referenced elsewhere keep the map open
+            until they are freed.
+        """
+        mdx, self.mdx = self.mdx, None
+        self.root_node = None
+        self.node_by_name = OrderedDict()
+        self.node_by_id = {}
+        if isinstance(mdx, mmap.mmap):
+            try:
+                mdx.close()
+            except BufferError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def open_mdx(filename):
+    """Returns the mdx file which belongs to the mdl file as read only memory map, or None if there is no mdx file."""
+    basename = os.path.splitext(filename)[0]
+    for mdx_filename in [basename + ".mdx", basename + ".MDX"]:
+        if os.path.exists(mdx_filename):
+            with open(mdx_filename, "rb") as file:
+                if os.fstat(file.fileno()).st_size == 0:
+                    return None
+                return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return None
+
+
+def read_model_file(filename, block=NULL_BLOCK, level=LOAD_ALL, cache=None):
+    """
+        Reads a model file.
+
+        @param filename path of the mdl file. The mdx file is expected next to it.
+        @param block parent block for the data blocks read from the file. Use a Block to record a block map.
+        @param level how much of the model to read, one of the LOAD_* levels
+        @param cache DiskCache with parsed models, see load_model. Not used when a block map is recorded.
+    """
     with open(filename, "rb") as file:
-        model = Model()
-        model.header = Header(file, block)
-        
-        # read entire model data into memory
-        model_data = file.read(model.header.mdl_size)
-        # read remaining model data from byte stream
-        data_file = io.BytesIO(model_data)
+        data = file.read()
+    # vertex data (normals, uvs, bone weights) is stored in the mdx file
+    mdx = open_mdx(filename) if level >= LOAD_NAMES else None
+    if block is NULL_BLOCK:
+        return load_model(data, mdx, level, cache)
+    return read_model_data(data, mdx, block, level)
 
-        model.geometry_header = GeometryHeader(data_file, block)
-        model.model_header = ModelHeader(data_file, block)
-        model.names_header = NamesHeader(data_file, block)
-        # read animations
-        model.model_header.read_animations(data_file)
 
-        model.names_header.read_names(data_file)
-        model.root_node = read_node_tree(data_file, model.names_header.root_node, block)
-        # update names
-        visit_tree(model.root_node, Node.get_childs, partial(update_node_name, model.names_header.names))
-        # create node dictionary by name and id
-        model.node_by_name = OrderedDict()
-        model.node_by_id = {}
-        visit_tree(model.root_node, Node.get_childs, partial(put_node_in_dict, model.node_by_name, model.node_by_id))
-
-#        visit_tree(root_node, Node.get_childs, lambda node, depth : print("  "*depth, node.headers["HEADER"].node_id, node.name, hex(node.node_type_id), *[node_type.name for node_type in node.node_types]))
-
-        # export SKIN nodes
-#        export_mesh_backup([node for node in iterate_tree(root_node, Node.get_childs) if "MESH" in node.headers and "SKIN" not in node.headers], filename)
-#        export_mesh_backup([node for node in iterate_tree(root_node, Node.get_childs) if "SKIN" in node.headers], filename)
+def model_cache_key(data, mdx, level):
+    return content_key(data, mdx if mdx is not None else b"", "mdl", str(MODEL_CACHE_VERSION), str(level))
+
+
+def load_model(data, mdx, level=LOAD_ALL, cache=None):
+    """
+        Reads a model from the content of the mdl and mdx file. See read_model_data.
+
+        @param cache DiskCache with parsed models. Models found in the cache are not parsed again, their arrays
+                     are views on the cached data. Parsed models are added to the cache. Models with lazy loaded
+                     nodes (levels below LOAD_GEOMETRY) are not cached.
+    """
+    if cache is None or level < LOAD_GEOMETRY:
+        return read_model_data(data, mdx, level=level)
+
+    key = model_cache_key(data, mdx, level)
+    cached = cache.get(key)
+    if cached is not None:
+        return load_objects(cached)
+
+    model = read_model_data(data, mdx, level=level)
+    cache.put(key, dump_objects(model))
     return model
 
 
-def export_mesh_backup(nodes, filename):
-    basename = os.path.splitext(os.path.split(filename)[1])[0]
-    with open(basename+".obj", 'w') as f:
-        f.write("# OBJ file\n")
-        vertex_offset = 1
-        for node in nodes:
-            mesh = node.headers["MESH"]
-
-            f.write("o {name}\n".format(name=node.name))
-            for v in mesh.vertices:
-                f.write("v %.4f %.4f %.4f\n" % (v.x, v.y, v.z))
-            for face in mesh.faces.data:
-                f.write("f")
-                for i in face.vertex_indices:
-                    f.write(" %d" % (i + vertex_offset))
-                f.write("\n")
-            vertex_offset = vertex_offset + len(mesh.vertices)
-    print("mesh written to "+basename+".obj")
+def read_animation_index(model, data):
+    """
+        Reads the index of the animations (see LOAD_ANIMATIONS) of a model loaded at a lower level from the content
+        of its mdl file. Only the names of the nodes and the animations are read, no node and no animation is parsed.
+    """
+    model_start = FILE_HEADER_STRUCT.size
+    data_file = MemoryReader(data, model_start, model_start + model.header.mdl_size)
+    if model.level < LOAD_NAMES:
+        model.names_header.read_names(data_file)
+    model.model_header.read_animations(data_file, model.names_header.names)
+    return model.model_header.animations
+
+
+def read_model_data(data, mdx, block=NULL_BLOCK, level=LOAD_ALL, stream=False):
+    """
+        Reads a model from the content of a mdl file. All offsets in the model are relative to the
+        model data behind the file header, so the headers are decoded directly at these offsets.
+
+        @param data content of the mdl file (bytes, bytearray or mmap)
+        @param mdx content of the mdx file or None
+        @param block parent block for the data blocks read from the file. Use a Block to record a block map.
+        @param level how much of the model to read, one of the LOAD_* levels
+        @param stream read the model data through a copy in an io.BytesIO instead of decoding it in place.
+            Slower, only used to compare the parsers.
+    """
+    model = Model()
+    model.level = level
+    # the file header is recorded at its position in the file, it is the only block in front of the model data
+    header_file = MemoryReader(data)
+    block.attach(header_file)
+    model.header = Header(header_file, block)
+    model_start = FILE_HEADER_STRUCT.size
+    model_end = model_start + model.header.mdl_size
+    if stream:
+        data_file = io.BytesIO(data[model_start:model_end])
+    else:
+        data_file = MemoryReader(data, model_start, model_end)
+    # the recorded blocks are relative to the model data
+    block.attach(data_file)
+
+    model.geometry_header = GeometryHeader(data_file, block)
+    model.model_header = ModelHeader(data_file, block)
+    model.names_header = NamesHeader(data_file, block)
+    model.root_node = None
+    model.node_by_name = OrderedDict()
+    model.node_by_id = {}
+    model.mdx = None
+    if level < LOAD_NAMES:
+        return model
+
+    model.mdx = mdx
+
+    model.names_header.read_names(data_file)
+    # the index of the animations. the animations are parsed on first access.
+    if level >= LOAD_ANIMATIONS:
+        model.model_header.read_animations(data_file, model.names_header.names)
+
+    model.root_node = read_node_tree(data_file, model.names_header.root_node, block, model.mdx, lazy=level < LOAD_GEOMETRY)
+    # update names and create the node dictionaries by name and id in one pass
+    names = model.names_header.names
+    for node in iterate_tree(model.root_node, Node.get_childs):
+        node_id = node.node_header.node_id
+        node.name = names[node_id]
+        model.node_by_name[node.name] = node
+        model.node_by_id[node_id] = node
+    return model
+
 
 def export_block(args):
     block = Block("root", 0)
@@ -91,9 +201,7 @@ def export_block(args):
     print("block file written to "+basename+".blk")
 
 def export_header(args):
-    block = Block("root", 0)
-    model = read_model_file(args.input, block)
-    block.close_block(os.stat(args.input).st_size)
+    model = read_model_file(args.input, level=LOAD_HEADERS)
     json_dict = OrderedDict()
     if args.f:
         json_dict["header"] = model.header
@@ -111,7 +219,7 @@ def export_header(args):
 
 def export_nodes(args):
     def node_details(node, depth):
-        node_header = node.headers["HEADER"]
+        node_header = node.node_header
         node_json = OrderedDict()
         node_json["id"] = node_header.node_id
         node_json["name"] = node.name
@@ -119,9 +227,8 @@ def export_nodes(args):
         node_json["parent"] = node_header.parent_node
         names_tree[node_json["id"]] = node_json
 
-    block = Block("root", 0)
-    model = read_model_file(args.input, block)
-    block.close_block(os.stat(args.input).st_size)
+    # the payload of exported nodes is read on demand
+    model = read_model_file(args.input, level=LOAD_NAMES)
     
     json_dict = OrderedDict()
     if args.ln:
@@ -148,34 +255,194 @@ def export_nodes(args):
     print(json.dumps(json_dict, indent=4, cls=Encoder))
 
 
-def export_mesh(args):
-    block = Block("root", 0)
-    model = read_model_file(args.input, block)
-    block.close_block(os.stat(args.input).st_size)
+def open_cache(args):
+    if not args.cache:
+        return None
+    return DiskCache(args.cache, args.cache_size * 1024 * 1024)
 
-    if args.n:
-        nodes = [model.node_by_name.get(node_name) for node_name in args.n.split(',')  ]
+
+def add_cache_arguments(parser, defaults=True):
+    """
+        Adds --cache and --cache-size. Without defaults (on sub commands) the values given before the sub command
+        are kept if the options are not repeated after it.
+    """
+    default = {} if defaults else dict(default=argparse.SUPPRESS)
+    parser.add_argument('--cache', metavar='DIRECTORY', help='cache parsed models in this directory. Cached models are not parsed again.', **default)
+    parser.add_argument('--cache-size', type=int, help='maximum size of the model cache in MB. (default: 1024)', **(default or dict(default=1024)))
+
+
+def worker_cache_arguments(args):
+    """Returns the arguments of open_worker_cache, the pool initializer which opens the cache once per worker process."""
+    return args.cache, args.cache_size * 1024 * 1024
+
+
+def mesh_optimizer(args):
+    if not args.optimize:
+        return None
+    return MeshOptimizer(args.weld, args.vertex_cache, args.lod)
+
+
+def add_optimizer_arguments(parser):
+    parser.add_argument('--optimize', action="store_true", help='weld vertices and order faces and vertices for the vertex cache')
+    parser.add_argument('--weld', type=float, default=1e-5, help='distance below which vertices are welded (default: 0.00001)')
+    parser.add_argument('--vertex-cache', dest='vertex_cache', type=int, default=32, help='size of the vertex cache the faces are ordered for (default: 32)')
+    parser.add_argument('--lod', type=int, default=None, help='reduce the detail to a grid with this many cells along the longest side of each mesh')
+
+
+def export_mesh(args):
+    model = read_model_file(args.input, level=LOAD_GEOMETRY, cache=open_cache(args))
+    node_names = args.n.split(',') if args.n else None
+    optimizer = mesh_optimizer(args)
+    if args.output:
+        export_obj(model, args.output, node_names, optimizer=optimizer)
+        print("mesh written to " + args.output)
+    else:
+        write_obj(sys.stdout, model, node_names, optimizer=optimizer)
+    if optimizer:
+        # the obj file may be written to stdout
+        optimizer.print_statistics(sys.stdout if args.output else sys.stderr)
+
+
+def export_gltf(args):
+    cache = open_cache(args)
+    optimizer = mesh_optimizer(args)
+    output = args.output or os.path.splitext(os.path.split(args.input[0])[1])[0] + ".glb"
+    if len(args.input) == 1:
+        export_glb(read_model_file(args.input[0], cache=cache), output, y_up=not args.z_up, optimizer=optimizer)
+        print("model written to " + output)
     else:
-        nodes = list(model.node_by_name.values())
-
-    print("# OBJ file")
-    vertex_offset = 1
-    for node in nodes:
-        if node and "MESH" in node.headers:
-            mesh = node.headers["MESH"]
-
-            print("o {name}".format(name=node.name))
-            for v in mesh.vertices:
-                print("v %.4f %.4f %.4f" % (v.x, v.y, v.z))
-            for face in mesh.faces.data:
-                print("f",  end='')
-                for i in face.vertex_indices:
-                    print(" %d" % (i + vertex_offset),  end='')
-                print()
-            vertex_offset = vertex_offset + len(mesh.vertices)
-
-def parse_command_line():
+        # several models share one binary buffer, equal meshes are written once
+        models = [read_model_file(path, cache=cache) for path in args.input]
+        export_glb_library(models, output, y_up=not args.z_up, optimizer=optimizer)
+        print("{} models written to {}".format(len(models), output))
+    if optimizer:
+        optimizer.print_statistics(sys.stdout)
+
+
+def export_ascii_model(args):
+    model = read_model_file(args.input, cache=open_cache(args))
+    if args.output:
+        export_ascii(model, args.output)
+        print("ascii model written to " + args.output)
+    else:
+        write_ascii(sys.stdout, model)
+
+
+def compile_model(args):
+    output = compile_file(args.input, args.output)
+    print("model written to " + output)
+
+
+def convert_model_file(task):
+    """
+        Converts one model file to the other format: binary mdl to ascii and ascii (".ascii" files) to binary
+        mdl and mdx. Runs in a worker process, parsed models are cached in the cache of the worker (see open_worker_cache).
+
+        @param task tuple (path, output directory)
+        @return tuple (path, error message or None)
+    """
+    path, directory = task
+    name = os.path.basename(path)
+    try:
+        if name.lower().endswith(ASCII_EXTENSION):
+            output = name[:-len(ASCII_EXTENSION)]
+            if not output.lower().endswith(".mdl"):
+                output += ".mdl"
+            compile_file(path, os.path.join(directory, output))
+        else:
+            with read_model_file(path, cache=get_worker_cache()) as model:
+                export_ascii(model, os.path.join(directory, name + ASCII_EXTENSION))
+        return path, None
+    except Exception as e:
+        return path, "{}: {}".format(type(e).__name__, e)
+
+
+def model_files(paths):
+    """Returns the mdl and ascii files of the paths. Directories are searched for them (not recursive)."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for name in sorted(os.listdir(path)):
+            if name.lower().endswith((".mdl", ASCII_EXTENSION)):
+                yield os.path.join(path, name)
+
+
+def batch_convert(args):
+    directory = args.directory or os.curdir
+    os.makedirs(directory, exist_ok=True)
+    tasks = [(path, directory) for path in model_files(args.paths)]
+    results, failed, elapsed = run_tasks(convert_model_file, tasks, args.jobs,
+                                         initializer=open_worker_cache, initargs=worker_cache_arguments(args))
+
+    for path, error in failed:
+        print("error: cannot convert {}: {}".format(path, error))
+    converted = len(results)
+    print("{} models converted, {} failed in {:.2f}s ({:.1f} models/s)".format(converted, len(failed), elapsed, converted / elapsed))
+
+
+def read_archive_data(location):
+    archive_path, offset, size = location
+    with open(archive_path, 'rb') as file:
+        return b"".join(read_partial_stream(file, offset, size))
+
+
+def export_archive_model(task):
+    """
+        Exports the meshes of one model from an archive to obj. Runs in a worker process, parsed models are
+        cached in the cache of the worker (see open_worker_cache).
+
+        @param task tuple (ressource name, mdl (archive path, offset, size), mdx (archive path, offset, size) or None,
+                    output directory)
+        @return tuple (ressource name, size of mdl data, error message or None)
+    """
+    name, mdl_location, mdx_location, directory = task
+    try:
+        data = read_archive_data(mdl_location)
+        mdx = read_archive_data(mdx_location) if mdx_location else None
+        model = load_model(data, mdx, LOAD_GEOMETRY, get_worker_cache())
+        export_obj(model, os.path.join(directory, name + ".obj"))
+        return name, len(data), None
+    except Exception as e:
+        return name, mdl_location[2], "{}: {}".format(type(e).__name__, e)
+
+
+def find_bif_models(key_file, bif_files):
+    """Returns (name, mdl location, mdx location or None) for each mdl in the bif files referenced by the key file."""
+    keyFile = key.readKeyDirectory(key_file)
+    models = OrderedDict()
+    mdx_files = {}
+    for entry, bif_path, bifEntry in key.find_resources(keyFile, bif_files):
+        location = (bif_path, bifEntry.offset, bifEntry.size)
+        if entry.type.extension == 'mdl':
+            models[entry.name] = location
+        elif entry.type.extension == 'mdx':
+            mdx_files[entry.name] = location
+    for name, location in models.items():
+        yield name, location, mdx_files.get(name)
+
+
+def batch_export(args):
+    models = find_bif_models(args.key, args.bifFiles)
+    if args.filter:
+        models = (model for model in models if fnmatch.fnmatch(model[0], args.filter))
+    directory = args.directory or os.curdir
+    os.makedirs(directory, exist_ok=True)
+    tasks = [model + (directory,) for model in models]
+    results, failed, elapsed = run_tasks(export_archive_model, tasks, args.jobs,
+                                         initializer=open_worker_cache, initargs=worker_cache_arguments(args))
+    exported = len(results)
+    input_bytes = sum(size for name, size, error in results)
+
+    for name, error in failed:
+        print("error: cannot export {}: {}".format(name, error))
+    print("{} models exported, {} failed in {:.2f}s ({:.1f} models/s, {:.2f} MB/s)".format(
+        exported, len(failed), elapsed, exported / elapsed, input_bytes / elapsed / 1e6))
+
+
+def parse_command_line(argv=None):
     parser = argparse.ArgumentParser(description='Process MDL files.')
+    add_cache_arguments(parser)
     subparsers = parser.add_subparsers(help='sub-command help',  description='')
     
     parser_header = subparsers.add_parser('exportheader', help='export file header')
@@ -197,14 +464,49 @@ def parse_command_line():
     parser_mesh = subparsers.add_parser('exportmesh', help='export mesh from geometry nodes') 
     parser_mesh.add_argument('input',  help ='Model file path')
     parser_mesh.add_argument('-n',  help ='node name(s) or id(s)') 
+    parser_mesh.add_argument('-o', dest='output', help='obj file (default: write to stdout)')
+    add_optimizer_arguments(parser_mesh)
     parser_mesh.set_defaults(func=export_mesh)
 
+    parser_gltf = subparsers.add_parser('exportglb', help='export nodes, meshes, skins and animations to binary gltf')
+    parser_gltf.add_argument('input', nargs='+', help='Model file path(s). Several models are written to one file, one scene per model.')
+    parser_gltf.add_argument('-o', dest='output', help='glb file (default: basename of the first model with "glb" extension)')
+    parser_gltf.add_argument('--z-up', dest='z_up', action="store_true", help='keep the z up coordinates of the model')
+    add_optimizer_arguments(parser_gltf)
+    parser_gltf.set_defaults(func=export_gltf)
+
+    parser_ascii = subparsers.add_parser('exportascii', help='export nodes, meshes and animations to ascii mdl')
+    parser_ascii.add_argument('input',  help ='Model file path')
+    parser_ascii.add_argument('-o', dest='output', help='ascii file (default: write to stdout)')
+    parser_ascii.set_defaults(func=export_ascii_model)
+
+    parser_compile = subparsers.add_parser('compile', help='compile an ascii model to binary mdl and mdx')
+    parser_compile.add_argument('input',  help ='ascii model file path')
+    parser_compile.add_argument('-o', dest='output', help='mdl file, the mdx file is written next to it (default: input without ".ascii")')
+    parser_compile.set_defaults(func=compile_model)
+
+    parser_convert = subparsers.add_parser('batchconvert', help='convert binary models to ascii and ascii models (*.ascii) to binary')
+    parser_convert.add_argument('paths', nargs='+', help='model files or directories with model files')
+    parser_convert.add_argument('--dir', dest='directory', help='Directory where to write the converted files. Defaults to current directory.')
+    parser_convert.add_argument('-j', dest='jobs', type=int, default=None, help='number of worker processes (default: number of cpus)')
+    add_cache_arguments(parser_convert, defaults=False)
+    parser_convert.set_defaults(func=batch_convert)
+
+    parser_batch = subparsers.add_parser('batchexport', help='export meshes of all models from bif files to obj')
+    parser_batch.add_argument('key', help='path to key file (i.e. chitin.key)')
+    parser_batch.add_argument('bifFiles', nargs='+', help='bif files referenced from key file (i.e. data/models.bif)')
+    parser_batch.add_argument('--filter', help='only export models matching this pattern (i.e. "c_*")')
+    parser_batch.add_argument('--dir', dest='directory', help='Directory where to write the obj files. Defaults to current directory.')
+    parser_batch.add_argument('-j', dest='jobs', type=int, default=None, help='number of worker processes (default: number of cpus)')
+    add_cache_arguments(parser_batch, defaults=False)
+    parser_batch.set_defaults(func=batch_export)
+
     parser_blocks = subparsers.add_parser('exportblocks', help='export blocks')
     parser_blocks.add_argument('input',  help ='Model file path')
     parser_blocks.set_defaults(func=export_block)
 
 
-    parsed = parser.parse_args()
+    parsed = parser.parse_args(argv)
     if parsed.func:
         parsed.func(parsed)
 
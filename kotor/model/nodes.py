@@ -1,50 +1,142 @@
+import pickle
+import struct
+
 from collections import OrderedDict
 
+import numpy
+
+from kotor.cache import dump_objects, load_objects
 from kotor.tools import *
-from .base import Array, Vertex, Quaternion, Face
+from .aabb import read_aabb_tree
+from .base import Array, Vertex, Quaternion, VERTEX, FACE, read_records, empty_records, strided_view, vectors
+
+
+# precompiled structs of the headers. each header is decoded with one unpack.
+NODE_TYPE_STRUCT = struct.Struct("<H")
+NODE_HEADER_STRUCT = struct.Struct("<HH6sI3f4f9I")
+CONTROLLER_STRUCT = struct.Struct("<I2sHHHB3s")
+LIGHT_HEADER_STRUCT = struct.Struct("<f9I3I3I7I")
+MESH_HEADER_STRUCT = struct.Struct("<8s3I3f3ff3f3f3fI32s32s24s3I3I3I40sI8sI4sii24sHH2sHH10s8sII")
+SKIN_MESH_HEADER_STRUCT = struct.Struct("<5III3I3I3I17H2s")
+DANGLY_MESH_HEADER_STRUCT = struct.Struct("<3I3fI")
+AABB_HEADER_STRUCT = struct.Struct("<I")
+FILE_HEADER_STRUCT = struct.Struct("<4xII")
+GEOMETRY_HEADER_STRUCT = struct.Struct("<8s32sII28sB3s")
+MODEL_HEADER_STRUCT = struct.Struct("<HBB4s3I4s6fff32s")
+ANIMATION_HEADER_STRUCT = struct.Struct("<ff32s3I4x")
+EVENT_STRUCT = struct.Struct("<f32s")
+NAMES_HEADER_STRUCT = struct.Struct("<4I3I")
+# name in the geometry header of an animation
+ANIMATION_NAME_STRUCT = struct.Struct("<8x32s")
+
+# number of parsed animations an AnimationIndex keeps
+ANIMATION_CACHE_SIZE = 16
+
+
+def decode_name(data):
+    """Decodes a null terminated name from a fixed size field."""
+    return data.partition(b'\0')[0].decode("utf-8")
 
 
 class Node:
     def __init__(self, file, parent_block):
         with parent_block.block("Node.type"):
-            self.node_type_id = readu16(file)
+            self.node_type_id, = unpack(file, NODE_TYPE_STRUCT)
             self.node_types = [node_type for node_type in NODE_TYPES if node_type.matches(self.node_type_id)]
         # set later
-        self.headers = OrderedDict()  # keep insertion order
+        self._headers = OrderedDict()  # keep insertion order
+        self.node_header = None  # the NodeHeader, always read
         self.name = ""
         self.childs = []
+        # (file, mdx) while the payload of the headers is not read yet
+        self.pending_payload = None
+        # serialized headers of a deserialized node (see __reduce_ex__) until they are accessed
+        self.pending_headers = None
+
+    @property
+    def headers(self):
+        """The headers of the node types. Reading a header reads the payload of a lazy loaded node."""
+        if self.pending_payload:
+            self.read_payload(*self.pending_payload)
+        if self.pending_headers is not None:
+            self.load_headers()
+        return self._headers
+
+    def load_headers(self):
+        names, data = self.pending_headers
+        self.pending_headers = None
+        loaded = load_objects(data) if data is not None else {}
+        self._headers = OrderedDict((name, self.node_header if name == "HEADER" else loaded[name]) for name in names)
+
+    def __reduce_ex__(self, protocol):
+        """
+            Serializes the headers of the node types (all but the node header) as separate block, which is only
+            deserialized when the headers are accessed. Loading a model from the model cache creates only the
+            nodes and their node headers.
+        """
+        state = dict(vars(self))
+        headers = self.headers
+        payload = OrderedDict((name, header) for name, header in headers.items() if name != "HEADER")
+        data = dump_objects(payload) if payload else None
+        # with protocol 5 the block is stored out of band, so it is loaded without a copy
+        if data is not None and protocol >= 5:
+            data = pickle.PickleBuffer(data)
+        state["pending_headers"] = (list(headers), data)
+        state["_headers"] = None
+        state["pending_payload"] = None
+        return object.__new__, (Node,), state
+
+    def read_payload(self, file, mdx=None):
+        """Reads the content of all headers: controllers, mesh data, aabb trees, ..."""
+        self.pending_payload = None
+        for node_type_header in self._headers.values():
+            node_type_header.read_node(file)
+        if "AABB" in self._headers and "MESH" in self._headers:
+            self._headers["AABB"].read_mesh(self._headers["MESH"])
+        if mdx is not None:
+            self.read_mdx(mdx)
 
     def get_childs(self):
         return self.childs
 
+    def read_mdx(self, mdx):
+        """Creates the views on the vertex data in the mdx buffer for mesh and skin headers."""
+        mesh = self._headers.get("MESH")
+        if mesh:
+            mesh.read_mdx(mdx)
+            if "SKIN" in self._headers:
+                self._headers["SKIN"].read_mdx(mdx, mesh)
+
     def __serialize__(self):
-        return object_attributes_to_ordered_dict(self, ['node_type_id', 'node_types', 'name', 'headers'])
+        serialized = object_attributes_to_ordered_dict(self, ['node_type_id', 'node_types', 'name'])
+        serialized['headers'] = self.headers
+        return serialized
 
 
 class NodeHeader:
     def __init__(self, file, parent_block):
         self.parent_block = parent_block
         with parent_block.block("NodeHeader"):
-            self.parent_node = readu16(file)
-            self.node_id = readu16(file)
-            self.unknown = file.read(4+2)
-            self.parent_node_start = readu32(file)
-            self.position = Vertex(file)
-            self.rotation = Quaternion(file)
-            self.child_offsets = Array(file)
-            self.controllers = Array(file)
-            self.controller_data = Array(file)
+            values = unpack(file, NODE_HEADER_STRUCT)
+            self.parent_node, self.node_id, self.unknown, self.parent_node_start = values[0:4]
+            self.position = Vertex.from_values(values[4:7])
+            self.rotation = Quaternion.from_values(values[7:11])
+            self.child_offsets = Array.from_values(values[11:14])
+            self.controllers = Array.from_values(values[14:17])
+            self.controller_data = Array.from_values(values[17:20])
 
-    def read_node(self, file):
-        self.child_offsets.read_data(file, readu32, self.parent_block.block("NodeHeader.child_offsets"))
+    def read_child_offsets(self, file):
+        self.child_offsets.read_values(file, 'I', self.parent_block.block("NodeHeader.child_offsets"))
 
+    def read_node(self, file):
         if self.controllers.allocated_entries > 0:
             self.controllers.read_data(file, Controller, self.parent_block.block("Controller.array"))
-            self.controller_data.read_data(file, readfloat, self.parent_block.block("Controller.data"))
+            self.controller_data.read_array(file, '<f4', self.parent_block.block("Controller.data"))
 
             # each controller can read its values from the data array
+            controller_data = numpy.asarray(self.controller_data.data, dtype='<f4')
             for controller in self.controllers.data:
-                controller.read_data_rows(self.controller_data.data)
+                controller.read_data_rows(controller_data)
 
     def __serialize__(self):
         base_attributes = object_attributes_to_ordered_dict(self,  ['parent_node', 'node_id', 'unknown', 'parent_node_start',  'position', 'rotation', 'child_offsets', 'controllers', 'controller_data'])
@@ -63,25 +155,72 @@ class ControllerRow:
 
 class Controller:
     def __init__(self, file):
-        self.controller_type_id = readu32(file)
+        (self.controller_type_id, self.unknown1, self.row_count, self.timekey_offset, self.datakey_offset,
+         self.column_count, self.unknown2) = unpack(file, CONTROLLER_STRUCT)
         self.controller_type = CONTROLLER_TYPES.get(self.controller_type_id,  ControllerType('unknown',  self.controller_type_id))
-        self.unknown1 = file.read(2)
-        self.row_count = readu16(file)
-        self.timekey_offset = readu16(file)
-        self.datakey_offset = readu16(file)
-        self.column_count = readu8(file)
-        self.unknown2 = file.read(3)
-        # read later
-        self.rows = []
+        # read later. times is a (row_count) and values a (row_count, columns) float array
+        self.times = numpy.zeros(0, dtype='<f4')
+        self.values = numpy.zeros((0, self.columns), dtype='<f4')
+        # values of each row as stored in the controller data (including tangents and compressed quaternions)
+        self.raw_values = numpy.zeros((0, self.row_stride), dtype='<f4')
+
+    @property
+    def bezier(self):
+        """Bezier controllers store the value and two tangents for each row."""
+        return bool(self.column_count & BEZIER_FLAG)
+
+    @property
+    def compressed(self):
+        """Orientations with two columns are stored as one packed 32 bit value per row."""
+        return self.controller_type_id == ORIENTATION_CONTROLLER and self.column_count & 0x0F == 2
+
+    @property
+    def columns(self):
+        """Number of columns of values."""
+        return 4 if self.compressed else self.column_count & 0x0F
+
+    @property
+    def row_stride(self):
+        """Number of floats of one row in the controller data."""
+        if self.compressed:
+            return 1
+        return self.columns * 3 if self.bezier else self.columns
 
     def read_data_rows(self,  data):
-        for row_index in range(self.row_count):
-            start_slice = self.datakey_offset + self.column_count * row_index
-            row = ControllerRow(data[self.timekey_offset+row_index],  data[start_slice:start_slice+self.column_count])
-            self.rows.append(row)
+        """Slices the times and values of the rows from the controller data (a float array) of the node."""
+        self.times = data[self.timekey_offset:self.timekey_offset + self.row_count]
+        self.raw_values = data[self.datakey_offset:self.datakey_offset + self.row_count * self.row_stride].reshape(self.row_count, self.row_stride)
+        if self.compressed:
+            self.values = decompress_quaternions(self.raw_values[:, 0].view('<u4'))
+        else:
+            # tangents of bezier controllers are skipped
+            self.values = numpy.ascontiguousarray(self.raw_values[:, :self.columns])
+
+    @property
+    def rows(self):
+        return [ControllerRow(timekey, values) for timekey, values in zip(self.times.tolist(), self.raw_values.tolist())]
 
     def __serialize__(self):
-        return object_attributes_to_ordered_dict(self,  ['controller_type_id', 'controller_type', 'unknown1', 'row_count', 'timekey_offset',  'datakey_offset', 'column_count', 'unknown2',  'rows'])
+        serialized = object_attributes_to_ordered_dict(self,  ['controller_type_id', 'controller_type', 'unknown1', 'row_count', 'timekey_offset',  'datakey_offset', 'column_count', 'unknown2'])
+        serialized['rows'] = self.rows
+        return serialized
+
+
+def decompress_quaternions(packed):
+    """
+        Unpacks orientations stored in one 32 bit value each (11 bit x, 11 bit y, 10 bit z).
+        Returns a (count, 4) float array of (x, y, z, w) quaternions.
+    """
+    packed = numpy.asarray(packed, dtype=numpy.uint32)
+    x = 1.0 - (packed & 0x7FF) / 1023.0
+    y = 1.0 - ((packed >> 11) & 0x7FF) / 1023.0
+    z = 1.0 - (packed >> 22) / 511.0
+    length_squared = x * x + y * y + z * z
+    inside = length_squared < 1.0
+    w = numpy.where(inside, -numpy.sqrt(numpy.maximum(1.0 - length_squared, 0.0)), 0.0)
+    # vectors outside of the unit sphere are normalized and have no real part
+    scale = numpy.where(inside, 1.0, 1.0 / numpy.sqrt(numpy.maximum(length_squared, 1e-12)))
+    return numpy.stack([x * scale, y * scale, z * scale, w], axis=-1).astype('<f4')
 
 
 class LightHeader:
@@ -89,19 +228,15 @@ class LightHeader:
         self.parent_block = parent_block
         with parent_block.block("LightHeader"):
             # http://web.archive.org/web/20050213205343/torlack.com/index.html?topics=nwndata_binmdl
-            self.flare_radius = readfloat(file)
-            self.unknown_array = Array(file)
-            self.flare_sizes = Array(file)
-            self.flare_positions = Array(file)
-            self.flare_color_shifts = readlist(readu32,  file,  3)
-            self.flare_texture_names_offsets = Array(file)
-            self.light_priority = readu32(file)
-            self.ambient_only = readu32(file)
-            self.dynamic_type = readu32(file)
-            self.affect_dynamic_flag = readu32(file)
-            self.shadow_flag = readu32(file)
-            self.generate_flare_flag = readu32(file)
-            self.fading_flag = readu32(file)
+            values = unpack(file, LIGHT_HEADER_STRUCT)
+            self.flare_radius = values[0]
+            self.unknown_array = Array.from_values(values[1:4])
+            self.flare_sizes = Array.from_values(values[4:7])
+            self.flare_positions = Array.from_values(values[7:10])
+            self.flare_color_shifts = list(values[10:13])
+            self.flare_texture_names_offsets = Array.from_values(values[13:16])
+            (self.light_priority, self.ambient_only, self.dynamic_type, self.affect_dynamic_flag, self.shadow_flag,
+             self.generate_flare_flag, self.fading_flag) = values[16:23]
 
     def read_node(self, file):
         pass
@@ -114,66 +249,80 @@ class MeshHeader:
     def __init__(self, file, parent_block):
         self.parent_block = parent_block
         with parent_block.block("MeshHeader"):
-            self.unknown1 = file.read(4+4)
-            self.faces = Array(file)
-            self.bounding_box = (readlist(readfloat, file, 3), readlist(readfloat, file, 3))
-            self.radius = readfloat(file)  # radius of bounding sphere
-            self.averange = Vertex(file)  # midpoint of bounding sphere
-            self.diffuse = readlist(readfloat, file, 3)
-            self.ambient = readlist(readfloat, file, 3)
-            self.transparency_hint = readu32(file)
-            self.texture_name = file.read(32).partition(b'\0')[0].decode("utf-8")
-            self.texture_name2 = file.read(32).partition(b'\0')[0].decode("utf-8")
-            self.unknown2 = file.read(24)  # unknown
+            values = unpack(file, MESH_HEADER_STRUCT)
+            self.unknown1 = values[0]
+            self.faces = Array.from_values(values[1:4])
+            self.bounding_box = (list(values[4:7]), list(values[7:10]))
+            self.radius = values[10]  # radius of bounding sphere
+            self.averange = Vertex.from_values(values[11:14])  # midpoint of bounding sphere
+            self.diffuse = list(values[14:17])
+            self.ambient = list(values[17:20])
+            self.transparency_hint = values[20]
+            self.texture_name = decode_name(values[21])
+            self.texture_name2 = decode_name(values[22])
+            self.unknown2 = values[23]  # unknown
             # read array where the vertex counts are saved. array always has size 1.
-            self.vertex_count_array = Array(file)
+            self.vertex_count_array = Array.from_values(values[24:27])
             # read array where the vertex offsets are saved. array always has size 1.
-            self.vertex_offset_array = Array(file)
+            self.vertex_offset_array = Array.from_values(values[27:30])
             if self.vertex_count_array.used_entries != 1 or self.vertex_offset_array.used_entries != 1:
                 raise ValueError("Illegal vertex array count. Only 1 is supported at the moment.")
-            self.unknown_array = Array(file)
-            self.unknown3 = file.read(24 + 16)  # other unknown stuff
-            self.mdx_structure_size = readu32(file)
-            self.unknown4 = file.read(8)  # unknown
-            self.vertex_normals_offset = readu32(file)
-            self.unknown5 = file.read(4)  # unknown
-            self.uv_offset1 = read32(file)
-            self.uv_offset2 = read32(file)
-            self.unknown6 = file.read(24)  # unknown
-            self.vertex_count = readu16(file)
-            self.texture_count = readu16(file)
-            self.unknown7 = file.read(2)  # unknown
-            self.shadow = readu16(file) != 0
-            self.render = readu16(file) != 0
-            self.unknown8 = file.read(10)  # unknown
+            self.unknown_array = Array.from_values(values[30:33])
+            self.unknown3 = values[33]  # other unknown stuff
+            self.mdx_structure_size = values[34]
+            self.unknown4 = values[35]  # unknown
+            self.vertex_normals_offset = values[36]
+            self.unknown5 = values[37]  # unknown
+            self.uv_offset1, self.uv_offset2 = values[38:40]
+            self.unknown6 = values[40]  # unknown
+            self.vertex_count, self.texture_count = values[41:43]
+            self.unknown7 = values[43]  # unknown
+            self.shadow = values[44] != 0
+            self.render = values[45] != 0
+            self.unknown8 = values[46]  # unknown
             # if (ctx.kotor2)
-            self.unknown9 = file.read(8)  # unknown
+            self.unknown9 = values[47]  # unknown
 
-            self.mdx_offset = readu32(file)
-            self.vertex_coordinates_offset = readu32(file)
+            self.mdx_offset, self.vertex_coordinates_offset = values[48:50]
 
-        # read later
-        self.vertices = []
-        self.vertex_indices = []
+        # read later. numpy record arrays with the fields of Vertex and Face
+        self.vertices = empty_records(VERTEX)
+        self.vertex_indices = numpy.zeros(0, dtype='<u2')
+        # views on the interleaved mdx records, (vertex_count, 3) and (vertex_count, 2) float arrays. None if not in mdx.
+        self.normals = None
+        self.uvs = None
+        self.uvs2 = None
 
     def read_node(self, file):
         # read vertex count array and vertex offset array
-        self.vertex_count_array.read_data(file, readu32, self.parent_block.block("MeshHeader.vertex_count_array"))
-        self.vertex_offset_array.read_data(file, readu32, self.parent_block.block("MeshHeader.vertex_offset_array"))
+        self.vertex_count_array.read_values(file, 'I', self.parent_block.block("MeshHeader.vertex_count_array"))
+        self.vertex_offset_array.read_values(file, 'I', self.parent_block.block("MeshHeader.vertex_offset_array"))
         # note: directly after this array there is an unknown 32bit value.
 
         # read faces
-        self.faces.read_data(file, Face,  self.parent_block.block("MeshHeader.face_array"))
+        self.faces.read_records(file, FACE,  self.parent_block.block("MeshHeader.face_array"))
 
         # read vertex coordinates
         file.seek(self.vertex_coordinates_offset)
         with self.parent_block.block("MeshHeader.vertex_array"):
-            self.vertices = readlist(Vertex, file, self.vertex_count)
+            self.vertices = read_records(file, VERTEX, self.vertex_count)
 
         # read vertex indices
         file.seek(self.vertex_offset_array.data[0])
         with self.parent_block.block("MeshHeader.vertex_indices_array"):
-            self.vertex_indices = readlist(readu16, file, self.vertex_count_array.data[0])
+            self.vertex_indices = read_array(file, '<u2', self.vertex_count_array.data[0])
+
+    def read_mdx(self, mdx):
+        """
+            Creates strided views on the normals and texture coordinates of the vertices. The mdx stores one
+            record of mdx_structure_size bytes per vertex, starting at mdx_offset.
+        """
+        if self.vertex_normals_offset != 0xFFFFFFFF:
+            self.normals = strided_view(mdx, self.mdx_offset + self.vertex_normals_offset, self.mdx_structure_size, self.vertex_count, 3)
+        if self.uv_offset1 != -1:
+            self.uvs = strided_view(mdx, self.mdx_offset + self.uv_offset1, self.mdx_structure_size, self.vertex_count, 2)
+        if self.uv_offset2 != -1:
+            self.uvs2 = strided_view(mdx, self.mdx_offset + self.uv_offset2, self.mdx_structure_size, self.vertex_count, 2)
 
     def __serialize__(self):
         return object_attributes_to_ordered_dict(
@@ -188,26 +337,47 @@ class SkinMeshHeader:
     def __init__(self, file, parent_block):
         self.parent_block = parent_block
         with parent_block.block("SkinMeshHeader"):
-            self.unknown1 = readlist(readu32,  file,  5)
-            self.bone_map_offset = readu32(file)
-            self.bone_map_count = readu32(file)
-            self.bone_quaternions = Array(file)
-            self.bone_vertices = Array(file)
-            self.bone_constants = Array(file)
-            self.bone_nodes = readlist(readu16, file, 17)  # list of nodes which can affect vertices from this node
-            self.unknown2 = file.read(2)
-        # read later
+            values = unpack(file, SKIN_MESH_HEADER_STRUCT)
+            self.unknown1 = list(values[0:5])
+            # offsets of the bone weights and bone indices (4 floats each) in the mdx record of a vertex
+            self.bone_weights_offset = self.unknown1[3]
+            self.bone_indices_offset = self.unknown1[4]
+            self.bone_map_offset, self.bone_map_count = values[5:7]
+            self.bone_quaternions = Array.from_values(values[7:10])
+            self.bone_vertices = Array.from_values(values[10:13])
+            self.bone_constants = Array.from_values(values[13:16])
+            self.bone_nodes = list(values[16:33])  # list of nodes which can affect vertices from this node
+            self.unknown2 = values[33]
+        # read later. bone index of each node id, -1 for nodes which are no bones of this skin.
         self.bone_map = []
+        # views on the mdx records, (vertex_count, 4) float arrays. the bone indices are floats, -1 for unused slots.
+        self.bone_weights = None
+        self.bone_indices = None
+
+    def read_mdx(self, mdx, mesh):
+        if self.bone_weights_offset != 0xFFFFFFFF:
+            self.bone_weights = strided_view(mdx, mesh.mdx_offset + self.bone_weights_offset, mesh.mdx_structure_size, mesh.vertex_count, 4)
+        if self.bone_indices_offset != 0xFFFFFFFF:
+            self.bone_indices = strided_view(mdx, mesh.mdx_offset + self.bone_indices_offset, mesh.mdx_structure_size, mesh.vertex_count, 4)
+
+    def bone_node_ids(self):
+        """Returns the node id of each bone (the values of bone_indices) as int array, -1 for bones without node."""
+        bone_map = numpy.asarray(self.bone_map, dtype=numpy.int64).reshape(-1)
+        node_ids = numpy.full(int(bone_map.max()) + 1 if len(bone_map) else 0, -1, dtype=numpy.int64)
+        used = numpy.nonzero(bone_map >= 0)[0]
+        node_ids[bone_map[used]] = used
+        return node_ids
 
     def read_node(self, file):
         # read bone map
         file.seek(self.bone_map_offset)
         with self.parent_block.block("SkinMeshHeader.bone_map"):
-            self.bone_map = readlist(readu32, file, self.bone_map_count)
+            # the bone map is stored as float values
+            self.bone_map = read_array(file, '<f4', self.bone_map_count).astype(numpy.int64).tolist()
 
         self.bone_quaternions.read_data(file, Quaternion, self.parent_block.block("SkinMeshHeader.bone_quaternions"))
         self.bone_vertices.read_data(file, Vertex, self.parent_block.block("SkinMeshHeader.bone_vertices"))
-        self.bone_constants.read_data(file, readfloat, self.parent_block.block("SkinMeshHeader.bone_constants"))
+        self.bone_constants.read_values(file, 'f', self.parent_block.block("SkinMeshHeader.bone_constants"))
 
     def __serialize__(self):
         return object_attributes_to_ordered_dict(self,  ['unknown1', 'bone_map_offset', 'bone_map_count', 'bone_quaternions', 'bone_vertices',  'bone_constants', 'bone_nodes', 'unknown2'])
@@ -217,21 +387,19 @@ class DanglyMeshHeader:
     def __init__(self, file, parent_block):
         self.parent_block = parent_block
         with parent_block.block("DanglyMeshHeader"):
-            self.constraints = Array(file)
-            self.displacement = readfloat(file)
-            self.tightness = readfloat(file)
-            self.period = readfloat(file)
-            self.unknown_array_offset = readu32(file)
+            values = unpack(file, DANGLY_MESH_HEADER_STRUCT)
+            self.constraints = Array.from_values(values[0:3])
+            self.displacement, self.tightness, self.period, self.unknown_array_offset = values[3:7]
         # read later
         self.unknown_array = []
 
     def read_node(self, file):
-        self.constraints.read_data(file, readfloat, self.parent_block.block("DanglyMeshHeader.constraints"))
+        self.constraints.read_values(file, 'f', self.parent_block.block("DanglyMeshHeader.constraints"))
 
         # read unknown array. same size as constraints, 3 floats for each entry
         file.seek(self.unknown_array_offset)
         with self.parent_block.block("DanglyMeshHeader.unknown_array"):
-            self.unknown_array = readlist(readfloat, file, self.constraints.allocated_entries*3)
+            self.unknown_array = read_array(file, '<f4', self.constraints.allocated_entries*3).tolist()
 
     def __serialize__(self):
         base_attributes = object_attributes_to_ordered_dict(self,  ['constraints', 'displacement', 'tightness', 'period', 'unknown_array_offset',  'unknown_array'])
@@ -246,44 +414,21 @@ class AabbHeader:
     def __init__(self, file, parent_block):
         self.parent_block = parent_block
         with parent_block.block("AabbHeader"):
-            self.entry_point_offset = readu32(file)
+            self.entry_point_offset, = unpack(file, AABB_HEADER_STRUCT)
         # read later
         self.aabb_tree = None
 
     def read_node(self, file):
-        file.seek(self.entry_point_offset)
-        self.aabb_tree = AabbEntry(file,  self.parent_block)
-        self.aabb_tree.read_childs(file,  self.parent_block)
+        self.aabb_tree = read_aabb_tree(file, self.entry_point_offset, self.parent_block)
 
-    def __serialize__(self):
-        return object_attributes_to_ordered_dict(self,  ['entry_point_offset',  'aabb_tree'])
-
-
-class AabbEntry:
-    def __init__(self,  file,  parent_block):
-        with parent_block.block("AABB_Node"):
-            self.bounding_box = readlist(Vertex,  file,  2)
-            self.left_node_offset = readu32(file)
-            self.right_node_offset = readu32(file)
-            self.leaf_node_nr = read32(file)
-            self.plane = readu32(file)
-        # read later
-        self.left_node = None
-        self.right_node = None
-
-    def read_childs(self, file,  parent_block):
-        if self.left_node_offset > 0:
-            file.seek(self.left_node_offset)
-            self.left_node = AabbEntry(file,  parent_block)
-            self.left_node.read_childs(file,  parent_block)
-
-        if self.right_node_offset > 0:
-            file.seek(self.right_node_offset)
-            self.right_node = AabbEntry(file,  parent_block)
-            self.right_node.read_childs(file,  parent_block)
+    def read_mesh(self, mesh):
+        """Sets the triangles of the mesh faces for the queries of the aabb tree."""
+        faces = mesh.faces.data
+        vertex_indices = faces.vertex_indices if len(faces) else numpy.zeros((0, 3), dtype=numpy.int64)
+        self.aabb_tree.set_triangles(vectors(mesh.vertices), vertex_indices)
 
     def __serialize__(self):
-        return object_attributes_to_ordered_dict(self,  ['bounding_box',  'left_node_offset',  'right_node_offset',  'leaf_node_nr',  'left_node',  'right_node'])
+        return object_attributes_to_ordered_dict(self,  ['entry_point_offset',  'aabb_tree'])
 
 
 class NodeType:
@@ -312,9 +457,8 @@ class ControllerType:
 class Header:
     def __init__(self, file, parent_block):
         with parent_block.block("Header"):
-            file.read(4)  # skip first dword (always 0x0)
-            self.mdl_size = readu32(file)
-            self.mdx_size = readu32(file)
+            # the first dword is skipped (always 0x0)
+            self.mdl_size, self.mdx_size = unpack(file, FILE_HEADER_STRUCT)
 
     def __serialize__(self):
         return object_attributes_to_ordered_dict(self,  ['mdl_size', 'mdx_size'])
@@ -323,13 +467,9 @@ class Header:
 class GeometryHeader:
     def __init__(self, file, parent_block):
         with parent_block.block("GeometryHeader"):
-            self.function_pointers = file.read(8)
-            self.name = file.read(32).partition(b'\0')[0].decode("utf-8")
-            self.node_offset = readu32(file)
-            self.node_count = readu32(file)
-            self.unknown2 = file.read(28)  # unknown
-            self.type = readu8(file)
-            self.unknown3 = file.read(3)  # unknown
+            # unknown2 and unknown3 are unknown
+            self.function_pointers, name, self.node_offset, self.node_count, self.unknown2, self.type, self.unknown3 = unpack(file, GEOMETRY_HEADER_STRUCT)
+            self.name = decode_name(name)
 
     def __serialize__(self):
         return object_attributes_to_ordered_dict(self,  ['function_pointers', 'name', 'node_offset', 'node_count', 'unknown2', 'type', 'unknown3'])
@@ -339,28 +479,20 @@ class ModelHeader:
     def __init__(self, file, parent_block):
         self.parent_block = parent_block
         with parent_block.block("ModelHeader"):
-            self.geometry_flags = readu16(file)
-            self.classification = readu8(file)
-            self.fogged = readu8(file)
-            self.unknown1 = file.read(4)
-            self.animation_offset_array = Array(file)
-            self.unknown2 = file.read(4)  # unknown
-            self.bounding_box = readlist(Vertex, file, 2)
-            self.radius = readfloat(file)
-            self.scale = readfloat(file)
-            self.super_model = file.read(32).partition(b'\0')[0].decode("utf-8")
+            values = unpack(file, MODEL_HEADER_STRUCT)
+            self.geometry_flags, self.classification, self.fogged, self.unknown1 = values[0:4]
+            self.animation_offset_array = Array.from_values(values[4:7])
+            self.unknown2 = values[7]  # unknown
+            self.bounding_box = [Vertex.from_values(values[8:11]), Vertex.from_values(values[11:14])]
+            self.radius, self.scale = values[14:16]
+            self.super_model = decode_name(values[16])
         # read later
         self.animations = []
 
-    def read_animations(self, file):
-        self.animation_offset_array.read_data(file, readu32, self.parent_block.block("Animations.offset_array"))
-
-        for offset in self.animation_offset_array.data:
-            file.seek(offset)
-            animation_header = AnimationHeader(file, self.parent_block)
-            animation_header.read_events(file)
-            animation_header.read_animation_node(file)
-            self.animations.append(animation_header)
+    def read_animations(self, file, node_names, max_size=ANIMATION_CACHE_SIZE):
+        """Reads the index of the animations. The animations are parsed on first access, see AnimationIndex."""
+        self.animation_offset_array.read_values(file, 'I', self.parent_block.block("Animations.offset_array"))
+        self.animations = AnimationIndex(file, self.animation_offset_array.data, node_names, self.parent_block, max_size)
 
     def __serialize__(self):
         return object_attributes_to_ordered_dict(self,  ['geometry_flags', 'classification', 'fogged', 'unknown1', 'animation_offset_array', 'unknown2', 'bounding_box', 'radius', 'scale', 'super_model'])
@@ -371,15 +503,21 @@ class AnimationHeader:
         self.parent_block = parent_block
         self.geometry_header = GeometryHeader(file, parent_block)
         with parent_block.block("AnimationHeader"):
-            self.length = readfloat(file)
-            self.transition_time = readfloat(file)
-            self.name = file.read(32).partition(b'\0')[0].decode("utf-8")
-            self.events = Array(file)
-            file.read(4)  # unknown
+            # the last dword is unknown
+            values = unpack(file, ANIMATION_HEADER_STRUCT)
+            self.length, self.transition_time = values[0:2]
+            # the name in the animation header is the root node of the animation (animroot), see animation_name
+            self.name = decode_name(values[2])
+            self.events = Array.from_values(values[3:6])
 
         # read later
         self.animation_node = None
 
+    @property
+    def animation_name(self):
+        """The name of the animation is the name in its geometry header."""
+        return self.geometry_header.name
+
     def read_events(self, file):
         self.events.read_data(file, Event, self.parent_block.block("Animations.events"))
 
@@ -387,56 +525,177 @@ class AnimationHeader:
         self.animation_node = read_node_tree(file, self.geometry_header.node_offset,  self.parent_block)
 
 
+class AnimationIndex:
+
+    """
+        The animations of a model by position and name. Only the names are read up front, each animation
+        is parsed on first access. At most max_size parsed animations are kept, the least recently used
+        animation is dropped (and parsed again on its next access).
+    """
+
+    def __init__(self, file, offsets, node_names, parent_block, max_size=ANIMATION_CACHE_SIZE):
+        self.file = file
+        self.offsets = list(offsets)
+        # names of the model nodes, the nodes of the animations refer to them by node id
+        self.node_names = node_names
+        self.parent_block = parent_block
+        self.max_size = max_size
+        self.names = []
+        for offset in self.offsets:
+            file.seek(offset)
+            name, = unpack(file, ANIMATION_NAME_STRUCT)
+            self.names.append(decode_name(name))
+        # lower case name -> position. the first animation with a name wins.
+        self.positions = {}
+        for position, name in enumerate(self.names):
+            self.positions.setdefault(name.lower(), position)
+        # position -> AnimationHeader, least recently used first
+        self.loaded = OrderedDict()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        for position in range(len(self.offsets)):
+            yield self[position]
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self.offsets)
+        if not 0 <= position < len(self.offsets):
+            raise IndexError("animation index out of range: {}".format(position))
+        animation = self.loaded.get(position)
+        if animation is None:
+            animation = self.load(position)
+            self.loaded[position] = animation
+            if len(self.loaded) > self.max_size:
+                self.loaded.popitem(last=False)
+        else:
+            self.loaded.move_to_end(position)
+        return animation
+
+    def __contains__(self, name):
+        return name.lower() in self.positions
+
+    def get(self, name, default=None):
+        """Returns the animation with the (case insensitive) name."""
+        position = self.positions.get(name.lower())
+        return default if position is None else self[position]
+
+    def load(self, position):
+        file = self.file
+        file.seek(self.offsets[position])
+        animation = AnimationHeader(file, self.parent_block)
+        animation.read_events(file)
+        animation.read_animation_node(file)
+        for node in iterate_tree(animation.animation_node, Node.get_childs):
+            node.name = self.node_names[node.node_header.node_id]
+        return animation
+
+    def model_data(self):
+        """Returns the model data the animations are parsed from."""
+        file = self.file
+        if isinstance(file, MemoryReader):
+            return file.buffer[file.start:file.end]
+        return file.getbuffer()
+
+    def __reduce_ex__(self, protocol):
+        """
+            Serialized indices keep the model data instead of parsed animations, so the animations of a model
+            loaded from a cache are parsed on first access too.
+        """
+        state = dict(vars(self))
+        state["loaded"] = OrderedDict()
+        data = self.model_data()
+        # with protocol 5 the model data is stored out of band, so it is loaded without a copy
+        state["file"] = pickle.PickleBuffer(data) if protocol >= 5 else bytes(data)
+        return object.__new__, (AnimationIndex,), state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.file = MemoryReader(self.file)
+
+
 class Event:
     def __init__(self, file):
-        self.time = readfloat(file)
-        self.name = file.read(32).partition(b'\0')[0].decode("utf-8")
+        self.time, name = unpack(file, EVENT_STRUCT)
+        self.name = decode_name(name)
 
 
 class NamesHeader:
     def __init__(self, file, parent_block):
         self.parent_block = parent_block
         with parent_block.block("NamesHeader", file):
-            self.root_node = readu32(file)
-            self.unknown1 = readu32(file)
-            self.mdx_size = readu32(file)
-            self.unknown2 = readu32(file)
-            self.names_offset_array = Array(file)
+            values = unpack(file, NAMES_HEADER_STRUCT)
+            self.root_node, self.unknown1, self.mdx_size, self.unknown2 = values[0:4]
+            self.names_offset_array = Array.from_values(values[4:7])
 
     def read_names(self, file):
         # seek to start of names offset table
-        self.names_offset_array.read_data(file, readu32, self.parent_block.block("Names.offset_array"))
+        self.names_offset_array.read_values(file, 'I', self.parent_block.block("Names.offset_array"))
 
         self.names = []
+        # a MemoryReader finds the end of each name in its buffer, other files are read byte by byte
+        read_terminated = getattr(file, "read_terminated", None)
         with self.parent_block.start_block("Names", self.names_offset_array.data[0]):
             for name_offset in self.names_offset_array.data:
-                file.seek(name_offset)
-                self.names.append(next(read_terminated_token(file, null_terminated)).decode("utf-8"))
+                if read_terminated:
+                    name = read_terminated(name_offset)
+                    file.seek(name_offset + len(name) + 1)
+                else:
+                    file.seek(name_offset)
+                    name = next(read_terminated_token(file, null_terminated))
+                self.names.append(name.decode("utf-8"))
 
     def __serialize__(self):
         return object_attributes_to_ordered_dict(self,  ['root_node', 'unknown1', 'mdx_size', 'unknown2', 'names_offset_array'])
 
 
-def read_node_tree(file, node_offset, parent_block):
+def read_node(file, node_offset, parent_block, mdx=None, lazy=False):
+    """Reads the node at node_offset without its child nodes."""
     file.seek(node_offset)
     node = Node(file, parent_block)
     # read header
     for node_type in node.node_types:
         if node_type.header_type:
             node_type_header = node_type.header_type(file, parent_block)
-            node.headers[node_type.name] = node_type_header
+            node._headers[node_type.name] = node_type_header
+    node.node_header = node._headers.get("HEADER")
 
     # read content of node type
-    for name, node_type_header in node.headers.items():
-        node_type_header.read_node(file)
-
-    # read child nodes
-    if "HEADER" in node.headers:
-        for child_offset in node.headers["HEADER"].child_offsets.data:
-            node.childs.append(read_node_tree(file, child_offset, parent_block))
+    if node.node_header:
+        node.node_header.read_child_offsets(file)
+    if lazy:
+        node.pending_payload = (file, mdx)
+    else:
+        node.read_payload(file, mdx)
     return node
 
 
+def read_node_tree(file, node_offset, parent_block, mdx=None, lazy=False):
+    """
+        Reads the node at node_offset and all its child nodes. The nodes are read in pre-order with an explicit
+        stack, so deep hierarchies don't hit the recursion limit.
+
+        @param mdx buffer with the vertex data of the meshes (optional)
+        @param lazy only read the headers and the hierarchy. The payload of a node is read on first access of node.headers.
+    """
+    root = read_node(file, node_offset, parent_block, mdx, lazy)
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.node_header:
+            node.childs = [read_node(file, child_offset, parent_block, mdx, lazy) for child_offset in node.node_header.child_offsets.data]
+            stack.extend(reversed(node.childs))
+    return root
+
+
+POSITION_CONTROLLER = 8
+ORIENTATION_CONTROLLER = 20
+SCALE_CONTROLLER = 36
+# set in the column count of controllers with bezier keys
+BEZIER_FLAG = 0x10
+
 NODE_TYPES = [
     NodeType("HEADER", 0x00000001, NodeHeader),
     NodeType("LIGHT", 0x00000002, LightHeader),
@@ -0,0 +1,146 @@
+import numpy
+
+from .nodes import NODE_TYPES
+
+
+def quaternion_matrices(rotations):
+    """Returns the rotation matrices of the (x, y, z, w) quaternions in the rows of rotations, an array of shape (n, 3, 3)."""
+    rotations = numpy.asarray(rotations, dtype=numpy.float64)
+    rotations = rotations / numpy.linalg.norm(rotations, axis=-1, keepdims=True)
+    x, y, z, w = rotations[..., 0], rotations[..., 1], rotations[..., 2], rotations[..., 3]
+    return numpy.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w),
+        2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w),
+        2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y),
+    ], axis=-1).reshape(rotations.shape[:-1] + (3, 3))
+
+
+def matrix_quaternions(matrices):
+    """Returns the (x, y, z, w) quaternions of the rotations in the matrices (n, 3, 3) or (n, 4, 4), the inverse of quaternion_matrices."""
+    m = numpy.asarray(matrices, dtype=numpy.float64)[..., :3, :3]
+    trace = m[..., 0, 0] + m[..., 1, 1] + m[..., 2, 2]
+    # each candidate is the quaternion scaled by one of its components. the one of the largest component is stable.
+    candidates = numpy.stack([
+        numpy.stack([m[..., 2, 1] - m[..., 1, 2], m[..., 0, 2] - m[..., 2, 0], m[..., 1, 0] - m[..., 0, 1], 1 + trace], axis=-1),
+        numpy.stack([1 + m[..., 0, 0] - m[..., 1, 1] - m[..., 2, 2], m[..., 0, 1] + m[..., 1, 0], m[..., 0, 2] + m[..., 2, 0], m[..., 2, 1] - m[..., 1, 2]], axis=-1),
+        numpy.stack([m[..., 0, 1] + m[..., 1, 0], 1 + m[..., 1, 1] - m[..., 0, 0] - m[..., 2, 2], m[..., 1, 2] + m[..., 2, 1], m[..., 0, 2] - m[..., 2, 0]], axis=-1),
+        numpy.stack([m[..., 0, 2] + m[..., 2, 0], m[..., 1, 2] + m[..., 2, 1], 1 + m[..., 2, 2] - m[..., 0, 0] - m[..., 1, 1], m[..., 1, 0] - m[..., 0, 1]], axis=-1),
+    ], axis=-2)
+    largest = numpy.argmax(numpy.stack([trace, m[..., 0, 0], m[..., 1, 1], m[..., 2, 2]], axis=-1), axis=-1)
+    quaternions = numpy.take_along_axis(candidates, largest[..., None, None], axis=-2)[..., 0, :]
+    quaternions /= numpy.linalg.norm(quaternions, axis=-1, keepdims=True)
+    # w >= 0
+    return numpy.where(quaternions[..., 3:] < 0, -quaternions, quaternions)
+
+
+def transform_matrices(positions, rotations, scales=None):
+    """Returns the 4x4 matrices which scale, rotate and translate, an array of shape (n, 4, 4)."""
+    positions = numpy.asarray(positions, dtype=numpy.float64)
+    matrices = numpy.zeros(positions.shape[:-1] + (4, 4))
+    matrices[..., :3, :3] = quaternion_matrices(rotations)
+    if scales is not None:
+        matrices[..., :3, :3] *= numpy.asarray(scales, dtype=numpy.float64)[..., None, None]
+    matrices[..., :3, 3] = positions
+    matrices[..., 3, 3] = 1.0
+    return matrices
+
+
+def transform_points(matrices, points):
+    """Transforms the points (n, 3) with the matrices (n, 4, 4) or with one matrix (4, 4)."""
+    return numpy.einsum('...ij,...j->...i', matrices[..., :3, :3], points) + matrices[..., :3, 3]
+
+
+# bitfields of the node types by name
+NODE_TYPE_MASKS = dict((node_type.name, node_type.bitfield) for node_type in NODE_TYPES)
+
+
+class NodeTable:
+
+    """
+        The nodes of a node tree as flat arrays in pre-order: parent index, depth, node id, type bitfield and the
+        local position and rotation (x, y, z, w) of the rest pose. Parents come before their children, so the world
+        transforms are composed in one pass over the depths with a batched matrix product for all nodes of a depth.
+    """
+
+    def __init__(self, root_node):
+        self.nodes = []
+        parents = []
+        depths = []
+        stack = [(root_node, -1, 0)] if root_node is not None else []
+        while stack:
+            node, parent, depth = stack.pop()
+            parents.append(parent)
+            depths.append(depth)
+            index = len(self.nodes)
+            self.nodes.append(node)
+            stack.extend((child, index, depth + 1) for child in reversed(node.childs))
+        count = len(self.nodes)
+        self.parents = numpy.array(parents, dtype=numpy.int64).reshape(count)
+        self.depths = numpy.array(depths, dtype=numpy.int64).reshape(count)
+        self.names = [node.name for node in self.nodes]
+        self.node_ids = numpy.full(count, -1, dtype=numpy.int64)
+        self.node_types = numpy.array([node.node_type_id for node in self.nodes], dtype=numpy.uint32).reshape(count)
+        self.positions = numpy.zeros((count, 3))
+        self.rotations = numpy.tile([0.0, 0.0, 0.0, 1.0], (count, 1))
+        for index, node in enumerate(self.nodes):
+            header = node.node_header
+            if header:
+                self.node_ids[index] = header.node_id
+                self.positions[index] = (header.position.x, header.position.y, header.position.z)
+                self.rotations[index] = (header.rotation.x, header.rotation.y, header.rotation.z, header.rotation.w)
+        # node indices of each depth below the root
+        self.levels = [numpy.nonzero(self.depths == depth)[0] for depth in range(1, int(self.depths.max()) + 1)] if count else []
+        self.index_by_name = dict((name, index) for index, name in reversed(list(enumerate(self.names))))
+        self.index_by_id = dict((node_id, index) for index, node_id in enumerate(self.node_ids.tolist()) if node_id >= 0)
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(model.root_node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def find(self, name):
+        """Returns the index of the node with the name or -1."""
+        return self.index_by_name.get(name, -1)
+
+    def find_id(self, node_id):
+        """Returns the index of the node with the node id (part number) or -1."""
+        return self.index_by_id.get(node_id, -1)
+
+    def with_types(self, mask):
+        """
+            Returns the indices of the nodes which have any of the types in the mask. The mask is a bitfield or
+            a node type name (i.e. "MESH").
+        """
+        if isinstance(mask, str):
+            mask = NODE_TYPE_MASKS[mask]
+        return numpy.nonzero(self.node_types & mask)[0]
+
+    def children(self, index):
+        return numpy.nonzero(self.parents == index)[0]
+
+    def local_matrices(self, positions=None, rotations=None, scales=None):
+        """Returns the local matrices of the nodes. Positions and rotations default to the rest pose."""
+        return transform_matrices(self.positions if positions is None else positions,
+                                  self.rotations if rotations is None else rotations, scales)
+
+    def compose(self, local, root=None):
+        """
+            Returns the world matrices for the local matrices of the nodes.
+
+            @param root matrix which places the root node, i.e. the position of a room model in an area
+        """
+        world = numpy.array(local, dtype=numpy.float64)
+        if root is not None and len(world):
+            world[0] = numpy.asarray(root, dtype=numpy.float64) @ world[0]
+        for level in self.levels:
+            world[level] = world[self.parents[level]] @ world[level]
+        return world
+
+    def world_matrices(self, root=None):
+        """Returns the world matrices of the rest pose, an array of shape (node count, 4, 4)."""
+        return self.compose(self.local_matrices(), root)
+
+    def world_positions(self, root=None):
+        return self.world_matrices(root)[:, :3, 3]
@@ -0,0 +1,103 @@
+from collections import OrderedDict
+
+import numpy
+
+from kotor.tools import *
+from .base import vectors
+
+
+# size of the write buffer of exported obj files
+WRITE_BUFFER_SIZE = 1 << 20
+# face vertex formats of obj: v, v/vt, v//vn and v/vt/vn. indexed by (has uvs, has normals)
+FACE_VERTEX_FORMATS = {
+    (False, False): "%d",
+    (True, False): "%d/%d",
+    (False, True): "%d//%d",
+    (True, True): "%d/%d/%d",
+}
+
+
+def format_rows(row_format, array):
+    """
+        Formats all rows of the array with one string formatting operation: the row format is repeated
+        for each row and applied to the flattened array.
+    """
+    array = numpy.asarray(array)
+    if not len(array):
+        return ""
+    return (row_format * len(array)) % tuple(array.ravel().tolist())
+
+
+class ObjWriter:
+
+    """
+        Writes meshes to an obj file. The indices of vertices, uvs and normals are counted separately,
+        because not every mesh has uvs and normals. The meshes are optimized with the MeshOptimizer before
+        they are written.
+    """
+
+    def __init__(self, file, precision=4, optimizer=None):
+        self.file = file
+        self.precision = precision
+        self.optimizer = optimizer
+        self.vertex_offset = 1
+        self.uv_offset = 1
+        self.normal_offset = 1
+        file.write("# OBJ file\n")
+
+    def write_mesh(self, name, mesh):
+        vertices = vectors(mesh.vertices)
+        indices = mesh.faces.data.vertex_indices
+        uvs, normals = mesh.uvs, mesh.normals
+        if self.optimizer:
+            attributes = OrderedDict((key, values) for key, values in (("uvs", uvs), ("normals", normals)) if values is not None)
+            vertices, indices, attributes = self.optimizer.optimize(name, vertices, indices, attributes)
+            uvs, normals = attributes.get("uvs"), attributes.get("normals")
+        self.write_buffers(name, vertices, indices, uvs, normals)
+
+    def write_buffers(self, name, vertices, indices, uvs=None, normals=None):
+        """Writes a mesh from the vertices (count, 3), the faces (count, 3) and the uvs and normals of the vertices."""
+        value = "%.{}f".format(self.precision)
+        write = self.file.write
+        write("o {}\n".format(name))
+        write(format_rows("v {0} {0} {0}\n".format(value), vertices))
+
+        references = [self.vertex_offset]
+        if uvs is not None:
+            write(format_rows("vt {0} {0}\n".format(value), uvs))
+            references.append(self.uv_offset)
+            self.uv_offset += len(uvs)
+        if normals is not None:
+            write(format_rows("vn {0} {0} {0}\n".format(value), normals))
+            references.append(self.normal_offset)
+            self.normal_offset += len(normals)
+
+        if len(indices):
+            # normals and uvs have the same index as the vertex
+            indices = numpy.asarray(indices, dtype=numpy.int64)
+            corners = numpy.stack([indices + offset for offset in references], axis=-1).reshape(len(indices), -1)
+            face_vertex = FACE_VERTEX_FORMATS[(uvs is not None, normals is not None)]
+            write(format_rows("f {0} {0} {0}\n".format(face_vertex), corners))
+        self.vertex_offset += len(vertices)
+
+
+def mesh_nodes(model, node_names=None):
+    """Returns the nodes with meshes of the model, or only the nodes with the names (or ids)."""
+    if node_names:
+        nodes = [model.node_by_name.get(name) or model.node_by_id.get(int(name) if name.isdigit() else name) for name in node_names]
+    else:
+        nodes = list(model.node_by_name.values())
+    return [node for node in nodes if node and "MESH" in node.headers]
+
+
+def write_obj(file, model, node_names=None, precision=4, optimizer=None):
+    """Writes the meshes of the model (or of the nodes with the names) to the text file."""
+    writer = ObjWriter(file, precision, optimizer)
+    for node in mesh_nodes(model, node_names):
+        writer.write_mesh(node.name, node.headers["MESH"])
+
+
+def export_obj(model, filename, node_names=None, precision=4, optimizer=None):
+    with open(filename, "w", buffering=WRITE_BUFFER_SIZE) as file:
+        write_obj(file, model, node_names, precision, optimizer)
+
@@ -0,0 +1,251 @@
+"""
+    Optimizes triangle meshes for rendering: welds vertices with equal (snapped) positions and attributes, orders
+    the faces for the post transform vertex cache (tipsify) and the vertices by their first use, and optionally
+    reduces the detail by vertex clustering. The vertex cache efficiency is measured as average cache miss ratio
+    (acmr), the vertex transforms per face of a fifo cache.
+"""
+
+from collections import OrderedDict, deque
+
+import numpy
+
+
+# columns of the statistics of each optimized mesh
+STATISTICS = ["name", "vertices_before", "vertices_after", "faces_before", "faces_after", "acmr_before", "acmr_after"]
+
+
+def remove_degenerate_faces(indices):
+    """Returns the faces (count, 3) which have three different vertices."""
+    indices = numpy.asarray(indices)
+    valid = (indices[:, 0] != indices[:, 1]) & (indices[:, 1] != indices[:, 2]) & (indices[:, 0] != indices[:, 2])
+    return indices[valid]
+
+
+def remove_duplicate_faces(indices):
+    """
+        Returns the faces without duplicates, in the order of their first occurrence. Faces are equal if they have
+        the same vertices with the same winding, so the two sides of double sided geometry are kept.
+    """
+    if not len(indices):
+        return indices
+    # rotate each face so that it starts with its smallest index, this keeps the winding
+    start = numpy.argmin(indices, axis=1)
+    canonical = numpy.take_along_axis(indices, (start[:, None] + numpy.arange(3)) % 3, axis=1)
+    unique, first = numpy.unique(canonical, axis=0, return_index=True)
+    return indices[numpy.sort(first)]
+
+
+def compact_vertices(indices, vertex_count):
+    """
+        Orders the vertices by their first use in the faces and drops vertices which are not used.
+
+        @return (new indices, index of the old vertex for each new vertex)
+    """
+    flat = numpy.asarray(indices, dtype=numpy.int64).ravel()
+    used, first = numpy.unique(flat, return_index=True)
+    order = used[numpy.argsort(first)]
+    remap = numpy.full(vertex_count, -1, dtype=numpy.int64)
+    remap[order] = numpy.arange(len(order))
+    return remap[flat].reshape(-1, 3), order
+
+
+def quantize(array, tolerance):
+    """Returns the array snapped to a grid of the tolerance as integers. Without tolerance the values are kept as they are."""
+    array = numpy.asarray(array)
+    if not tolerance or array.dtype.kind not in "fc":
+        return array.reshape(len(array), -1).astype(numpy.float64)
+    return numpy.round(array.reshape(len(array), -1) / tolerance).astype(numpy.float64)
+
+
+def weld_vertices(positions, indices, attributes=None, tolerance=1e-5):
+    """
+        Merges vertices whose positions and attributes (normals, texture coordinates, weights) are equal after
+        snapping them to a grid of the tolerance. The grid cell is the spatial hash of the vertex, all vertices of a
+        cell with the same attributes become the first of them. Faces which collapse to a line are removed.
+
+        @param attributes OrderedDict name -> array with one row per vertex
+        @return (positions, indices, attributes) of the welded mesh
+    """
+    attributes = attributes or OrderedDict()
+    if not len(positions):
+        return positions, indices, attributes
+    keys = numpy.hstack([quantize(positions, tolerance)] + [quantize(values, tolerance) for values in attributes.values()])
+    unique, first, inverse = numpy.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    # keep the first vertex of each cell in the original order
+    order = numpy.argsort(first)
+    remap = numpy.empty(len(order), dtype=numpy.int64)
+    remap[order] = numpy.arange(len(order))
+    kept = first[order]
+    indices = remove_degenerate_faces(remap[inverse][numpy.asarray(indices, dtype=numpy.int64)])
+    return positions[kept], indices, OrderedDict((name, values[kept]) for name, values in attributes.items())
+
+
+def decimate(positions, indices, attributes=None, cells=32):
+    """
+        Reduces the detail of the mesh by vertex clustering: the bounding box is divided into a grid with cells
+        along its longest side, the vertices of a cell are merged at their mean position. The attributes are taken
+        from the first vertex of each cell. Faces which collapse and duplicate faces are removed.
+
+        @return (positions, indices, attributes) of the decimated mesh
+    """
+    attributes = attributes or OrderedDict()
+    positions = numpy.asarray(positions)
+    if not len(positions):
+        return positions, indices, attributes
+    lower = positions.min(axis=0)
+    size = max(float((positions.max(axis=0) - lower).max()), 1e-9) / cells
+    grid = numpy.floor((positions - lower) / size).astype(numpy.int64)
+    unique, first, clusters = numpy.unique(grid, axis=0, return_index=True, return_inverse=True)
+    clusters = clusters.reshape(-1)
+    counts = numpy.bincount(clusters, minlength=len(unique))
+    means = numpy.stack([numpy.bincount(clusters, positions[:, axis], minlength=len(unique)) for axis in range(positions.shape[1])], axis=1)
+    means = (means / counts[:, None]).astype(positions.dtype)
+    indices = remove_duplicate_faces(remove_degenerate_faces(clusters[numpy.asarray(indices, dtype=numpy.int64)]))
+    return means, indices, OrderedDict((name, values[first]) for name, values in attributes.items())
+
+
+def acmr(indices, cache_size=32):
+    """Returns the average cache miss ratio of the faces for a fifo vertex cache of the size, between 0.5 and 3."""
+    if not len(indices):
+        return 0.0
+    cache = deque()
+    cached = set()
+    misses = 0
+    for vertex in numpy.asarray(indices).ravel().tolist():
+        if vertex in cached:
+            continue
+        misses += 1
+        cache.append(vertex)
+        cached.add(vertex)
+        if len(cache) > cache_size:
+            cached.discard(cache.popleft())
+    return misses / len(indices)
+
+
+def vertex_faces(indices, vertex_count):
+    """Returns the faces of each vertex as offsets (vertex_count + 1) into an array of face indices."""
+    flat = numpy.asarray(indices, dtype=numpy.int64).ravel()
+    faces = numpy.argsort(flat, kind="stable") // 3
+    offsets = numpy.zeros(vertex_count + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(flat, minlength=vertex_count), out=offsets[1:])
+    return offsets, faces
+
+
+def tipsify(indices, vertex_count, cache_size=32):
+    """
+        Returns the order of the faces for the vertex cache (Sander, Nehab, Barczak: "Fast triangle reordering for
+        vertex locality and reduced overdraw", 2007). The faces around a vertex are emitted as fan, the next fan
+        vertex is a vertex which is still in the cache and has few faces left. The walk is sequential, the vertex
+        adjacency is built with array operations.
+    """
+    indices = numpy.asarray(indices, dtype=numpy.int64)
+    offsets, adjacent = vertex_faces(indices, vertex_count)
+    offsets = offsets.tolist()
+    adjacent = adjacent.tolist()
+    faces = indices.tolist()
+    live = numpy.bincount(indices.ravel(), minlength=vertex_count).tolist()
+    cache_time = [0] * vertex_count
+    emitted = bytearray(len(faces))
+    dead_end = []
+    order = []
+    time = cache_size + 1
+    cursor = 0
+
+    def next_unused_vertex():
+        nonlocal cursor
+        while dead_end:
+            vertex = dead_end.pop()
+            if live[vertex] > 0:
+                return vertex
+        while cursor < vertex_count and live[cursor] == 0:
+            cursor += 1
+        return cursor if cursor < vertex_count else -1
+
+    fan = next_unused_vertex()
+    while fan >= 0:
+        candidates = []
+        for face in adjacent[offsets[fan]:offsets[fan + 1]]:
+            if emitted[face]:
+                continue
+            emitted[face] = 1
+            order.append(face)
+            for vertex in faces[face]:
+                dead_end.append(vertex)
+                candidates.append(vertex)
+                live[vertex] -= 1
+                if time - cache_time[vertex] > cache_size:
+                    cache_time[vertex] = time
+                    time += 1
+        # the candidate which stays longest in the cache while its remaining faces are emitted
+        fan = -1
+        best = -1
+        for vertex in candidates:
+            if live[vertex] > 0:
+                priority = 0
+                if time - cache_time[vertex] + 2 * live[vertex] <= cache_size:
+                    priority = time - cache_time[vertex]
+                if priority > best:
+                    fan, best = vertex, priority
+        if fan < 0:
+            fan = next_unused_vertex()
+    return numpy.array(order, dtype=numpy.int64)
+
+
+class MeshOptimizer:
+
+    """
+        Optimizes the buffers of exported meshes and collects the statistics before and after each mesh.
+
+        @param weld_tolerance grid size for welding vertices, 0 welds only equal vertices, None does not weld
+        @param cache_size size of the fifo vertex cache for the face order and the acmr
+        @param lod_cells cells of the grid along the longest side of the mesh for decimation, None keeps the detail
+    """
+
+    def __init__(self, weld_tolerance=1e-5, cache_size=32, lod_cells=None):
+        self.weld_tolerance = weld_tolerance
+        self.cache_size = cache_size
+        self.lod_cells = lod_cells
+        self.statistics = []
+
+    def optimize(self, name, positions, indices, attributes=None):
+        """
+            Optimizes the mesh. The attributes (OrderedDict name -> array with one row per vertex) are welded and
+            reordered with the positions.
+
+            @return (positions, indices (count, 3), attributes)
+        """
+        positions = numpy.asarray(positions)
+        indices = numpy.asarray(indices, dtype=numpy.int64).reshape(-1, 3)
+        attributes = OrderedDict(attributes or ())
+        row = OrderedDict([("name", name), ("vertices_before", len(positions)), ("vertices_after", 0),
+                           ("faces_before", len(indices)), ("faces_after", 0),
+                           ("acmr_before", acmr(indices, self.cache_size)), ("acmr_after", 0.0)])
+        if self.weld_tolerance is not None:
+            positions, indices, attributes = weld_vertices(positions, indices, attributes, self.weld_tolerance)
+        if self.lod_cells:
+            positions, indices, attributes = decimate(positions, indices, attributes, self.lod_cells)
+        if len(indices):
+            indices = indices[tipsify(indices, len(positions), self.cache_size)]
+        indices, order = compact_vertices(indices, len(positions))
+        positions = positions[order]
+        attributes = OrderedDict((name, values[order]) for name, values in attributes.items())
+        row["vertices_after"] = len(positions)
+        row["faces_after"] = len(indices)
+        row["acmr_after"] = acmr(indices, self.cache_size)
+        self.statistics.append(row)
+        return positions, indices, attributes
+
+    def totals(self):
+        """Returns the sums of the vertices and faces and the acmr over all faces before and after."""
+        rows = self.statistics
+        totals = OrderedDict((column, sum(row[column] for row in rows)) for column in STATISTICS[1:5])
+        for column, faces in (("acmr_before", "faces_before"), ("acmr_after", "faces_after")):
+            totals[column] = sum(row[column] * row[faces] for row in rows) / max(totals[faces], 1)
+        return totals
+
+    def print_statistics(self, file):
+        file.write("{:<24} {:>17} {:>17} {:>13}\n".format("mesh", "vertices", "faces", "acmr"))
+        rows = self.statistics + [dict(self.totals(), name="total")] if self.statistics else []
+        for row in rows:
+            file.write("{:<24} {:>8} {:>8} {:>8} {:>8} {:>6.3f} {:>6.3f}\n".format(*[row[column] for column in STATISTICS]))
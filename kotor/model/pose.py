@@ -0,0 +1,146 @@
+import weakref
+
+from collections import OrderedDict
+
+import numpy
+
+from kotor.tools import *
+from .animation import AnimationSampler, animation_tracks
+from .base import vectors
+from .nodes import ANIMATION_CACHE_SIZE
+from .nodetable import NodeTable, quaternion_matrices, transform_matrices, transform_points
+
+
+class SkinBinding:
+
+    """The vertices of a skin mesh with their bones (as node indices of the PoseEvaluator) and normalized weights."""
+
+    def __init__(self, name, node, vertices, bones, weights, bind_matrices):
+        self.name = name
+        # index of the mesh node
+        self.node = node
+        # (vertex_count, 3) vertices in the space of the mesh node
+        self.vertices = vertices
+        # (vertex_count, 4) node indices and weights of the influencing bones. unused influences have weight 0.
+        self.bones = bones
+        self.weights = weights
+        # (vertex_count) vertices without any weight follow the mesh node
+        self.rigid = weights.sum(axis=1) == 0
+        # transforms from the mesh space to the space of each node in the rest pose
+        self.bind_matrices = bind_matrices
+
+
+class PoseEvaluator:
+
+    """
+        Evaluates the world transforms of the nodes of a model for an animation time and deforms the
+        skin meshes with them. The world transforms are composed with the NodeTable of the model.
+    """
+
+    def __init__(self, model, max_samplers=ANIMATION_CACHE_SIZE):
+        self.model = model
+        self.table = NodeTable.from_model(model)
+        self.nodes = self.table.nodes
+        self.parents = self.table.parents
+        self.node_index = self.table.index_by_name
+        # rest pose, rotations as (x, y, z, w)
+        self.rest_positions = self.table.positions
+        self.rest_rotations = self.table.rotations
+        self.rest_world = self.table.world_matrices()
+        self.skins = [skin for skin in (self.bind_skin(index, node) for index, node in enumerate(self.nodes)) if skin]
+        # animation name -> (weak reference to the animation, AnimationSampler), least recently used first
+        self.samplers = OrderedDict()
+        self.max_samplers = max_samplers
+
+    def compose(self, local):
+        """Returns the world matrices for the local matrices of the nodes."""
+        return self.table.compose(local)
+
+    def bind_skin(self, index, node):
+        skin = node.headers.get("SKIN")
+        mesh = node.headers.get("MESH")
+        if skin is None or mesh is None or skin.bone_weights is None or skin.bone_indices is None:
+            return None
+        # bone index -> node index. bones without node and unused influences (the last entry) follow the mesh node.
+        bone_nodes = numpy.array([self.table.find_id(node_id) for node_id in skin.bone_node_ids().tolist()] + [index], dtype=numpy.int64)
+        bone_nodes[bone_nodes < 0] = index
+        bone_indices = numpy.asarray(skin.bone_indices).astype(numpy.int64)
+        valid = (bone_indices >= 0) & (bone_indices < len(bone_nodes) - 1)
+        bones = bone_nodes[numpy.where(valid, bone_indices, len(bone_nodes) - 1)]
+        weights = numpy.where(valid, skin.bone_weights, 0.0)
+        totals = weights.sum(axis=1, keepdims=True)
+        weights = weights / numpy.where(totals > 0, totals, 1.0)
+        vertices = numpy.asarray(vectors(mesh.vertices), dtype=numpy.float64)
+        return SkinBinding(node.name, index, vertices, bones, weights, numpy.linalg.inv(self.rest_world) @ self.rest_world[index])
+
+    def sampler(self, animation):
+        """
+            Returns the sampler of the animation. At most max_samplers samplers are kept by animation name, they
+            don't keep their animation alive. An animation parsed again by its AnimationIndex (or another animation
+            with the same name) gets a new sampler.
+        """
+        name = animation.animation_name
+        entry = self.samplers.pop(name, None)
+        if entry is None or entry[0]() is not animation:
+            entry = (weakref.ref(animation), AnimationSampler(animation_tracks(animation)))
+        self.samplers[name] = entry
+        if len(self.samplers) > self.max_samplers:
+            self.samplers.popitem(last=False)
+        return entry[1]
+
+    def local_transforms(self, animation=None, time=0.0):
+        """
+            Returns the positions, rotations (x, y, z, w) and scales of the nodes at the time of the animation.
+            Nodes without controllers in the animation keep their rest pose. The animation nodes are matched by name,
+            so animations of super models can be used.
+        """
+        positions = self.rest_positions.copy()
+        rotations = self.rest_rotations.copy()
+        scales = numpy.ones(len(self.nodes))
+        if animation is None:
+            return positions, rotations, scales
+        targets = {"position": positions, "orientation": rotations, "scale": scales}
+        for track_type, (names, values) in self.sampler(animation).sample([time]).items():
+            indices = numpy.array([self.node_index.get(name, -1) for name in names], dtype=numpy.int64)
+            found = indices >= 0
+            target = targets[track_type]
+            target[indices[found]] = values[found, 0].reshape((int(found.sum()),) + target.shape[1:])
+        return positions, rotations, scales
+
+    def world_matrices(self, animation=None, time=0.0):
+        """Returns the world matrices of the nodes at the time of the animation, an array of shape (node count, 4, 4)."""
+        return self.compose(transform_matrices(*self.local_transforms(animation, time)))
+
+    def skin_vertices(self, skin, world):
+        """Returns the world positions of the vertices of the skin for the world matrices of the pose."""
+        # transform from the rest pose of the mesh to the posed bone
+        skin_matrices = world @ skin.bind_matrices
+        blended = numpy.einsum('vk,vkij->vij', skin.weights, skin_matrices[skin.bones][:, :, :3, :])
+        positions = numpy.einsum('vij,vj->vi', blended[:, :, :3], skin.vertices) + blended[:, :, 3]
+        if skin.rigid.any():
+            positions[skin.rigid] = transform_points(world[skin.node], skin.vertices[skin.rigid])
+        return positions
+
+    def mesh_vertices(self, animation=None, time=0.0):
+        """
+            Returns the world positions of the vertices of all meshes at the time of the animation, an OrderedDict
+            node name -> (vertex_count, 3) array. Skin meshes are deformed by their bones, other meshes follow their node.
+        """
+        world = self.world_matrices(animation, time)
+        skins = dict((skin.node, skin) for skin in self.skins)
+        vertices = OrderedDict()
+        for index, node in enumerate(self.nodes):
+            if index in skins:
+                vertices[node.name] = self.skin_vertices(skins[index], world)
+            elif "MESH" in node.headers:
+                mesh_vertices = numpy.asarray(vectors(node.headers["MESH"].vertices), dtype=numpy.float64)
+                vertices[node.name] = transform_points(world[index], mesh_vertices)
+        return vertices
+
+    def bounding_box(self, animation=None, time=0.0):
+        """Returns the minimum and maximum of the mesh vertices at the time of the animation, or None for models without vertices."""
+        vertices = [positions for positions in self.mesh_vertices(animation, time).values() if len(positions)]
+        if not vertices:
+            return None
+        vertices = numpy.concatenate(vertices)
+        return vertices.min(axis=0), vertices.max(axis=0)
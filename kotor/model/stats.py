@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+"""
+    Collects statistics of all models of an installation: node types, controller types unknown to the parser,
+    vertex, face and animation counts and the use of super models. The models are parsed in worker processes
+    straight from the bif files.
+"""
+
+import argparse
+import csv
+import fnmatch
+import time
+
+from collections import Counter, OrderedDict
+
+from kotor.tools import *
+from .mdl import LOAD_ALL, load_model, read_archive_data
+from .nodes import Node, NODE_TYPES, CONTROLLER_TYPES
+from .supermodel import ModelSource, NO_SUPER_MODEL, resource_name
+
+
+# bits of the node types known to the parser
+KNOWN_NODE_TYPE_BITS = sum(node_type.bitfield for node_type in NODE_TYPES)
+
+# columns of the statistics, one row per model
+COLUMNS = (["name", "mdl_size", "mdx_size", "classification", "super_model", "nodes"] +
+           ["{}_nodes".format(node_type.name.lower()) for node_type in NODE_TYPES] +
+           ["unknown_node_types", "vertices", "faces", "controllers", "unknown_controllers", "animations", "animation_nodes", "parse_seconds"])
+
+
+def format_counts(counter):
+    """Formats a Counter of ids as "id:count" pairs separated by spaces, ordered by id."""
+    return " ".join("{}:{}".format(key, count) for key, count in sorted(counter.items()))
+
+
+def parse_counts(text):
+    """Parses the "id:count" pairs of format_counts. Returns a Counter."""
+    counter = Counter()
+    for pair in text.split():
+        key, count = pair.rsplit(":", 1)
+        counter[int(key)] += int(count)
+    return counter
+
+
+def model_statistics(name, model):
+    """Returns the statistics of the model (read with LOAD_ALL) as OrderedDict with the COLUMNS (except the sizes and the time)."""
+    row = OrderedDict((column, 0) for column in COLUMNS)
+    row["name"] = name
+    row["classification"] = model.model_header.classification
+    row["super_model"] = resource_name(model.model_header.super_model or NO_SUPER_MODEL)
+    unknown_node_types = Counter()
+    unknown_controllers = Counter()
+
+    def count_nodes(root, geometry):
+        count = 0
+        for node in iterate_tree(root, Node.get_childs):
+            count += 1
+            if geometry:
+                for node_type in node.node_types:
+                    row["{}_nodes".format(node_type.name.lower())] += 1
+                mesh = node.headers.get("MESH")
+                if mesh:
+                    row["vertices"] += mesh.vertex_count
+                    row["faces"] += len(mesh.faces.data)
+            unknown_bits = node.node_type_id & ~KNOWN_NODE_TYPE_BITS
+            if unknown_bits:
+                unknown_node_types[unknown_bits] += 1
+            if node.node_header:
+                for controller in node.node_header.controllers.data:
+                    row["controllers"] += 1
+                    if controller.controller_type_id not in CONTROLLER_TYPES:
+                        unknown_controllers[controller.controller_type_id] += 1
+        return count
+
+    # node type, vertex and face counts are of the geometry, controllers of the geometry and the animations
+    row["nodes"] = count_nodes(model.root_node, True)
+    animations = model.model_header.animations
+    row["animations"] = len(animations)
+    for animation in animations:
+        row["animation_nodes"] += count_nodes(animation.animation_node, False)
+    row["unknown_node_types"] = format_counts(unknown_node_types)
+    row["unknown_controllers"] = format_counts(unknown_controllers)
+    return row
+
+
+def scan_model(task):
+    """
+        Parses one model and returns its statistics. Runs in a worker process.
+
+        @param task tuple (ressource name, mdl (path, offset, size), mdx (path, offset, size) or None)
+        @return tuple (ressource name, statistics or None, error message or None)
+    """
+    name, mdl_location, mdx_location = task
+    try:
+        start = time.perf_counter()
+        data = read_archive_data(mdl_location)
+        mdx = read_archive_data(mdx_location) if mdx_location else None
+        row = model_statistics(name, load_model(data, mdx, LOAD_ALL))
+        row["mdl_size"] = len(data)
+        row["mdx_size"] = len(mdx) if mdx is not None else 0
+        row["parse_seconds"] = round(time.perf_counter() - start, 6)
+        return name, row, None
+    except Exception as e:
+        return name, None, "{}: {}".format(type(e).__name__, e)
+
+
+def scan_models(source, jobs=None, pattern=None):
+    """
+        Scans the models of the ModelSource in a process pool. Returns the statistics rows (ordered by name)
+        and the (name, error) tuples of the models which cannot be parsed.
+    """
+    tasks = [(name, mdl_location, mdx_location) for name, (mdl_location, mdx_location) in source.locations.items()
+             if not pattern or fnmatch.fnmatch(name, pattern)]
+    results, failed, elapsed = run_tasks(scan_model, tasks, jobs, chunksize=8)
+    rows = [row for name, row, error in results]
+    rows.sort(key=lambda row: row["name"])
+    failed.sort()
+    return rows, failed
+
+
+def write_csv(file, rows):
+    writer = csv.DictWriter(file, COLUMNS, lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def summary(rows):
+    """Returns the totals of the rows: node type counts, unknown controllers and the most used super models."""
+    totals = OrderedDict()
+    for column in ["nodes"] + ["{}_nodes".format(node_type.name.lower()) for node_type in NODE_TYPES] + ["vertices", "faces", "controllers", "animations"]:
+        totals[column] = sum(row[column] for row in rows)
+    unknown_controllers = Counter()
+    unknown_node_types = Counter()
+    for row in rows:
+        unknown_controllers += parse_counts(row["unknown_controllers"])
+        unknown_node_types += parse_counts(row["unknown_node_types"])
+    super_models = Counter(row["super_model"] for row in rows if row["super_model"] != NO_SUPER_MODEL)
+    return totals, unknown_controllers, unknown_node_types, super_models
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='Collect statistics of all models of bif files and directories.')
+    parser.add_argument('--dir', action='append', dest='directories', default=[], help='directory with mdl and mdx files (can be repeated)')
+    parser.add_argument('--key', help='path to key file (i.e. chitin.key)')
+    parser.add_argument('--bif', action='append', dest='bif_files', default=[], help='bif file referenced from key file (i.e. data/models.bif, can be repeated)')
+    parser.add_argument('--filter', help='only scan models matching this pattern (i.e. "c_*")')
+    parser.add_argument('-o', dest='output', default='model_stats.csv', help='csv file with one row per model (default: model_stats.csv)')
+    parser.add_argument('--failed', help='file for the names and errors of the models which cannot be parsed (default: print them)')
+    parser.add_argument('-j', dest='jobs', type=int, default=None, help='number of worker processes (default: number of cpus)')
+    parsed = parser.parse_args()
+
+    source = ModelSource()
+    if parsed.key:
+        source.add_bif_files(parsed.key, parsed.bif_files)
+    for directory in parsed.directories:
+        source.add_directory(directory)
+
+    start = time.perf_counter()
+    rows, failed = scan_models(source, parsed.jobs, parsed.filter)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    with open(parsed.output, "w", newline="") as file:
+        write_csv(file, rows)
+
+    totals, unknown_controllers, unknown_node_types, super_models = summary(rows)
+    print("{} models scanned, {} failed in {:.2f}s ({:.1f} models/s), statistics written to {}".format(
+        len(rows), len(failed), elapsed, len(rows) / elapsed, parsed.output))
+    for column, total in totals.items():
+        print("  {:>20} {:>10}".format(column, total))
+    print("unknown controller types: {}".format(format_counts(unknown_controllers) or "none"))
+    print("unknown node types: {}".format(" ".join("0x{:x}:{}".format(bits, count) for bits, count in sorted(unknown_node_types.items())) or "none"))
+    print("most used super models: {}".format(", ".join("{} ({})".format(name, count) for name, count in super_models.most_common(10)) or "none"))
+    if parsed.failed:
+        with open(parsed.failed, "w") as file:
+            file.writelines("{}\t{}\n".format(name, error) for name, error in failed)
+    else:
+        for name, error in failed:
+            print("error: cannot parse {}: {}".format(name, error))
+
+
+def main():
+    parse_command_line()
+
+
+if __name__ == "__main__":
+    main()
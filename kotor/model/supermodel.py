@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import os
+
+from collections import OrderedDict
+
+import numpy
+
+from .mdl import LOAD_ALL, find_bif_models, load_model, read_animation_index, read_archive_data
+from .nodes import AnimationIndex
+
+
+# super model name of models without super model
+NO_SUPER_MODEL = "null"
+
+
+def resource_name(name):
+    """Resource names are case insensitive."""
+    return name.lower()
+
+
+class ModelSource:
+
+    """
+        Locations of the mdl and mdx data of models by resource name. Each location is a tuple (path, offset, size),
+        so models in bif files and loose files in directories are read the same way.
+    """
+
+    def __init__(self):
+        # resource name -> (mdl location, mdx location or None)
+        self.locations = OrderedDict()
+
+    def add(self, name, mdl_location, mdx_location=None):
+        self.locations[resource_name(name)] = (mdl_location, mdx_location)
+
+    def add_directory(self, directory):
+        """Adds the mdl files (and the mdx files next to them) in the directory. Existing models are replaced."""
+        for filename in sorted(glob.glob(os.path.join(directory, "*.[mM][dD][lL]"))):
+            basename = os.path.splitext(filename)[0]
+            mdx_location = None
+            for mdx_filename in [basename + ".mdx", basename + ".MDX"]:
+                if os.path.exists(mdx_filename):
+                    mdx_location = (mdx_filename, 0, os.path.getsize(mdx_filename))
+                    break
+            self.add(os.path.basename(basename), (filename, 0, os.path.getsize(filename)), mdx_location)
+
+    def add_bif_files(self, key_file, bif_files):
+        """Adds the models of the bif files referenced by the key file."""
+        for name, mdl_location, mdx_location in find_bif_models(key_file, bif_files):
+            self.add(name, mdl_location, mdx_location)
+
+    def __contains__(self, name):
+        return resource_name(name) in self.locations
+
+    def read_mdl(self, name):
+        """Returns the content of the mdl file of the model."""
+        return read_archive_data(self.locations[resource_name(name)][0])
+
+    def read(self, name):
+        """Returns the content of the mdl and the mdx file (or None) of the model."""
+        mdl_location, mdx_location = self.locations[resource_name(name)]
+        return read_archive_data(mdl_location), read_archive_data(mdx_location) if mdx_location else None
+
+
+class ModelLibrary:
+
+    """
+        Loads models from a ModelSource and keeps them. Each model is parsed only once, so all models with
+        the same super model share the parsed super model, its animations and its part number mapping.
+    """
+
+    def __init__(self, source, level=LOAD_ALL, cache=None):
+        self.source = source
+        self.level = level
+        self.cache = cache
+        # resource name -> Model
+        self.models = {}
+        # (model name, super model name) -> part numbers
+        self.part_number_maps = {}
+
+    def load(self, name):
+        """Returns the model with the resource name. Raises KeyError if the source has no such model."""
+        name = resource_name(name)
+        model = self.models.get(name)
+        if model is None:
+            data, mdx = self.source.read(name)
+            model = load_model(data, mdx, self.level, self.cache)
+            self.models[name] = model
+        return model
+
+    def chain_names(self, name):
+        """
+            Returns the resource names of the model and its super models: [model, super model, super model of the
+            super model, ...]. The chain ends at a model without super model, a super model which is not in the
+            source or a cycle.
+        """
+        names = [resource_name(name)]
+        while True:
+            super_model = resource_name(self.load(names[-1]).model_header.super_model)
+            if not super_model or super_model == NO_SUPER_MODEL or super_model in names or super_model not in self.source:
+                return names
+            names.append(super_model)
+
+    def chain(self, name):
+        """Returns the model and its super models, see chain_names."""
+        return [self.load(chain_name) for chain_name in self.chain_names(name)]
+
+    def part_numbers(self, name, super_name):
+        """
+            Maps the part numbers (node ids) of the model to the part numbers of the nodes with the same name
+            in the super model. Returns an int array indexed by the node id of the model, -1 for nodes which are
+            not in the super model.
+        """
+        key = (resource_name(name), resource_name(super_name))
+        part_numbers = self.part_number_maps.get(key)
+        if part_numbers is None:
+            model = self.load(name)
+            super_ids = dict((node_name.lower(), node_id) for node_id, node_name in enumerate(self.load(super_name).names_header.names))
+            part_numbers = numpy.array([super_ids.get(node_name.lower(), -1) for node_name in model.names_header.names], dtype=numpy.int64)
+            self.part_number_maps[key] = part_numbers
+        return part_numbers
+
+    def chain_part_numbers(self, name):
+        """
+            Returns the part numbers of the nodes of the model in each model of its chain, an int array of shape
+            (len(chain), node count). Row 0 are the node ids of the model itself.
+        """
+        names = self.chain_names(name)
+        node_count = len(self.load(name).names_header.names)
+        rows = [numpy.arange(node_count, dtype=numpy.int64)]
+        for super_name in names[1:]:
+            rows.append(self.part_numbers(name, super_name))
+        return numpy.array(rows).reshape(len(names), node_count)
+
+    def animation_index(self, name):
+        """
+            Returns the AnimationIndex of the model. Models loaded below LOAD_ANIMATIONS have no index, it is read
+            once from the mdl file (without parsing the model again) and kept in the loaded model.
+        """
+        model = self.load(name)
+        if not isinstance(model.model_header.animations, AnimationIndex):
+            read_animation_index(model, self.source.read_mdl(name))
+        return model.model_header.animations
+
+    def animation_owners(self, name):
+        """
+            Returns the names of the animations of the model including the inherited animations of its super models,
+            an OrderedDict lower case animation name -> model which defines it. Animations of a model replace the
+            animations with the same name of its super models. No animation is parsed.
+        """
+        owners = OrderedDict()
+        for chain_name in self.chain_names(name):
+            model = self.load(chain_name)
+            for animation_name in self.animation_index(chain_name).names:
+                owners.setdefault(animation_name.lower(), model)
+        return owners
+
+    def animations(self, name):
+        """Returns the animations of the model (see animation_owners), an OrderedDict animation name -> (animation, model which defines it)."""
+        return OrderedDict((animation_name, (model.model_header.animations.get(animation_name), model))
+                           for animation_name, model in self.animation_owners(name).items())
+
+    def find_animation(self, name, animation_name):
+        """Returns (animation, model which defines it) or None if neither the model nor its super models have the animation."""
+        model = self.animation_owners(name).get(animation_name.lower())
+        if model is None:
+            return None
+        return model.model_header.animations.get(animation_name), model
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='Resolve the super models and inherited animations of models.')
+    parser.add_argument('models', nargs='+', help='resource names of the models')
+    parser.add_argument('--dir', action='append', dest='directories', default=[], help='directory with mdl and mdx files (can be repeated)')
+    parser.add_argument('--key', help='path to key file (i.e. chitin.key)')
+    parser.add_argument('--bif', action='append', dest='bif_files', default=[], help='bif file referenced from key file (i.e. data/models.bif, can be repeated)')
+    parsed = parser.parse_args()
+
+    source = ModelSource()
+    if parsed.key:
+        source.add_bif_files(parsed.key, parsed.bif_files)
+    # loose files override the models of the bif files
+    for directory in parsed.directories:
+        source.add_directory(directory)
+
+    library = ModelLibrary(source)
+    for name in parsed.models:
+        chain = library.chain(name)
+        print("{}: {}".format(name, " -> ".join(model.geometry_header.name for model in chain)))
+        part_numbers = library.chain_part_numbers(name)
+        print("  {} nodes, {} mapped to the root super model".format(part_numbers.shape[1], int((part_numbers[-1] >= 0).sum())))
+        owners = library.animation_owners(name)
+        print("  {} animations: {}".format(len(owners), ", ".join(
+            "{} ({})".format(animation_name, model.geometry_header.name) for animation_name, model in owners.items())))
+
+
+def main():
+    parse_command_line()
+
+
+if __name__ == "__main__":
+    main()
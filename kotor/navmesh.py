@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+import argparse
+import heapq
+import os
+
+import numpy
+
+import kotor.lyt as lyt
+import kotor.wok as wok
+
+
+# surface materials (surfacemat.2da) which can not be walked on: undefined, obscuring, nonwalk, transparent,
+# lava, bottomless pit, deep water and nonwalk grass
+NON_WALKABLE_SURFACES = frozenset([0, 2, 7, 8, 15, 16, 17, 19])
+# vertices of different rooms closer than this are the same vertex
+WELD_TOLERANCE = 0.01
+# faces with a slope steeper than this (normal z) are skipped by locate
+MIN_NORMAL_Z = 1e-3
+
+
+def cross2(origin, a, b):
+    """z component of the cross product of a - origin and b - origin (in the xy plane)."""
+    return (a[0] - origin[0]) * (b[1] - origin[1]) - (a[1] - origin[1]) * (b[0] - origin[0])
+
+
+def connected_components(count, sources, targets):
+    """Labels the connected components of the undirected graph with count nodes and the edges sources[i] - targets[i]."""
+    labels = numpy.arange(count)
+    while True:
+        # propagate the smallest label along the edges, then jump to the label of the label
+        updated = labels.copy()
+        numpy.minimum.at(updated, sources, labels[targets])
+        numpy.minimum.at(updated, targets, labels[sources])
+        updated = updated[updated]
+        if numpy.array_equal(updated, labels):
+            break
+        labels = updated
+    return numpy.unique(labels, return_inverse=True)[1].reshape(-1)
+
+
+class Path:
+    def __init__(self, points, faces, cost):
+        # (count, 3) array with the corners of the path, from start to goal
+        self.points = points
+        self.faces = faces
+        self.cost = cost
+
+    def length(self):
+        return float(numpy.linalg.norm(numpy.diff(self.points, axis=0), axis=1).sum())
+
+
+class NavMesh:
+
+    """
+        Walkable faces of an area in one mesh. Faces are adjacent if they share an edge (after welding vertices of
+        different rooms). The adjacency is stored as graph in compressed rows with a portal (the shared edge) and
+        the cost of each step. A uniform grid over the xy plane answers which face is under a point.
+    """
+
+    def __init__(self, vertices, faces, materials, face_rooms=None, cell_size=None):
+        vertices = numpy.asarray(vertices, dtype=numpy.float64).reshape(-1, 3)
+        faces = numpy.asarray(faces, dtype=numpy.int64).reshape(-1, 3)
+        materials = numpy.asarray(materials).reshape(-1)
+        walkable = ~numpy.isin(materials, list(NON_WALKABLE_SURFACES))
+        self.vertices = vertices
+        self.faces = faces[walkable]
+        self.materials = materials[walkable]
+        self.face_rooms = numpy.zeros(len(self.faces), dtype=numpy.int32) if face_rooms is None else numpy.asarray(face_rooms)[walkable]
+        self.triangles = vertices[self.faces]
+        self.centroids = self.triangles.mean(axis=1)
+        normals = numpy.cross(self.triangles[:, 1] - self.triangles[:, 0], self.triangles[:, 2] - self.triangles[:, 0])
+        lengths = numpy.linalg.norm(normals, axis=1)
+        self.normals = normals / numpy.where(lengths > 0, lengths, 1.0)[:, None]
+        self.build_adjacency()
+        self.components = connected_components(len(self.faces), self.sources, self.targets)
+        self.build_grid(cell_size)
+
+    @classmethod
+    def from_walkmeshes(cls, walkmeshes, **kwargs):
+        """
+            Creates the navmesh from (walkmesh, position) pairs. The vertices of a walkmesh are relative to
+            its position field, so each walkmesh is moved by position - walkmesh.position.
+        """
+        vertices = []
+        faces = []
+        materials = []
+        face_rooms = []
+        vertex_count = 0
+        for room, (walkmesh, position) in enumerate(walkmeshes):
+            offset = numpy.asarray(position, dtype=numpy.float64) - numpy.asarray(walkmesh.position, dtype=numpy.float64)
+            vertices.append(walkmesh.vertices.astype(numpy.float64) + offset)
+            faces.append(walkmesh.faces.astype(numpy.int64) + vertex_count)
+            materials.append(walkmesh.materials)
+            face_rooms.append(numpy.full(len(walkmesh.faces), room, dtype=numpy.int32))
+            vertex_count += len(walkmesh.vertices)
+        if not walkmeshes:
+            return cls(numpy.zeros((0, 3)), numpy.zeros((0, 3)), numpy.zeros(0), **kwargs)
+        return cls(numpy.concatenate(vertices), numpy.concatenate(faces), numpy.concatenate(materials), numpy.concatenate(face_rooms), **kwargs)
+
+    def build_adjacency(self):
+        face_count = len(self.faces)
+        # weld vertices by position
+        keys = numpy.round(self.vertices / WELD_TOLERANCE).astype(numpy.int64)
+        if len(keys):
+            welded = numpy.unique(keys, axis=0, return_inverse=True)[1].reshape(-1)
+        else:
+            welded = numpy.zeros(0, dtype=numpy.int64)
+        corners = welded[self.faces] if face_count else numpy.zeros((0, 3), dtype=numpy.int64)
+        # edge i of a face goes from corner i to corner i + 1
+        start = corners.reshape(-1)
+        end = corners[:, [1, 2, 0]].reshape(-1)
+        edge_keys = numpy.minimum(start, end) * (len(welded) + 1) + numpy.maximum(start, end)
+        order = numpy.argsort(edge_keys, kind='stable')
+        shared = edge_keys[order][1:] == edge_keys[order][:-1]
+        first = order[:-1][shared]
+        second = order[1:][shared]
+        # neighbors[face, edge] is the face on the other side of the edge, -1 for none
+        neighbors = numpy.full(face_count * 3, -1, dtype=numpy.int64)
+        neighbors[first] = second // 3
+        neighbors[second] = first // 3
+        self.neighbors = neighbors.reshape(face_count, 3)
+
+        # graph in compressed rows: the neighbors of face f are targets[offsets[f]:offsets[f + 1]]
+        edges = numpy.nonzero(neighbors >= 0)[0]
+        self.sources = edges // 3
+        self.targets = neighbors[edges]
+        self.offsets = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(self.sources, minlength=face_count))])
+        edge_faces = self.faces[self.sources] if len(edges) else numpy.zeros((0, 3), dtype=numpy.int64)
+        corner = edges % 3
+        self.portals = numpy.stack([self.vertices[edge_faces[numpy.arange(len(edges)), corner]],
+                                    self.vertices[edge_faces[numpy.arange(len(edges)), (corner + 1) % 3]]], axis=1).reshape(-1, 2, 3)
+        midpoints = self.portals.mean(axis=1)
+        self.costs = (numpy.linalg.norm(midpoints - self.centroids[self.sources], axis=1) +
+                      numpy.linalg.norm(self.centroids[self.targets] - midpoints, axis=1))
+
+    def build_grid(self, cell_size=None):
+        if not len(self.faces):
+            self.grid_origin = numpy.zeros(2)
+            self.cell_size = 1.0
+            self.grid_shape = (1, 1)
+            self.cell_offsets = numpy.zeros(2, dtype=numpy.int64)
+            self.cell_faces = numpy.zeros(0, dtype=numpy.int64)
+            return
+        minimum = self.triangles[:, :, 0:2].min(axis=1)
+        maximum = self.triangles[:, :, 0:2].max(axis=1)
+        self.grid_origin = minimum.min(axis=0)
+        extent = maximum.max(axis=0) - self.grid_origin
+        if cell_size is None:
+            # about two faces per cell
+            cell_size = max(numpy.sqrt(max(extent[0] * extent[1], 1e-6) * 2.0 / len(self.faces)), 1e-3)
+        self.cell_size = float(cell_size)
+        width, height = (numpy.floor(extent / self.cell_size).astype(numpy.int64) + 1).tolist()
+        self.grid_shape = (width, height)
+
+        # insert each face into all cells overlapped by its bounding box
+        low = numpy.floor((minimum - self.grid_origin) / self.cell_size).astype(numpy.int64)
+        high = numpy.floor((maximum - self.grid_origin) / self.cell_size).astype(numpy.int64)
+        spans = high - low + 1
+        counts = spans[:, 0] * spans[:, 1]
+        faces = numpy.repeat(numpy.arange(len(self.faces)), counts)
+        local = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        cell_x = low[faces, 0] + local % spans[faces, 0]
+        cell_y = low[faces, 1] + local // spans[faces, 0]
+        cells = cell_y * width + cell_x
+        order = numpy.argsort(cells, kind='stable')
+        self.cell_faces = faces[order]
+        self.cell_offsets = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(cells, minlength=width * height))])
+
+    def candidates(self, points):
+        """Returns (point ids, face ids) of the faces in the grid cells of the points."""
+        cell = numpy.floor((points[:, 0:2] - self.grid_origin) / self.cell_size).astype(numpy.int64)
+        width, height = self.grid_shape
+        inside = (cell[:, 0] >= 0) & (cell[:, 1] >= 0) & (cell[:, 0] < width) & (cell[:, 1] < height)
+        cell_ids = numpy.where(inside, cell[:, 1] * width + cell[:, 0], 0)
+        starts = self.cell_offsets[cell_ids]
+        counts = numpy.where(inside, self.cell_offsets[cell_ids + 1] - starts, 0)
+        point_ids = numpy.repeat(numpy.arange(len(points)), counts)
+        local = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        return point_ids, self.cell_faces[starts[point_ids] + local]
+
+    def face_heights(self, faces, points):
+        """Heights of the planes of the faces at the xy positions of the points. nan for vertical faces."""
+        normals = self.normals[faces]
+        corner = self.triangles[faces, 0]
+        nz = numpy.where(numpy.abs(normals[:, 2]) > MIN_NORMAL_Z, normals[:, 2], numpy.nan)
+        return corner[:, 2] - (normals[:, 0] * (points[:, 0] - corner[:, 0]) + normals[:, 1] * (points[:, 1] - corner[:, 1])) / nz
+
+    def locate(self, points, epsilon=1e-6):
+        """
+            Returns the face under each point (-1 for none). For (count, 3) points the face whose surface is
+            vertically nearest to the point is chosen, for (count, 2) points the highest face.
+        """
+        points = numpy.asarray(points, dtype=numpy.float64)
+        points = points.reshape(-1, points.shape[-1])
+        point_ids, faces = self.candidates(points)
+        query = points[point_ids]
+        triangles = self.triangles[faces]
+        # inside test with the signs of the edge cross products, for both windings
+        signs = numpy.stack([cross2(triangles[:, i].T, triangles[:, (i + 1) % 3].T, query.T) for i in range(3)], axis=1)
+        scale = numpy.maximum(numpy.abs(signs).max(axis=1), 1.0)
+        inside = numpy.all(signs >= -epsilon * scale[:, None], axis=1) | numpy.all(signs <= epsilon * scale[:, None], axis=1)
+        heights = self.face_heights(faces, query)
+        valid = inside & ~numpy.isnan(heights)
+        point_ids, faces, heights = point_ids[valid], faces[valid], heights[valid]
+        if points.shape[1] >= 3:
+            score = -numpy.abs(heights - points[point_ids, 2])
+        else:
+            score = heights
+        result = numpy.full(len(points), -1, dtype=numpy.int64)
+        # best candidate per point: the last one after sorting by point and score
+        order = numpy.lexsort((score, point_ids))
+        last = numpy.ones(len(order), dtype=bool)
+        last[:-1] = point_ids[order][1:] != point_ids[order][:-1]
+        result[point_ids[order][last]] = faces[order][last]
+        return result
+
+    def heights(self, points):
+        """Returns the height of the walkable surface under each point, nan if there is none."""
+        points = numpy.asarray(points, dtype=numpy.float64)
+        points = points.reshape(-1, points.shape[-1])
+        faces = self.locate(points)
+        heights = numpy.full(len(points), numpy.nan)
+        found = faces >= 0
+        heights[found] = self.face_heights(faces[found], points[found])
+        return heights
+
+    def reachable(self, starts, goals):
+        """Returns True for each pair of points, which are on walkable faces connected with each other."""
+        start_faces = self.locate(starts)
+        goal_faces = self.locate(goals)
+        found = (start_faces >= 0) & (goal_faces >= 0)
+        reachable = numpy.zeros(len(found), dtype=bool)
+        reachable[found] = self.components[start_faces[found]] == self.components[goal_faces[found]]
+        return reachable
+
+    def find_faces(self, start_face, goal_face, goal):
+        """A* search over the face graph. Returns the faces from start_face to goal_face and the cost, or None."""
+        costs = {start_face: 0.0}
+        previous = {start_face: (-1, -1)}
+        queue = [(0.0, start_face)]
+        closed = set()
+        while queue:
+            estimate, face = heapq.heappop(queue)
+            if face == goal_face:
+                break
+            if face in closed:
+                continue
+            closed.add(face)
+            for edge in range(self.offsets[face], self.offsets[face + 1]):
+                neighbor = int(self.targets[edge])
+                cost = costs[face] + self.costs[edge]
+                if cost < costs.get(neighbor, numpy.inf):
+                    costs[neighbor] = cost
+                    previous[neighbor] = (face, edge)
+                    heapq.heappush(queue, (cost + numpy.linalg.norm(self.centroids[neighbor] - goal), neighbor))
+        if goal_face not in previous:
+            return None
+        faces = []
+        edges = []
+        face = goal_face
+        while face >= 0:
+            faces.append(face)
+            face, edge = previous[face]
+            if edge >= 0:
+                edges.append(edge)
+        return faces[::-1], edges[::-1], costs[goal_face]
+
+    def find_path(self, start, goal):
+        """Returns the shortest Path from start to goal over the walkable faces, or None if goal is not reachable."""
+        start = numpy.asarray(start, dtype=numpy.float64)
+        goal = numpy.asarray(goal, dtype=numpy.float64)
+        start_face, goal_face = self.locate([start, goal]).tolist()
+        if start_face < 0 or goal_face < 0 or self.components[start_face] != self.components[goal_face]:
+            return None
+        faces, edges, cost = self.find_faces(start_face, goal_face, self.centroids[goal_face])
+        return Path(self.funnel(start, goal, faces, edges), faces, cost)
+
+    def funnel(self, start, goal, faces, edges):
+        """Shortens the path through the portals with the simple stupid funnel algorithm (in the xy plane)."""
+        portals = [(start, start)]
+        for face, edge in zip(faces, edges):
+            a, b = self.portals[edge]
+            # left and right as seen from the face towards the next face
+            if cross2(self.centroids[face], a, b) < 0:
+                portals.append((a, b))
+            else:
+                portals.append((b, a))
+        portals.append((goal, goal))
+
+        points = [start]
+        apex, left, right = start, portals[0][0], portals[0][1]
+        apex_index = left_index = right_index = 0
+        index = 1
+        while index < len(portals):
+            portal_left, portal_right = portals[index]
+            # tighten the right side
+            if cross2(apex, right, portal_right) >= 0:
+                if numpy.array_equal(apex, right) or cross2(apex, left, portal_right) < 0:
+                    right, right_index = portal_right, index
+                else:
+                    # right crosses left: left is a corner of the path
+                    if not numpy.array_equal(points[-1], left):
+                        points.append(left)
+                    apex, apex_index = left, left_index
+                    left, right, left_index, right_index = apex, apex, apex_index, apex_index
+                    index = apex_index + 1
+                    continue
+            # tighten the left side
+            if cross2(apex, left, portal_left) <= 0:
+                if numpy.array_equal(apex, left) or cross2(apex, right, portal_left) > 0:
+                    left, left_index = portal_left, index
+                else:
+                    if not numpy.array_equal(points[-1], right):
+                        points.append(right)
+                    apex, apex_index = right, right_index
+                    left, right, left_index, right_index = apex, apex, apex_index, apex_index
+                    index = apex_index + 1
+                    continue
+            index += 1
+        if not numpy.array_equal(points[-1], goal):
+            points.append(goal)
+        return numpy.array(points)
+
+    def __len__(self):
+        return len(self.faces)
+
+
+def find_room_walkmesh(directory, room):
+    for name in [room, room.lower()]:
+        filename = os.path.join(directory, name + ".wok")
+        if os.path.exists(filename):
+            return filename
+    return None
+
+
+def load_area(lyt_filename, directory=None, **kwargs):
+    """
+        Loads the navmesh of an area from its layout. The room walkmeshes (<room>.wok) are read from
+        directory, which defaults to the directory of the layout. Rooms without walkmesh are skipped.
+    """
+    layout = lyt.read_lyt_file(lyt_filename)
+    directory = directory if directory else os.path.dirname(lyt_filename)
+    walkmeshes = []
+    for room in layout.rooms:
+        filename = find_room_walkmesh(directory, room.name)
+        if filename:
+            walkmeshes.append((wok.read_wok_file(filename), room.position))
+    return NavMesh.from_walkmeshes(walkmeshes, **kwargs)
+
+
+def print_statistics(filename, navmesh):
+    sizes = numpy.bincount(navmesh.components) if len(navmesh) else numpy.zeros(1, dtype=numpy.int64)
+    print("{}: {} walkable faces, {} rooms, {} components, largest component {:.1%}".format(
+        filename, len(navmesh), len(numpy.unique(navmesh.face_rooms)), len(sizes), sizes.max() / max(len(navmesh), 1)))
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='Build navigation meshes from area layouts and walkmeshes.')
+    parser.add_argument('input', nargs='+', help='path to lyt file(s)')
+    parser.add_argument('--dir', action='store', dest='directory', help='Directory with the wok files. Defaults to the directory of the lyt file.')
+    parser.add_argument('--path', nargs=6, type=float, metavar=('X1', 'Y1', 'Z1', 'X2', 'Y2', 'Z2'), help='find a path between two points')
+    parsed = parser.parse_args()
+
+    for filename in parsed.input:
+        navmesh = load_area(filename, parsed.directory)
+        print_statistics(filename, navmesh)
+        if parsed.path:
+            path = navmesh.find_path(parsed.path[0:3], parsed.path[3:6])
+            if path is None:
+                print("no path found")
+            else:
+                print("path length {:.2f} over {} faces".format(path.length(), len(path.faces)))
+                for point in path.points:
+                    print("  {:.2f} {:.2f} {:.2f}".format(*point))
+
+
+def main():
+    parse_command_line()
+
+
+if __name__ == "__main__":
+    main()
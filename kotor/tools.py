@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 import struct
 import json
+import time
 
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from multiprocessing import Pool
+
+import numpy
 
 
 def readlist(function, file, count):
@@ -47,6 +51,89 @@ def read8(file):
     return struct.unpack("b", data)[0]
 
 
+def read_array(file, dtype, count):
+    """Reads count elements of the numpy dtype with one read and returns them as (read only) numpy array."""
+    read_array_function = getattr(file, "read_array", None)
+    if read_array_function:
+        return read_array_function(dtype, count)
+    dtype = numpy.dtype(dtype)
+    size = dtype.itemsize * count
+    data = file.read(size)
+    if len(data) != size:
+        raise IOError("unexpected end of stream, {} bytes remaining".format(size - len(data)))
+    return numpy.frombuffer(data, dtype=dtype, count=count)
+
+
+def unpack(file, struct_format):
+    """
+        Unpacks the precompiled struct.Struct at the current position of the file and moves behind it.
+        A MemoryReader unpacks directly from its buffer, other files are read.
+    """
+    unpack_function = getattr(file, "unpack", None)
+    if unpack_function:
+        return unpack_function(struct_format)
+    return struct_format.unpack(file.read(struct_format.size))
+
+
+class MemoryReader:
+
+    """
+        File like reader over a bytes like object (bytes, bytearray, mmap). Structs and arrays are
+        decoded at absolute offsets in the buffer without copying the data.
+
+        @param data the buffer
+        @param start offset in the buffer which is position 0 of the reader
+        @param end end of the readable data in the buffer. Defaults to the end of the buffer.
+    """
+
+    def __init__(self, data, start=0, end=None):
+        self.data = data
+        self.buffer = memoryview(data)
+        self.start = start
+        self.end = len(data) if end is None else min(end, len(data))
+        self.position = 0
+
+    def read(self, size=-1):
+        start = self.start + self.position
+        end = self.end if size < 0 else min(start + size, self.end)
+        data = self.buffer[start:end].tobytes()
+        self.position += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.end - self.start
+        self.position = offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def unpack(self, struct_format):
+        values = struct_format.unpack_from(self.buffer, self.start + self.position)
+        self.position += struct_format.size
+        return values
+
+    def read_array(self, dtype, count):
+        dtype = numpy.dtype(dtype)
+        size = dtype.itemsize * count
+        start = self.start + self.position
+        if start + size > self.end:
+            raise IOError("unexpected end of stream, {} bytes remaining".format(start + size - self.end))
+        self.position += size
+        return numpy.frombuffer(self.buffer, dtype=dtype, count=count, offset=start)
+
+    def read_terminated(self, offset, terminator=b"\0"):
+        """Returns the bytes from offset up to (not including) the terminator."""
+        start = self.start + offset
+        end = self.data.find(terminator, start, self.end)
+        if end < 0:
+            end = self.end
+        return self.buffer[start:end].tobytes()
+
+
 def printHex(name, number):
     print(name, ":", number, "0x{0:x}".format(number))
 
@@ -111,22 +198,100 @@ def null_terminated(byte):
     return byte == b"\x00"
 
 
+def run_tasks(function, tasks, jobs=None, chunksize=4, initializer=None, initargs=()):
+    """
+        Runs the function for each task in a process pool (in order of completion). The function returns a tuple
+        with the name of the task as first and the error message or None as last element.
+
+        @param initializer called once in each worker process with initargs, i.e. to open a cache per process
+        @return (results without error, (name, error) of the failed tasks, elapsed seconds)
+    """
+    results = []
+    failed = []
+    start = time.perf_counter()
+    with Pool(jobs, initializer=initializer, initargs=initargs) as pool:
+        for result in pool.imap_unordered(function, tasks, chunksize=chunksize):
+            if result[-1]:
+                failed.append((result[0], result[-1]))
+            else:
+                results.append(result)
+    return results, failed, max(time.perf_counter() - start, 1e-9)
+
+
+# traversal orders of walk_tree
+PRE_ORDER = "pre-order"
+POST_ORDER = "post-order"
+BREADTH_FIRST = "breadth-first"
+
+
+# the tree functions use explicit stacks instead of recursion: each node costs O(1) independent of its depth
+# and deep trees don't hit the recursion limit. get_childs_function has to return a sequence.
 def visit_tree(node, get_childs_function, visitor, depth=0):
-    visitor(node, depth)
-    for child in get_childs_function(node):
-        visit_tree(child, get_childs_function, visitor, depth + 1)
+    """Calls visitor(node, depth) for all nodes of the tree in pre-order."""
+    for node, node_depth in walk_tree(node, get_childs_function):
+        visitor(node, node_depth + depth)
 
 
 def iterate_tree(node, get_childs_function):
-    yield node
-    for child in get_childs_function(node):
-        yield from iterate_tree(child, get_childs_function)
+    """Returns an iterator over all nodes of the tree in pre-order."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(get_childs_function(node)))
+
+
+def walk_tree(node, get_childs_function, order=PRE_ORDER):
+    """Returns an iterator over (node, depth) for all nodes of the tree in the order PRE_ORDER, POST_ORDER or BREADTH_FIRST."""
+    if order == PRE_ORDER:
+        stack = [(node, 0)]
+        while stack:
+            node, depth = stack.pop()
+            yield node, depth
+            stack.extend((child, depth + 1) for child in reversed(get_childs_function(node)))
+    elif order == POST_ORDER:
+        # a node is yielded when it is popped the second time, after all its children
+        stack = [(node, 0, False)]
+        while stack:
+            node, depth, expanded = stack.pop()
+            if expanded:
+                yield node, depth
+                continue
+            stack.append((node, depth, True))
+            stack.extend((child, depth + 1, False) for child in reversed(get_childs_function(node)))
+    elif order == BREADTH_FIRST:
+        queue = deque([(node, 0)])
+        while queue:
+            node, depth = queue.popleft()
+            yield node, depth
+            queue.extend((child, depth + 1) for child in get_childs_function(node))
+    else:
+        raise ValueError("unknown traversal order: {}".format(order))
+
+
+def filter_tree(node, get_childs_function, predicate, prune=False):
+    """
+        Returns an iterator over the nodes of the tree (in pre-order) for which predicate(node) is true.
+
+        @param prune don't descend into nodes for which the predicate is false
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if predicate(node):
+            yield node
+        elif prune:
+            continue
+        stack.extend(reversed(get_childs_function(node)))
 
 
 class Block:
 
     """
         Block of data read from the file. It is specified by it's start and length.
+
+        Readers trace the blocks they read with block()/start_block() and a with statement. Block records
+        the blocks (i.e. for block maps), NULL_BLOCK ignores them.
     """
 
     def __init__(self, name, start, file=None):
@@ -146,6 +311,10 @@ class Block:
         self.blocks.append(block)
         return block
 
+    def attach(self, file):
+        """Sets the file whose position is recorded by this block and all blocks started later."""
+        self.file = file
+
     def __enter__(self):
         if self.file:
             self.start = self.file.tell()
@@ -162,12 +331,56 @@ class Block:
         return self.blocks
 
     def sort(self):
-        self.blocks.sort(key=lambda block: block.start)
+        """Sorts the sub blocks on all levels by their start."""
+        for block in iterate_tree(self, Block.get_childs):
+            block.blocks.sort(key=lambda block: block.start)
 
     def __str__(self):
         return "{}, {}".format(self.start, self.end)
 
 
+class NullBlock:
+
+    """Block tracer which records nothing. block() and start_block() return the tracer itself, so tracing does not allocate."""
+
+    name = "null"
+    start = 0
+    end = 0
+    file = None
+    blocks = ()
+
+    def start_block(self, name, start):
+        return self
+
+    def block(self, name, file=None):
+        return self
+
+    def attach(self, file):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def close_block(self, end):
+        pass
+
+    def get_childs(self):
+        return self.blocks
+
+    def sort(self):
+        pass
+
+    def __reduce__(self):
+        # unpickled objects refer to the shared instance
+        return "NULL_BLOCK"
+
+
+NULL_BLOCK = NullBlock()
+
+
 # serialisation stuff
 def object_attributes_to_ordered_dict(obj,  attributes):
     """Returns the specified attributes  from the object in an OrderedDict."""
@@ -187,5 +400,8 @@ class Encoder(json.JSONEncoder):
         # is it a byte array? write as hex string
         if isinstance(object, bytes):
             return ",".join([hex(b) for b in object])
+        # numpy arrays and scalars (records are written as lists)
+        if isinstance(object, (numpy.ndarray, numpy.generic)):
+            return object.tolist()
         # Let the base class default method raise the TypeError
         return json.JSONEncoder.default(self, object)
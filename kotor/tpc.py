@@ -1,12 +1,36 @@
 import argparse
+import fnmatch
+import io
+import os
+import struct
 
+import numpy
+
+import kotor.dxt as dxt
+import kotor.erf as erf
+import kotor.key as key
+from kotor.cache import DiskCache, content_key, get_worker_cache, open_worker_cache
 from kotor.tools import *
-from PIL import Image, ImageDraw
+from PIL import Image
 
 
+# uncompressed encodings (data_size == 0)
+ENCODING_GRAYSCALE = 1
+ENCODING_RGB = 2
+ENCODING_RGBA = 4
+# compressed encodings (data_size != 0)
 ENCODING_DXT_1 = 2
 ENCODING_DXT_5 = 4
 
+DXT_ENCODINGS = {
+    "dxt1": ENCODING_DXT_1,
+    "dxt5": ENCODING_DXT_5
+}
+DXT_NAMES = dict((encoding, name) for name, encoding in DXT_ENCODINGS.items())
+
+# data size, reserved, width, height, encoding, mipmaps, unknown, reserved
+TPC_HEADER = struct.Struct("<IIHHBBH112s")
+
 class DX1Texel:
     def rgb565ToRgba32(self, color):
         return ((color & 0x1F) << 3) | (((color >> 5) & 0x3F) << 10) | (((color >> 11) & 0x1F) << 19) | 0xFF000000
@@ -85,6 +109,10 @@ class Header:
         # reserved
         file.read(112)
 
+    def is_compressed(self):
+        """Compressed textures store the size of the first mipmap in data_size, uncompressed textures store 0."""
+        return self.data_size != 0
+
     def __serialize__(self):
         return object_attributes_to_ordered_dict(self, ['data_size', 'reserved', 'width', 'height', 'encoding',  'mipmaps',  'unknown'])
 
@@ -98,42 +126,360 @@ def swapByte1And3(inValue):
         swap = (swap << 16) | (inValue >> 16 & 0xFF)
         return inValue & 0xFF00FF00 | swap
 
-texel_types = {
-    2: DX1Texel, 
-    4: DX5Texel
+# fourcc and bytes per 4x4 texel of the encodings which dds can store without conversion
+dds_formats = {
+    ENCODING_DXT_1: (b"DXT1", 8),
+    ENCODING_DXT_5: (b"DXT5", 16)
 }
 
-def extract(parsed, tpc_file):
-    with open(tpc_file, 'rb') as f:
-        header = Header(f);
-
-        img = Image.new('RGBA', (header.width,  header.height), color = 'cyan')
-        draw = ImageDraw.Draw(img)
-        for y in range(0,  header.height,  4):
-            for x in range(0, header.width, 4):
-                texel = texel_types.get(header.encoding)()
-                texel.read(f)
-                for dy in range(0, 4):
-                    for dx in range(0, 4):
-                        pixel = texel.get_pixel(dx, dy)
-                        draw.point( (x+dx, (header.height-1)-(y+dy)) ,  pixel)
-
-        img.save(tpc_file+'.png')
+# PIL mode and bytes per pixel of the uncompressed encodings
+pixel_formats = {
+    ENCODING_GRAYSCALE: ('L', 1),
+    ENCODING_RGB: ('RGB', 3),
+    ENCODING_RGBA: ('RGBA', 4)
+}
+
+DDSD_CAPS = 0x1
+DDSD_HEIGHT = 0x2
+DDSD_WIDTH = 0x4
+DDSD_PIXELFORMAT = 0x1000
+DDSD_MIPMAPCOUNT = 0x20000
+DDSD_LINEARSIZE = 0x80000
+DDPF_FOURCC = 0x4
+DDSCAPS_COMPLEX = 0x8
+DDSCAPS_TEXTURE = 0x1000
+DDSCAPS_MIPMAP = 0x400000
+
+# magic, size, flags, height, width, linear size, depth, mipmap count, reserved,
+# pixel format (size, flags, fourcc, bit count, 4 masks), caps (4 dwords), reserved
+DDS_HEADER = struct.Struct("<4s7I44s2I4s5I5I")
+
+
+def check_encoding(header):
+    formats = dds_formats if header.is_compressed() else pixel_formats
+    if header.encoding not in formats:
+        raise ValueError("unsupported {} encoding {}".format("compressed" if header.is_compressed() else "uncompressed", header.encoding))
+
+
+def mipmap_sizes(header):
+    """Returns the size in bytes of each mipmap level of the texture."""
+    check_encoding(header)
+    sizes = []
+    width = header.width
+    height = header.height
+    for level in range(max(header.mipmaps, 1)):
+        if header.is_compressed():
+            sizes.append(max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * dds_formats[header.encoding][1])
+        else:
+            sizes.append(width * height * pixel_formats[header.encoding][1])
+        width = max(1, width // 2)
+        height = max(1, height // 2)
+    return sizes
+
+
+def dds_header(header):
+    """Returns the dds file header (including magic) for the tpc header."""
+    if not header.is_compressed() or header.encoding not in dds_formats:
+        raise ValueError("encoding {} cannot be exported to dds without conversion".format(header.encoding))
+    fourcc, texel_size = dds_formats[header.encoding]
+    mipmaps = max(header.mipmaps, 1)
+    flags = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT | DDSD_LINEARSIZE
+    caps = DDSCAPS_TEXTURE
+    if mipmaps > 1:
+        flags |= DDSD_MIPMAPCOUNT
+        caps |= DDSCAPS_COMPLEX | DDSCAPS_MIPMAP
+    return DDS_HEADER.pack(b"DDS ", 124, flags, header.height, header.width, mipmap_sizes(header)[0], 0, mipmaps, bytes(44),
+                           32, DDPF_FOURCC, fourcc, 0, 0, 0, 0, 0,
+                           caps, 0, 0, 0, 0)
+
+
+def write_dds(file, destination_file, flip=False):
+    """
+        Copies a compressed tpc texture to a dds file without decoding it.
+
+        @param file stream positioned at the start of the tpc
+        @param destination_file stream where the dds file is written to
+        @param flip rows are stored bottom up. Without flip the texel data is copied as is. With flip the blocks of
+                    each mipmap are flipped (without decoding them), so the first row is at the top like in the png
+                    export. Raises ValueError for heights which can't be flipped exactly, see dxt.flip_blocks.
+        @return the tpc header
+    """
+    start = file.tell()
+    header = Header(file)
+    sizes = mipmap_sizes(header)
+    heights = [max(1, header.height >> level) for level in range(len(sizes))]
+    if flip and any(height >= 4 and height % 4 for height in heights):
+        raise ValueError("cannot flip the blocks of a texture with height {} exactly".format(header.height))
+    destination_file.write(dds_header(header))
+    if not flip:
+        for chunk in read_partial_stream(file, start + 128, sum(sizes)):
+            destination_file.write(chunk)
+        return header
+
+    file.seek(start + 128)
+    for level, size in enumerate(sizes):
+        data = file.read(size)
+        if len(data) != size:
+            raise IOError("unexpected end of stream, {} bytes remaining".format(size - len(data)))
+        destination_file.write(dxt.flip_blocks(data, max(1, header.width >> level), heights[level], DXT_NAMES[header.encoding]))
+    return header
+
+def read_compressed_pixels(file, encoding, width, height):
+    """Decodes all dxt blocks of the mipmap at once with dxt.decompress."""
+    size = max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * dds_formats[encoding][1]
+    data = file.read(size)
+    if len(data) != size:
+        raise IOError("unexpected end of stream, {} bytes remaining".format(size - len(data)))
+    return Image.fromarray(dxt.decompress(data, width, height, DXT_NAMES[encoding]), 'RGBA')
+
+
+def read_uncompressed_pixels(file, encoding, width, height):
+    mode, pixel_size = pixel_formats[encoding]
+    size = width * height * pixel_size
+    data = file.read(size)
+    if len(data) != size:
+        raise IOError("unexpected end of stream, {} bytes remaining".format(size - len(data)))
+    pixels = numpy.frombuffer(data, dtype=numpy.uint8).reshape(height, width, pixel_size)
+    return Image.fromarray(pixels[:, :, 0] if pixel_size == 1 else pixels, mode).convert('RGBA')
+
+
+def read_txi(file, header, start=0):
+    """
+        Returns the txi text block which follows the texture data or an empty string.
+
+        @param file stream containing the tpc
+        @param header the tpc header
+        @param start offset of the tpc in the stream
+    """
+    file.seek(start + 128 + sum(mipmap_sizes(header)))
+    return file.read().partition(b'\0')[0].decode("latin-1")
+
+
+def read_texture(file, mipmap=0, flip=True):
+    """
+        Reads a tpc texture from the stream and returns the decoded image.
+        The txi text block is stored in the info dictionary of the image ("txi").
+
+        @param file stream positioned at the start of the tpc
+        @param mipmap mipmap level to decode
+        @param flip rows are stored bottom up. flip the image so the first row is at the top.
+    """
+    start = file.tell()
+    header = Header(file)
+    sizes = mipmap_sizes(header)
+    if not 0 <= mipmap < len(sizes):
+        raise ValueError("mipmap level {} not in texture with {} mipmaps".format(mipmap, len(sizes)))
+
+    file.seek(start + 128 + sum(sizes[:mipmap]))
+    width = max(1, header.width >> mipmap)
+    height = max(1, header.height >> mipmap)
+    if header.is_compressed():
+        img = read_compressed_pixels(file, header.encoding, width, height)
+    else:
+        img = read_uncompressed_pixels(file, header.encoding, width, height)
+    if flip:
+        img = img.transpose(Image.FLIP_TOP_BOTTOM)
+    img.info["txi"] = read_txi(file, header, start)
+    return img
+
+
+# width, height, length of txi text
+CACHED_TEXTURE_HEADER = struct.Struct("<III")
+
+# increment when the decoded images change, so old cache entries are not used anymore
+TEXTURE_CACHE_VERSION = 2
+
+
+def texture_cache_key(data, mipmap, flip):
+    return content_key(data, "tpc", str(TEXTURE_CACHE_VERSION), str(mipmap), str(flip))
+
+
+def load_texture(data, mipmap=0, flip=True, cache=None):
+    """
+        Decodes a tpc texture from its file content. See read_texture.
+
+        @param cache DiskCache with decoded textures. Textures found in the cache are not decoded again,
+                     decoded textures are added to the cache.
+    """
+    if cache is None:
+        return read_texture(io.BytesIO(data), mipmap, flip)
+
+    key = texture_cache_key(data, mipmap, flip)
+    cached = cache.get(key)
+    if cached is not None:
+        width, height, txi_size = CACHED_TEXTURE_HEADER.unpack_from(cached)
+        txi_end = CACHED_TEXTURE_HEADER.size + txi_size
+        img = Image.frombuffer('RGBA', (width, height), cached[txi_end:], 'raw', 'RGBA', 0, 1)
+        img.info["txi"] = cached[CACHED_TEXTURE_HEADER.size:txi_end].decode("latin-1")
         return img
 
+    img = read_texture(io.BytesIO(data), mipmap, flip)
+    txi = img.info["txi"].encode("latin-1")
+    cache.put(key, CACHED_TEXTURE_HEADER.pack(img.width, img.height, len(txi)) + txi + img.tobytes())
+    return img
+
+
+def save_texture(img, filename):
+    """Saves the image as png and the txi block (if any) next to it."""
+    img.save(filename + '.png')
+    if img.info.get("txi"):
+        with open(filename + '.txi', 'w') as txi_file:
+            txi_file.write(img.info["txi"])
+
+
+def write_tpc(destination_file, img, encoding=None, preset="normal", threads=None):
+    """
+        Compresses the image to a dxt1 or dxt5 tpc with the complete mipmap chain.
+
+        @param destination_file stream where the tpc is written to
+        @param img PIL image
+        @param encoding "dxt1", "dxt5" or None to use dxt5 only for images with transparent pixels
+        @param preset speed/quality preset, one of dxt.PRESETS
+        @param threads number of threads used to compress large textures
+        @return the number of mipmaps written
+    """
+    pixels = numpy.asarray(img.convert('RGBA'))
+    if encoding is None:
+        encoding = "dxt5" if (pixels[:, :, 3] < 255).any() else "dxt1"
+    # rows are stored bottom up
+    levels = [dxt.compress(level, encoding, preset, threads) for level in dxt.mipmaps(pixels[::-1])]
+    height, width = pixels.shape[:2]
+    destination_file.write(TPC_HEADER.pack(len(levels[0]), 0, width, height, DXT_ENCODINGS[encoding], len(levels), 0, bytes(112)))
+    for level in levels:
+        destination_file.write(level)
+    return len(levels)
+
+
+def open_cache(parsed):
+    if not parsed.cache:
+        return None
+    return DiskCache(parsed.cache, parsed.cache_size * 1024 * 1024)
 
-def execute_action(parsed, erfFile):
+
+def extract(parsed, tpc_file):
+    with open(tpc_file, 'rb') as f:
+        img = load_texture(f.read(), parsed.mipmap, cache=open_cache(parsed))
+
+    save_texture(img, tpc_file)
+    return img
+
+
+def extract_files(parsed, tpc_files):
+    for tpc_file in tpc_files:
+        extract(parsed, tpc_file)
+
+
+def create_files(parsed, image_files):
+    for image_file in image_files:
+        tpc_file = os.path.splitext(image_file)[0] + '.tpc'
+        with open(tpc_file, 'wb') as destination_file:
+            write_tpc(destination_file, Image.open(image_file), parsed.encoding, parsed.preset)
+        print("created", tpc_file)
+
+
+def export_dds_files(parsed, tpc_files):
+    for tpc_file in tpc_files:
+        with open(tpc_file, 'rb') as f:
+            with open(tpc_file+'.dds', 'wb') as destination_file:
+                write_dds(f, destination_file, parsed.flip_dds)
+
+
+def convert_archive_entry(task):
+    """
+        Converts one texture from an archive to png or dds. Runs in a worker process, decoded textures
+        are cached in the cache of the worker (see open_worker_cache).
+
+        @param task tuple (archive path, offset, size, ressource name, output directory, output format, flip dds)
+        @return tuple (ressource name, size of tpc data, number of pixels, error message or None)
+    """
+    archive_path, offset, size, name, directory, output_format, flip_dds = task
+    try:
+        with open(archive_path, 'rb') as file:
+            data = b"".join(read_partial_stream(file, offset, size))
+        if output_format == 'dds':
+            with open(os.path.join(directory, name + '.dds'), 'wb') as destination_file:
+                header = write_dds(io.BytesIO(data), destination_file, flip_dds)
+            return name, size, header.width * header.height, None
+        img = load_texture(data, cache=get_worker_cache())
+        save_texture(img, os.path.join(directory, name))
+        return name, size, img.width * img.height, None
+    except Exception as e:
+        return name, size, 0, "{}: {}".format(type(e).__name__, e)
+
+
+def find_erf_textures(erf_files):
+    """Returns (archive path, offset, size, name) for each tpc in the erf files."""
+    for erf_file in erf_files:
+        erfFile = erf.readErfDirectory(erf_file)
+        if not erfFile:
+            continue
+        for entry in erfFile.entries:
+            if entry.type.extension == 'tpc':
+                yield erf_file, entry.offset, entry.size, entry.name
+
+
+def find_bif_textures(key_file, bif_files):
+    """Returns (archive path, offset, size, name) for each tpc in the bif files referenced by the key file."""
+    keyFile = key.readKeyDirectory(key_file)
+    for entry, bif_path, bifEntry in key.find_resources(keyFile, bif_files, 'tpc'):
+        yield bif_path, bifEntry.offset, bifEntry.size, entry.name
+
+
+def batch_convert(parsed, archives):
+    if parsed.key:
+        textures = find_bif_textures(parsed.key, archives)
+    else:
+        textures = find_erf_textures(archives)
+    if parsed.filter:
+        textures = (texture for texture in textures if fnmatch.fnmatch(texture[3], parsed.filter))
+
+    directory = parsed.directory or os.curdir
+    os.makedirs(directory, exist_ok=True)
+    tasks = [texture + (directory, parsed.format, parsed.flip_dds) for texture in textures]
+
+    cache_size = parsed.cache_size * 1024 * 1024
+    results, failed, elapsed = run_tasks(convert_archive_entry, tasks, parsed.jobs,
+                                         initializer=open_worker_cache, initargs=(parsed.cache, cache_size))
+    converted = len(results)
+    input_bytes = sum(size for name, size, pixel_count, error in results)
+    pixels = sum(pixel_count for name, size, pixel_count, error in results)
+
+    for name, error in failed:
+        print("error: cannot convert {}: {}".format(name, error))
+    print("converted {} of {} textures to {} in {:.2f}s".format(converted, len(tasks), directory, elapsed))
+    print("throughput: {:.1f} textures/s, {:.2f} MB/s, {:.2f} MPixel/s".format(
+        converted / elapsed, input_bytes / elapsed / 1e6, pixels / elapsed / 1e6))
+
+
+def execute_action(parsed, inputs):
     switcher= {
-        "extract" : extract,
+        "extract" : extract_files,
+        "create" : create_files,
+        "dds" : export_dds_files,
+        "batch" : batch_convert,
     }
     func = switcher.get(parsed.action, not_yet_implemented)
-    func(parsed, erfFile)
+    func(parsed, inputs)
 
 
 def parse_command_line():
-    parser = argparse.ArgumentParser(description='Process ERF files.')
-    parser.add_argument('input', help='path to erf file')
-    parser.add_argument('-x', action='store_const', dest='action', const='extract', help='Extract file <file> from erf file')
+    parser = argparse.ArgumentParser(description='Process TPC files.')
+    parser.add_argument('input', nargs='+', help='path to tpc file(s) or image file(s) (-c). In batch mode: erf files or bif files (with --key)')
+    parser.add_argument('-x', action='store_const', dest='action', const='extract', help='Convert tpc file(s) to <file>.png')
+    parser.add_argument('-c', action='store_const', dest='action', const='create', help='Create <file>.tpc from image file(s)')
+    parser.add_argument('--encoding', choices=sorted(DXT_ENCODINGS), help='encoding of created tpc files. (default: dxt5 for images with transparency, dxt1 otherwise)')
+    parser.add_argument('--preset', choices=sorted(dxt.PRESETS), default='normal', help='compression speed/quality of created tpc files. (default: normal)')
+    parser.add_argument('-d', action='store_const', dest='action', const='dds', help='Copy compressed tpc file(s) to <file>.dds without decoding. The rows stay bottom up, see --flip-dds.')
+    parser.add_argument('-b', action='store_const', dest='action', const='batch', help='Convert all tpc files from erf or bif files to png')
+    parser.add_argument('-f', dest='format', choices=['png', 'dds'], default='png', help='output format in batch mode. png files have top down rows, dds files are copied as is (see --flip-dds). (default: png)')
+    parser.add_argument('--flip-dds', action='store_true', help='flip the blocks of dds files (-d, -f dds) without decoding them, so the rows are top down like in the png files. Only for heights which are a multiple of 4.')
+    parser.add_argument('--key', help='path to key file (i.e. chitin.key). Batch mode reads from bif files instead of erf files.')
+    parser.add_argument('--filter', help='only convert textures matching this pattern (i.e. "lda_*")')
+    parser.add_argument('--dir', action='store', dest='directory', help='Directory where to write the png files. Defaults to current directory.')
+    parser.add_argument('--mipmap', type=int, default=0, help='mipmap level to convert with -x. (default: 0)')
+    parser.add_argument('--cache', metavar='DIRECTORY', help='cache decoded textures in this directory. Cached textures are not decoded again.')
+    parser.add_argument('--cache-size', type=int, default=1024, help='maximum size of the texture cache in MB. (default: 1024)')
+    parser.add_argument('-j', dest='jobs', type=int, default=None, help='number of worker processes (default: number of cpus)')
 
     parsed = parser.parse_args()
 
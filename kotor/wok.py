@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import argparse
+import struct
+
+import numpy
+
+from kotor.tools import *
+from kotor.model.aabb import AabbTree
+
+
+# binary walkmesh (BWM V1.0). area walkmeshes (wok) have type 1, placeable and door walkmeshes (pwk, dwk) type 0.
+WOK_HEADER = struct.Struct("<4s4sI3f3f3f3f3f16I")
+WOK_AABB = numpy.dtype([
+    ('minimum', '<f4', (3,)),
+    ('maximum', '<f4', (3,)),
+    ('face', '<i4'),
+    ('unknown', '<u4'),
+    ('plane', '<u4'),
+    ('children', '<i4', (2,)),
+])
+WALKMESH_TYPE_AREA = 1
+
+
+class Walkmesh:
+    def __init__(self, header_values):
+        (self.file_type, self.version, self.walkmesh_type) = header_values[0:3]
+        self.relative_use_positions = (header_values[3:6], header_values[6:9])
+        self.absolute_use_positions = (header_values[9:12], header_values[12:15])
+        self.position = header_values[15:18]
+        (self.vertex_count, self.vertex_offset, self.face_count, self.faces_offset, self.materials_offset,
+         self.normals_offset, self.distances_offset, self.aabb_count, self.aabb_offset, self.unknown,
+         self.adjacency_count, self.adjacency_offset, self.edge_count, self.edge_offset,
+         self.perimeter_count, self.perimeter_offset) = header_values[18:34]
+        # read later
+        self.vertices = numpy.zeros((0, 3), dtype='<f4')
+        self.faces = numpy.zeros((0, 3), dtype='<u4')
+        self.materials = numpy.zeros(0, dtype='<u4')
+        self.normals = numpy.zeros((0, 3), dtype='<f4')
+        self.distances = numpy.zeros(0, dtype='<f4')
+        # adjacent edges (face * 3 + edge, -1 for none) of the walkable faces, which are stored first
+        self.adjacency = numpy.zeros((0, 3), dtype='<i4')
+        # (edge, transition) of the perimeter edges
+        self.edges = numpy.zeros((0, 2), dtype='<i4')
+        self.perimeters = numpy.zeros(0, dtype='<u4')
+        self.aabb_tree = None
+
+    def read_data(self, file):
+        def read_block(offset, dtype, count):
+            file.seek(offset)
+            return read_array(file, dtype, count)
+
+        self.vertices = read_block(self.vertex_offset, '<f4', self.vertex_count * 3).reshape(-1, 3)
+        self.faces = read_block(self.faces_offset, '<u4', self.face_count * 3).reshape(-1, 3)
+        self.materials = read_block(self.materials_offset, '<u4', self.face_count)
+        self.normals = read_block(self.normals_offset, '<f4', self.face_count * 3).reshape(-1, 3)
+        self.distances = read_block(self.distances_offset, '<f4', self.face_count)
+        self.adjacency = read_block(self.adjacency_offset, '<i4', self.adjacency_count * 3).reshape(-1, 3)
+        self.edges = read_block(self.edge_offset, '<i4', self.edge_count * 2).reshape(-1, 2)
+        self.perimeters = read_block(self.perimeter_offset, '<u4', self.perimeter_count)
+        if self.aabb_count:
+            nodes = read_block(self.aabb_offset, WOK_AABB, self.aabb_count)
+            self.aabb_tree = AabbTree(nodes['minimum'], nodes['maximum'], nodes['children'], nodes['face'], nodes['plane'])
+            self.aabb_tree.set_triangles(self.vertices, self.faces)
+
+
+def read_wok(file):
+    """Reads a binary walkmesh (wok, pwk or dwk)."""
+    walkmesh = Walkmesh(unpack(file, WOK_HEADER))
+    if walkmesh.file_type != b"BWM " or walkmesh.version != b"V1.0":
+        raise ValueError("not a binary walkmesh: {} {}".format(walkmesh.file_type, walkmesh.version))
+    walkmesh.read_data(file)
+    return walkmesh
+
+
+def read_wok_file(filename):
+    with open(filename, "rb") as file:
+        return read_wok(MemoryReader(file.read()))
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(description='Process WOK files.')
+    parser.add_argument('input', help='path to wok file')
+    parsed = parser.parse_args()
+
+    walkmesh = read_wok_file(parsed.input)
+    print("type: {}, position: {}".format(walkmesh.walkmesh_type, walkmesh.position))
+    print("vertices: {}, faces: {}, walkable faces: {}, aabb nodes: {}".format(
+        walkmesh.vertex_count, walkmesh.face_count, walkmesh.adjacency_count, walkmesh.aabb_count))
+
+
+def main():
+    parse_command_line()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import kotor.cache as cache
+import os
+
+
+def test_content_key():
+    assert cache.content_key(b"ab", "c") == cache.content_key(b"ab", b"c")
+    assert cache.content_key(b"ab", "c") != cache.content_key(b"a", "bc")
+    assert len(cache.content_key(b"")) == 40
+
+
+def test_put_get(tmp_path):
+    disk_cache = cache.DiskCache(str(tmp_path))
+    key = cache.content_key(b"data")
+    assert disk_cache.get(key) is None
+    path = disk_cache.put(key, b"value")
+    assert os.path.exists(path)
+    assert disk_cache.get(key) == b"value"
+    assert disk_cache.lookup(key) == path
+    assert disk_cache.size() == 5
+
+
+def test_evicts_least_recently_used(tmp_path):
+    disk_cache = cache.DiskCache(str(tmp_path), max_size=30)
+    keys = [cache.content_key(str(index)) for index in range(3)]
+    for index, key in enumerate(keys):
+        disk_cache.put(key, bytes(10))
+        # make the access times distinct
+        os.utime(disk_cache.path(key), (index, index))
+    # use the first entry, so the second one is the oldest
+    assert disk_cache.get(keys[0]) is not None
+    disk_cache.max_size = 25
+    disk_cache.evict()
+    assert disk_cache.get(keys[1]) is None
+    assert disk_cache.get(keys[0]) == bytes(10)
+    assert disk_cache.get(keys[2]) == bytes(10)
+
+
+def test_put_evicts_when_full(tmp_path):
+    disk_cache = cache.DiskCache(str(tmp_path), max_size=25)
+    for index in range(5):
+        disk_cache.put(cache.content_key(str(index)), bytes(10))
+    assert disk_cache.size() <= 25
+
+
+def test_put_replaces_entry_size(tmp_path):
+    disk_cache = cache.DiskCache(str(tmp_path), max_size=50)
+    key = cache.content_key("a")
+    disk_cache.put(key, bytes(10))
+
+    def fail():
+        raise AssertionError("cache evicted")
+    disk_cache.evict = fail
+    for size in [20, 15, 20]:
+        disk_cache.put(key, bytes(size))
+    assert disk_cache.estimated_size == 20
+    assert disk_cache.get(key) == bytes(20)
+
+
+def test_clear(tmp_path):
+    disk_cache = cache.DiskCache(str(tmp_path))
+    disk_cache.put(cache.content_key("a"), b"a")
+    disk_cache.clear()
+    assert disk_cache.size() == 0
+
+
+def test_dump_load_objects():
+    import numpy
+    arrays = {"a": numpy.arange(5, dtype='<f4'), "b": numpy.arange(12, dtype='<u2').reshape(4, 3)[:, 1], "name": "x"}
+    data = cache.dump_objects(arrays)
+    loaded = cache.load_objects(data)
+    assert loaded["name"] == "x"
+    assert loaded["a"].tolist() == [0, 1, 2, 3, 4]
+    assert loaded["b"].tolist() == [1, 4, 7, 10]
+    # contiguous arrays are views on the serialized data
+    assert not loaded["a"].flags.writeable
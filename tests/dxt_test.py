@@ -0,0 +1,70 @@
+import kotor.dxt as dxt
+import numpy
+import pytest
+
+
+def gradient_image(width, height, alpha=255):
+    y, x = numpy.mgrid[0:height, 0:width]
+    return numpy.stack([x * 255 // max(width - 1, 1), y * 255 // max(height - 1, 1), (x + y) % 256, numpy.full_like(x, alpha)], axis=-1).astype(numpy.uint8)
+
+
+def test_compress_solid_color_is_lossless():
+    pixels = numpy.zeros((8, 8, 4), dtype=numpy.uint8)
+    pixels[:] = (0xFF, 0x00, 0x84, 0xFF)
+    data = dxt.compress(pixels, "dxt1")
+    assert len(data) == 4 * 8
+    assert (dxt.decompress(data, 8, 8, "dxt1") == pixels).all()
+
+
+@pytest.mark.parametrize("preset", sorted(dxt.PRESETS))
+def test_compress_roundtrip(preset):
+    pixels = gradient_image(32, 16)
+    decoded = dxt.decompress(dxt.compress(pixels, "dxt1", preset), 32, 16, "dxt1")
+    assert decoded.shape == (16, 32, 4)
+    assert numpy.abs(decoded.astype(int) - pixels).mean() < 4
+
+
+def test_compress_dxt5_alpha():
+    pixels = gradient_image(8, 4)
+    pixels[:, :, 3] = numpy.arange(8, dtype=numpy.uint8)[None, :] * 32
+    data = dxt.compress(pixels, "dxt5")
+    assert len(data) == 2 * 16
+    decoded = dxt.decompress(data, 8, 4, "dxt5")
+    assert numpy.abs(decoded[:, :, 3].astype(int) - pixels[:, :, 3]).max() <= 10
+
+
+def test_decompress_dxt5_always_has_4_colors():
+    # color0 < color1 selects the 3 color mode in dxt1 only
+    color0, color1 = 0x001F, 0xF800
+    color_block = numpy.array([color0, color1], dtype="<u2").tobytes() + bytes([0b11100100] * 4)
+    alpha_block = bytes([255, 255]) + bytes(6)
+    decoded = dxt.decompress(alpha_block + color_block, 4, 4, "dxt5")
+    # indices 0, 1, 2, 3 in each row: blue, red and the two colors between them
+    assert decoded[0, :, :3].tolist() == [[0, 0, 255], [255, 0, 0], [85, 0, 170], [170, 0, 85]]
+    assert (decoded[:, :, 3] == 255).all()
+    dxt1 = dxt.decompress(color_block, 4, 4, "dxt1")
+    assert dxt1[0, 2].tolist() == [128, 0, 128, 255] and dxt1[0, 3].tolist() == [0, 0, 0, 0]
+
+
+def test_compress_pads_odd_sizes():
+    pixels = gradient_image(5, 3)
+    data = dxt.compress(pixels, "dxt1")
+    assert len(data) == 2 * 8
+    assert dxt.decompress(data, 5, 3, "dxt1").shape == (3, 5, 4)
+
+
+def test_compress_threads_match_single_thread(monkeypatch):
+    monkeypatch.setattr(dxt, "THREAD_CHUNK_BLOCKS", 4)
+    pixels = gradient_image(32, 32)
+    assert dxt.compress(pixels, "dxt5", threads=4) == dxt.compress(pixels, "dxt5", threads=1)
+
+
+def test_compress_unknown_encoding():
+    with pytest.raises(ValueError):
+        dxt.compress(gradient_image(4, 4), "dxt3")
+
+
+def test_mipmaps():
+    levels = dxt.mipmaps(gradient_image(8, 2))
+    assert [level.shape[:2] for level in levels] == [(2, 8), (1, 4), (1, 2), (1, 1)]
+    assert len(dxt.mipmaps(gradient_image(8, 8), 2)) == 2
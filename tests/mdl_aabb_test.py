@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import kotor.model.aabb as aabb
+import kotor.model.mdl as mdl
+from .testutil import *
+import io
+import numpy
+import pytest
+
+
+def grid_walkmesh(size=4):
+    """Square of size x size quads (two faces each) in the plane z = 0."""
+    vertices = [(float(x), float(y), 0.0) for y in range(size + 1) for x in range(size + 1)]
+    faces = []
+    for y in range(size):
+        for x in range(size):
+            corner = y * (size + 1) + x
+            faces.append(((corner, corner + 1, corner + size + 2), (0xFFFF,) * 3, 1))
+            faces.append(((corner, corner + size + 2, corner + size + 1), (0xFFFF,) * 3, 1))
+    return NodeSpec("grid_walkmesh", children=[NodeSpec("walkmesh", 0x221, vertices=vertices, faces=faces)])
+
+
+@pytest.fixture
+def tree():
+    data, mdx = model_data(grid_walkmesh())
+    return mdl.read_model_data(data, mdx).node_by_name["walkmesh"].headers["AABB"].aabb_tree
+
+
+def test_read_aabb_tree(tree):
+    assert len(tree) == 2 * 32 - 1
+    assert sorted(tree.faces[tree.faces >= 0].tolist()) == list(range(32))
+    assert (tree.children[tree.faces >= 0] == -1).all()
+    assert (tree.children[tree.faces < 0] >= 0).all()
+    assert tree.minimum[0].tolist() == [0.0, 0.0, 0.0]
+    assert tree.maximum[0].tolist() == [4.0, 4.0, 0.0]
+    assert tree.triangles.shape == (32, 3, 3)
+
+
+def test_read_deep_aabb_tree_iteratively():
+    # chain of inner nodes, each with one leaf. deeper than the recursion limit.
+    depth = 3000
+    # offset 0 means no child, so the tree starts at offset 40
+    data = bytearray(40)
+    for level in range(depth):
+        inner = len(data)
+        leaf = inner + 40
+        next_inner = inner + 80 if level < depth - 1 else 0
+        data += struct.pack("=6fIIiI", 0, 0, 0, 1, 1, 1, leaf, next_inner, -1, 0)
+        data += struct.pack("=6fIIiI", 0, 0, 0, 1, 1, 1, 0, 0, level, 0)
+    tree = aabb.read_aabb_tree(io.BytesIO(bytes(data)), 40)
+    assert len(tree) == 2 * depth
+    assert sorted(tree.faces[tree.faces >= 0].tolist()) == list(range(depth))
+
+
+def test_boxes_containing(tree):
+    points, faces = tree.boxes_containing([(0.75, 0.25, 0.0), (10.0, 0.0, 0.0)])
+    assert set(points.tolist()) == {0}
+    # the point lies in the boxes of both faces of the first quad
+    assert sorted(faces.tolist()) == [0, 1]
+
+
+def test_raycast_matches_brute_force(tree):
+    random = numpy.random.default_rng(7)
+    origins = numpy.column_stack([random.uniform(-1, 5, 200), random.uniform(-1, 5, 200), numpy.full(200, 2.0)])
+    directions = numpy.column_stack([random.uniform(-0.5, 0.5, (200, 2)), numpy.full(200, -1.0)])
+    distances, faces = tree.raycast(origins, directions)
+
+    all_hits = numpy.stack([aabb.intersect_triangles(origins, directions, numpy.repeat(tree.triangles[face:face + 1], 200, axis=0))
+                            for face in range(32)], axis=1)
+    expected = all_hits.min(axis=1)
+    assert distances == pytest.approx(expected)
+    hit = numpy.isfinite(expected)
+    assert hit.any() and (~hit).any()
+    assert (faces[~hit] == -1).all()
+    assert all_hits[hit, faces[hit]] == pytest.approx(expected[hit])
+
+
+def test_raycast_max_distance(tree):
+    distances, faces = tree.raycast([(1.5, 1.5, 2.0)], [(0.0, 0.0, -1.0)], max_distance=1.0)
+    assert faces.tolist() == [-1]
+    distances, faces = tree.raycast([(1.5, 1.5, 2.0)], [(0.0, 0.0, -1.0)], max_distance=3.0)
+    assert distances.tolist() == [2.0]
+
+
+def test_line_of_sight(tree):
+    starts = [(1.0, 1.0, 1.0), (1.2, 1.3, 1.0), (-2.0, -2.0, -1.0)]
+    ends = [(3.0, 2.0, 1.0), (1.2, 1.3, -1.0), (6.0, 6.0, -1.0)]
+    assert tree.line_of_sight(starts, ends).tolist() == [True, False, True]
+
+
+def test_nearest_faces_matches_brute_force(tree):
+    random = numpy.random.default_rng(3)
+    points = random.uniform(-2, 6, (300, 3))
+    distances, faces, closest = tree.nearest_faces(points)
+
+    all_distances = numpy.stack([numpy.linalg.norm(aabb.closest_points_on_triangles(points, numpy.repeat(tree.triangles[face:face + 1], 300, axis=0)) - points, axis=1)
+                                 for face in range(32)], axis=1)
+    assert distances == pytest.approx(all_distances.min(axis=1))
+    assert all_distances[numpy.arange(300), faces] == pytest.approx(distances)
+    assert numpy.linalg.norm(closest - points, axis=1) == pytest.approx(distances)
+
+
+def test_nearest_faces_inner_node_without_children():
+    # the root has a leaf (face 0) and an inner node without children, which is nearer to the point
+    tree = aabb.AabbTree(numpy.array([[0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [5.0, 0.0, 0.0]]),
+                         numpy.array([[6.0, 1.0, 0.0], [1.0, 1.0, 0.0], [6.0, 1.0, 0.0]]),
+                         numpy.array([[1, 2], [-1, -1], [-1, -1]]), numpy.array([-1, 0, -1]))
+    tree.set_triangles([(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0)], [(0, 1, 2)])
+    distances, faces, closest = tree.nearest_faces([(5.5, 0.5, 0.0), (0.2, 0.2, 1.0)])
+    assert faces.tolist() == [0, 0]
+    assert distances == pytest.approx([numpy.hypot(4.5, 0.5), 1.0])
+
+
+def test_closest_points_on_triangles():
+    triangle = numpy.array([[[0.0, 0.0, 0.0], [2.0, 0.0, 0.0], [0.0, 2.0, 0.0]]] * 4)
+    points = numpy.array([[0.5, 0.5, 3.0], [-1.0, -1.0, 0.0], [1.0, -1.0, 0.0], [2.0, 2.0, 0.0]])
+    closest = aabb.closest_points_on_triangles(points, triangle)
+    assert closest.tolist() == [[0.5, 0.5, 0.0], [0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [1.0, 1.0, 0.0]]
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import kotor.model.animation as animation
+import kotor.model.mdl as mdl
+import kotor.model.nodes as nodes
+import kotor.tools as tools
+from .testutil import *
+import math
+import numpy
+import pytest
+
+
+def packed_float(value):
+    """Returns the float with the bits of the 32 bit value (compressed quaternions are stored in the float data)."""
+    return struct.unpack("=f", struct.pack("=I", value))[0]
+
+
+def walk_model():
+    half_turn = math.sqrt(0.5)
+    arm = NodeSpec("arm", controllers=[
+        (8, [0.0, 1.0, 2.0], [(0.0, 0.0, 0.0), (2.0, 0.0, 0.0), (2.0, 4.0, 0.0)]),
+        # quarter turn around z, (x, y, z, w)
+        (20, [0.0, 1.0], [(0.0, 0.0, 0.0, 1.0), (0.0, 0.0, half_turn, half_turn)]),
+    ])
+    leg = NodeSpec("leg", controllers=[
+        (36, [0.5], [(2.0,)]),
+        # bezier position: value, in tangent and out tangent per row
+        (8, [0.0, 2.0], [(1.0, 1.0, 1.0, 9.0, 9.0, 9.0, 7.0, 7.0, 7.0), (3.0, 3.0, 3.0, 9.0, 9.0, 9.0, 7.0, 7.0, 7.0)], 0x13),
+    ])
+    animation_root = NodeSpec("walk_model", children=[arm, leg])
+    root = NodeSpec("walk_model", children=[NodeSpec("arm"), NodeSpec("leg")])
+    walk = AnimationSpec("walk", 2.0, animation_root, events=[(1.0, "snd_footstep")])
+    return model_data(root, animations=[walk])
+
+
+@pytest.fixture
+def walk():
+    data, mdx = walk_model()
+    return mdl.read_model_data(data, mdx, tools.Block("root", 0)).model_header.animations[0]
+
+
+def controllers_by_type(walk, node_name):
+    node = next(node for node in tools.iterate_tree(walk.animation_node, nodes.Node.get_childs) if node.name == node_name)
+    return {controller.controller_type_id: controller for controller in node.node_header.controllers.data}
+
+
+def test_controller_arrays(walk):
+    position = controllers_by_type(walk, "arm")[8]
+    assert position.times.dtype == numpy.float32
+    assert list(position.times) == [0.0, 1.0, 2.0]
+    assert position.values.shape == (3, 3)
+    assert position.values.flags['C_CONTIGUOUS']
+    assert [row.values for row in position.rows] == [[0.0, 0.0, 0.0], [2.0, 0.0, 0.0], [2.0, 4.0, 0.0]]
+
+
+def test_bezier_controller_skips_tangents(walk):
+    position = controllers_by_type(walk, "leg")[8]
+    assert position.bezier
+    assert position.values.tolist() == [[1.0, 1.0, 1.0], [3.0, 3.0, 3.0]]
+    assert len(position.rows[0].values) == 9
+
+
+def test_animation_header(walk):
+    assert walk.animation_name == "walk"
+    assert walk.name == "walk_model"
+    assert walk.length == 2.0
+    assert walk.events.data[0].name == "snd_footstep"
+
+
+def test_sample_position_and_scale(walk):
+    samples = animation.sample_animation(walk, [-1.0, 0.5, 1.5, 3.0])
+    names, positions = samples["position"]
+    assert names == ["arm", "leg"]
+    assert positions.shape == (2, 4, 3)
+    assert positions[0].tolist() == [[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [2.0, 2.0, 0.0], [2.0, 4.0, 0.0]]
+    assert positions[1, 1].tolist() == [1.5, 1.5, 1.5]
+    # a single key is constant
+    names, scales = samples["scale"]
+    assert scales.tolist() == [[[2.0]] * 4]
+
+
+def test_sample_orientation_slerp(walk):
+    names, orientations = animation.sample_animation(walk, [0.5])["orientation"]
+    angle = math.pi / 8  # half of the quarter turn, as half angle
+    assert orientations[0, 0] == pytest.approx([0.0, 0.0, math.sin(angle), math.cos(angle)])
+
+
+def test_bake_animation(walk):
+    times, samples = animation.bake_animation(walk, fps=10)
+    assert len(times) == 21
+    assert times[-1] == pytest.approx(2.0)
+    assert samples["position"][1].shape == (2, 21, 3)
+
+
+def test_slerp_takes_shorter_arc():
+    start = numpy.array([[0.0, 0.0, 0.0, 1.0]])
+    end = numpy.array([[0.0, 0.0, 0.0, -1.0]])
+    assert animation.slerp(start, end, numpy.array([0.5])) == pytest.approx(numpy.array([[0.0, 0.0, 0.0, 1.0]]))
+
+
+def test_decompress_quaternions():
+    # x = y = 1 - 1023/1023 = 0, z = 1 - 511/511 = 0: identity with w = -1
+    identity = nodes.decompress_quaternions([1023 | (1023 << 11) | (511 << 22)])
+    assert identity.tolist() == [[0.0, 0.0, 0.0, -1.0]]
+    # x = 1 - 0/1023 = 1: outside of the unit sphere is normalized
+    assert nodes.decompress_quaternions([0 | (1023 << 11) | (511 << 22)]).tolist() == [[1.0, 0.0, 0.0, 0.0]]
+
+
+def test_compressed_orientation_controller():
+    packed = 1023 | (1023 << 11) | (511 << 22)
+    arm = NodeSpec("arm", controllers=[(20, [0.0], [(packed_float(packed),)], 2)])
+    data, mdx = model_data(NodeSpec("root", children=[arm]))
+    model = mdl.read_model_data(data, mdx, tools.Block("root", 0))
+    controller = model.node_by_name["arm"].node_header.controllers.data[0]
+    assert controller.compressed
+    assert controller.values.tolist() == [[0.0, 0.0, 0.0, -1.0]]
+
+
+def three_animations_model():
+    root = NodeSpec("walk_model", children=[NodeSpec("arm")])
+    animations = [AnimationSpec(name, 1.0, NodeSpec("walk_model", children=[NodeSpec("arm", controllers=[(8, [0.0], [(index, 0.0, 0.0)])])]))
+                  for index, name in enumerate(["walk", "run", "Pause1"])]
+    return model_data(root, animations=animations)
+
+
+def test_animation_index_is_lazy():
+    animations = mdl.read_model_data(*three_animations_model()).model_header.animations
+    assert animations.names == ["walk", "run", "Pause1"]
+    assert len(animations) == 3
+    assert not animations.loaded
+    assert "pause1" in animations and "jump" not in animations
+
+    run = animations.get("RUN")
+    assert run.animation_name == "run"
+    assert list(animations.loaded) == [1]
+    assert run.animation_node.childs[0].name == "arm"
+    assert animations.get("run") is run
+    assert animations[-1].animation_name == "Pause1"
+    assert animations.get("jump") is None
+    with pytest.raises(IndexError):
+        animations[3]
+
+
+def test_animation_index_evicts_least_recently_used():
+    animations = mdl.read_model_data(*three_animations_model()).model_header.animations
+    animations.max_size = 2
+    walk = animations[0]
+    animations[1]
+    animations[0]
+    animations[2]
+    assert list(animations.loaded) == [0, 2]
+    assert animations[0] is walk
+    # parsed again after eviction
+    assert animations[1].animation_node.childs[0].node_header.controllers.data[0].values.tolist() == [[1.0, 0.0, 0.0]]
+    assert [animation.animation_name for animation in animations] == ["walk", "run", "Pause1"]
+
+
+def test_animation_index_serialized_without_parsed_animations():
+    from kotor.cache import dump_objects, load_objects
+    parsed = mdl.read_model_data(*three_animations_model())
+    parsed.model_header.animations[1]
+    model = load_objects(dump_objects(parsed))
+    animations = model.model_header.animations
+    assert not animations.loaded
+    assert animations.names == ["walk", "run", "Pause1"]
+    animations.max_size = 1
+    assert [animation.animation_name for animation in animations] == ["walk", "run", "Pause1"]
+    assert list(animations.loaded) == [2]
+    assert animations[1].animation_node.childs[0].node_header.controllers.data[0].values.tolist() == [[1.0, 0.0, 0.0]]
+    # serialized again from the cached model data
+    assert load_objects(dump_objects(model)).model_header.animations[0].animation_name == "walk"
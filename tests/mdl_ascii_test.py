@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import kotor.model.ascii as ascii
+import kotor.model.compiler as compiler
+import kotor.model.mdl as mdl
+import kotor.model.pose as pose
+from .testutil import *
+from .mdl_aabb_test import grid_walkmesh
+from .mdl_model_test import box_model
+from .mdl_pose_test import animated_skin
+import argparse
+import io
+import math
+import numpy
+import pytest
+
+
+HANDWRITTEN = """
+# quad with a texture seam: vertex 1 has two texture coordinates
+newmodel flag
+setsupermodel flag NULL
+classification placeable
+beginmodelgeom flag
+node dummy flag
+  parent NULL
+endnode
+node light lamp
+  parent flag
+  position 0 0 2
+  flareradius 1.5
+  lightpriority 3
+  shadow 1
+  colorkey 1
+    0 1 0.5 0
+endnode
+node danglymesh cloth
+  parent flag
+  orientation 0 0 1 1.5707963
+  bitmap flagtex
+  verts 4
+    0 0 0
+    1 0 0
+    0 1 0
+    1 1 0
+  faces 2
+    0 1 2 1 0 1 2 3
+    1 3 2 1 4 3 2 3
+  tverts 5
+    0 0
+    1 0
+    0 1
+    1 1
+    0.5 0
+  constraints 4
+    0
+    0
+    255
+    255
+  displacement 0.5
+  tightness 2
+  period 3
+  positionbezierkey
+    0 1 2 3 0 0 0 0 0 0
+    1 4 5 6 0 0 0 0 0 0
+  endlist
+endnode
+endmodelgeom flag
+donemodel flag
+"""
+
+
+def ascii_text(model):
+    file = io.StringIO()
+    ascii.write_ascii(file, model)
+    return file.getvalue()
+
+
+def test_axis_angles():
+    half_turn = math.sqrt(0.5)
+    quaternions = numpy.array([[0.0, 0.0, 0.0, 1.0], [0.0, 0.0, half_turn, half_turn], [half_turn, 0.0, 0.0, -half_turn]])
+    rotations = ascii.axis_angles(quaternions)
+    assert numpy.allclose(rotations[:2], [[0.0, 0.0, 0.0, 0.0], [0.0, 0.0, 1.0, math.pi / 2]])
+    assert numpy.allclose(ascii.axis_angle_quaternions(rotations), quaternions)
+
+
+def test_write_ascii():
+    data, mdx = model_data(box_model())
+    lines = ascii_text(mdl.read_model_data(data, mdx)).splitlines()
+    assert lines[1:4] == ["newmodel box_model", "setsupermodel box_model NULL", "classification character"]
+    box = lines.index("node trimesh box")
+    assert lines[box + 1:box + 3] == ["  parent box_model", "  position 1 2 3"]
+    faces = lines.index("  faces 2")
+    assert lines[faces + 1:faces + 3] == ["    0 1 2 1 0 1 2 4", "    1 3 2 1 1 3 2 7"]
+    assert "  tverts 4" in lines and "  normals 4" in lines
+    assert lines[-1] == "donemodel box_model"
+
+
+def test_round_trip_keeps_skin_and_animations():
+    model = animated_skin()
+    text = ascii_text(model)
+    assert "    pelvis 0.5 head 0.5" in text
+    assert "  orientationkey 2" in text
+    data, mdx = compiler.compile_ascii(text.splitlines())
+    compiled = mdl.read_model_data(data, mdx)
+    assert ascii_text(compiled) == text
+
+    animation = compiled.model_header.animations.get("lift")
+    assert animation.length == 2.0
+    expected = pose.PoseEvaluator(model).mesh_vertices(model.model_header.animations[0], 2.0)["body"]
+    assert numpy.allclose(pose.PoseEvaluator(compiled).mesh_vertices(animation, 2.0)["body"], expected, atol=1e-5)
+    # the bind pose of each node relative to the mesh
+    skin = compiled.node_by_name["body"].headers["SKIN"]
+    assert [(vertex.x, vertex.y, vertex.z) for vertex in skin.bone_vertices.data[1:3]] == [(0.0, 0.0, -1.0), (0.0, 0.0, -2.0)]
+
+
+def test_round_trip_rebuilds_faces_and_aabb_tree():
+    data, mdx = model_data(grid_walkmesh())
+    model = mdl.read_model_data(data, mdx)
+    compiled = mdl.read_model_data(*compiler.compile_ascii(ascii_text(model).splitlines()))
+    faces = compiled.node_by_name["walkmesh"].headers["MESH"].faces.data
+    original = model.node_by_name["walkmesh"].headers["MESH"].faces.data
+    assert numpy.array_equal(faces.vertex_indices, original.vertex_indices)
+    assert numpy.allclose(faces.plane_normal.z, 1.0)
+    # the two faces of the first quad share their diagonal
+    assert faces[0].adjected_faces[2] == 1 and faces[1].adjected_faces[0] == 0
+
+    tree = compiled.node_by_name["walkmesh"].headers["AABB"].aabb_tree
+    assert len(tree) == 2 * len(faces) - 1
+    distances, hit = tree.raycast([[1.2, 0.3, 5.0]], [[0.0, 0.0, -1.0]])
+    assert numpy.allclose(distances, 5.0)
+    # the upper face of the second quad
+    assert hit.tolist() == [3]
+
+
+def test_compile_handwritten_model():
+    model = mdl.read_model_data(*compiler.compile_ascii(HANDWRITTEN.splitlines()))
+    assert list(model.node_by_name) == ["flag", "lamp", "cloth"]
+    assert model.model_header.classification == 0x20
+
+    light = model.node_by_name["lamp"].headers["LIGHT"]
+    assert (light.flare_radius, light.light_priority, light.shadow_flag) == (1.5, 3, 1)
+    color = model.node_by_name["lamp"].node_header.controllers.data[0]
+    assert color.controller_type_id == 76 and numpy.allclose(color.values, [[1.0, 0.5, 0.0]])
+
+    cloth = model.node_by_name["cloth"]
+    mesh = cloth.headers["MESH"]
+    # vertex 1 is split because it has the texture coordinates 1 and 4
+    assert len(mesh.vertices) == 5
+    assert mesh.texture_name == "flagtex"
+    corners = mesh.uvs[mesh.faces.data.vertex_indices.astype(int)]
+    assert numpy.allclose(corners[1], [(0.5, 0.0), (1.0, 1.0), (0.0, 1.0)])
+    assert sorted(cloth.headers["DANGLY"].constraints.data) == [0.0, 0.0, 0.0, 255.0, 255.0]
+    assert cloth.headers["DANGLY"].period == 3.0
+
+    position = cloth.node_header.controllers.data[0]
+    assert position.bezier and numpy.allclose(position.values, [[1, 2, 3], [4, 5, 6]])
+    rotation = cloth.node_header.rotation
+    assert numpy.allclose([rotation.w, rotation.z], [math.sqrt(0.5), math.sqrt(0.5)])
+
+
+def test_compile_errors():
+    broken = HANDWRITTEN.replace("parent flag\n  position 0 0 2", "parent pole\n  position 0 0 2")
+    with pytest.raises(ValueError):
+        compiler.compile_ascii(broken.splitlines())
+
+
+def test_convert_model_files(tmp_path):
+    data, mdx = model_data(box_model())
+    (tmp_path / "box_model.mdl").write_bytes(data)
+    (tmp_path / "box_model.mdx").write_bytes(mdx)
+    ascii_directory = tmp_path / "ascii"
+    ascii_directory.mkdir()
+    assert mdl.convert_model_file((str(tmp_path / "box_model.mdl"), str(ascii_directory))) == (str(tmp_path / "box_model.mdl"), None)
+    ascii_file = ascii_directory / "box_model.mdl.ascii"
+    assert ascii_file.exists()
+
+    assert list(mdl.model_files([str(ascii_directory)])) == [str(ascii_file)]
+    assert mdl.convert_model_file((str(ascii_file), str(tmp_path / "ascii")))[1] is None
+    compiled = mdl.read_model_file(str(ascii_directory / "box_model.mdl"))
+    assert compiled.node_by_name["box"].headers["MESH"].uvs.tolist() == [[0.0, 0.0], [1.0, 0.0], [0.0, 1.0], [1.0, 1.0]]
+
+    (tmp_path / "broken.mdl.ascii").write_text("newmodel broken\n")
+    path, error = mdl.convert_model_file((str(tmp_path / "broken.mdl.ascii"), str(tmp_path)))
+    assert error.startswith("ValueError")
+
+
+def test_batch_convert(tmp_path, capsys):
+    data, mdx = model_data(box_model())
+    (tmp_path / "box_model.mdl").write_bytes(data)
+    (tmp_path / "box_model.mdx").write_bytes(mdx)
+    mdl.batch_convert(argparse.Namespace(paths=[str(tmp_path)], directory=str(tmp_path / "ascii"), jobs=2, cache=None, cache_size=1024))
+    assert (tmp_path / "ascii" / "box_model.mdl.ascii").exists()
+    assert "1 models converted, 0 failed" in capsys.readouterr().out
+
+
+def test_batch_convert_cache_arguments(tmp_path, monkeypatch):
+    parsed = []
+    monkeypatch.setattr(mdl, "batch_convert", parsed.append)
+    mdl.parse_command_line(["batchconvert", str(tmp_path)])
+    mdl.parse_command_line(["--cache", "before", "batchconvert", str(tmp_path)])
+    mdl.parse_command_line(["batchconvert", str(tmp_path), "--cache", "after", "--cache-size", "16"])
+    assert [(args.cache, args.cache_size) for args in parsed] == [(None, 1024), ("before", 1024), ("after", 16)]
+
+    data, mdx = model_data(box_model())
+    (tmp_path / "box_model.mdl").write_bytes(data)
+    (tmp_path / "box_model.mdx").write_bytes(mdx)
+    monkeypatch.undo()
+    mdl.parse_command_line(["batchconvert", str(tmp_path), "--dir", str(tmp_path / "ascii"), "-j", "1", "--cache", str(tmp_path / "cache")])
+    assert list((tmp_path / "cache").iterdir())
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import kotor.model.dedup as dedup
+import kotor.model.mdl as mdl
+import kotor.model.supermodel as supermodel
+from .testutil import *
+from .mdl_model_test import box_model
+from .mdl_supermodel_test import write_model
+import csv
+import io
+import numpy
+
+
+def moved_box_model():
+    root = box_model()
+    box = root.children[1]
+    box.vertices = [(x, y, z + 1.0) for x, y, z in box.vertices]
+    return root
+
+
+def test_buffer_digest():
+    indices = numpy.arange(6, dtype='<u2')
+    assert dedup.buffer_digest(indices) == dedup.buffer_digest(indices.copy())
+    # same bytes with another shape or dtype
+    assert dedup.buffer_digest(indices) != dedup.buffer_digest(indices.reshape(2, 3))
+    assert dedup.buffer_digest(indices) != dedup.buffer_digest(indices.view('<i2'))
+    assert dedup.buffer_digest(indices, None) != dedup.buffer_digest(indices)
+
+
+def test_model_geometry():
+    model = mdl.read_model_data(*model_data(box_model()))
+    (name, digest, vertex_count, face_count, size), = dedup.model_geometry(model)
+    assert (name, vertex_count, face_count, size) == ("box", 4, 2, 4 * 12 + 2 * 6)
+    assert digest == dedup.mesh_digest(model.node_by_name["box"].headers["MESH"])
+    moved = mdl.read_model_data(*model_data(moved_box_model()))
+    assert dedup.model_geometry(moved)[0][1] != digest
+
+
+def test_find_duplicate_geometry(tmp_path):
+    write_model(tmp_path, "plc_box", box_model())
+    write_model(tmp_path, "plc_crate", box_model())
+    write_model(tmp_path, "plc_moved", moved_box_model())
+    (tmp_path / "plc_broken.mdl").write_bytes(b"\0" * 16)
+    source = supermodel.ModelSource()
+    source.add_directory(str(tmp_path))
+    groups, mesh_count, failed = dedup.find_duplicate_geometry(source, jobs=2, pattern="plc_*")
+    assert mesh_count == 3
+    assert [name for name, error in failed] == ["plc_broken"]
+    group, = groups
+    assert group["meshes"] == [("plc_box", "box"), ("plc_crate", "box")]
+    assert (group["count"], group["saved_bytes"]) == (2, 60)
+
+    file = io.StringIO()
+    dedup.write_csv(file, groups)
+    row, = csv.DictReader(io.StringIO(file.getvalue()))
+    assert row["meshes"] == "plc_box/box plc_crate/box" and row["digest"] == group["digest"]
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import kotor.model.gltf as gltf
+import kotor.model.mdl as mdl
+from .testutil import *
+from .mdl_model_test import box_model
+from .mdl_animation_test import walk_model
+import io
+import json
+import numpy
+
+
+def skinned_model():
+    vertices = [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0)]
+    body = NodeSpec("body", 0x61, vertices=vertices, faces=[((0, 1, 2), (0xFFFF,) * 3, 1)],
+                    bone_map=[-1.0, 0.0, 1.0, -1.0],
+                    bone_weights=[(1.0, 0.0, 0.0, 0.0), (0.5, 0.5, 0.0, 0.0), (2.0, 2.0, 0.0, 0.0)],
+                    bone_indices=[(0.0, -1.0, -1.0, -1.0), (0.0, 1.0, -1.0, -1.0), (1.0, 0.0, -1.0, -1.0)])
+    return NodeSpec("rig", children=[NodeSpec("pelvis", position=(0.0, 0.0, 1.0)), NodeSpec("head", position=(0.0, 0.0, 2.0)), body])
+
+
+def glb(data, mdx, **kwargs):
+    file = io.BytesIO()
+    gltf.write_glb(file, mdl.read_model_data(data, mdx), **kwargs)
+    return file.getvalue()
+
+
+def parse_glb(data):
+    magic, version, length = gltf.GLB_HEADER_STRUCT.unpack_from(data)
+    assert (magic, version, length) == (gltf.GLB_MAGIC, 2, len(data))
+    json_length, chunk_type = gltf.GLB_CHUNK_STRUCT.unpack_from(data, 12)
+    assert chunk_type == gltf.JSON_CHUNK and json_length % 4 == 0
+    document = json.loads(data[20:20 + json_length].decode("utf-8"))
+    binary = b""
+    if 20 + json_length < len(data):
+        binary_length, chunk_type = gltf.GLB_CHUNK_STRUCT.unpack_from(data, 20 + json_length)
+        assert chunk_type == gltf.BIN_CHUNK
+        binary = data[28 + json_length:28 + json_length + binary_length]
+        assert len(binary) == binary_length == document["buffers"][0]["byteLength"]
+    return document, binary
+
+
+def accessor_data(document, binary, index):
+    accessor = document["accessors"][index]
+    view = document["bufferViews"][accessor["bufferView"]]
+    dtype = {5121: 'u1', 5123: '<u2', 5125: '<u4', 5126: '<f4'}[accessor["componentType"]]
+    columns = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4, "MAT4": 16}[accessor["type"]]
+    assert view["byteOffset"] % 4 == 0
+    values = numpy.frombuffer(binary, dtype=dtype, count=accessor["count"] * columns, offset=view["byteOffset"])
+    return values.reshape(accessor["count"], columns)
+
+
+def test_glb_nodes_and_mesh():
+    document, binary = parse_glb(glb(*model_data(box_model())))
+    names = [node["name"] for node in document["nodes"]]
+    assert names == ["box_model", "dummy", "box", "z_up"]
+    assert document["nodes"][0]["children"] == [1, 2]
+    assert document["nodes"][2]["translation"] == [1.0, 2.0, 3.0]
+    assert document["nodes"][2]["rotation"] == [0.0, 0.0, 0.0, 1.0]
+    assert document["scenes"][0]["nodes"] == [3]
+
+    primitive = document["meshes"][document["nodes"][2]["mesh"]]["primitives"][0]
+    positions = document["accessors"][primitive["attributes"]["POSITION"]]
+    assert positions["min"] == [0.0, 0.0, 0.0] and positions["max"] == [1.0, 1.0, 0.0]
+    assert accessor_data(document, binary, primitive["indices"]).ravel().tolist() == [0, 1, 2, 1, 3, 2]
+    assert accessor_data(document, binary, primitive["attributes"]["NORMAL"]).tolist() == [[0.0, 0.0, 1.0]] * 4
+    assert accessor_data(document, binary, primitive["attributes"]["TEXCOORD_0"])[1].tolist() == [1.0, 1.0]
+    assert document["materials"][primitive["material"]]["name"] == "texture"
+
+
+def test_glb_z_up():
+    document, binary = parse_glb(glb(*model_data(box_model()), y_up=False))
+    assert document["scenes"][0]["nodes"] == [0]
+    assert len(document["nodes"]) == 3
+
+
+def test_glb_skin():
+    document, binary = parse_glb(glb(*model_data(skinned_model())))
+    body = document["nodes"][3]
+    skin = document["skins"][body["skin"]]
+    assert skin["joints"] == [1, 2]
+    inverse_binds = accessor_data(document, binary, skin["inverseBindMatrices"]).reshape(-1, 4, 4)
+    # column major: translation in the last row
+    assert inverse_binds[:, 3, :3].tolist() == [[0.0, 0.0, -1.0], [0.0, 0.0, -2.0]]
+
+    attributes = document["meshes"][body["mesh"]]["primitives"][0]["attributes"]
+    assert accessor_data(document, binary, attributes["JOINTS_0"]).tolist() == [[0, 0, 0, 0], [0, 1, 0, 0], [1, 0, 0, 0]]
+    assert accessor_data(document, binary, attributes["WEIGHTS_0"]).tolist() == [[1.0, 0.0, 0.0, 0.0], [0.5, 0.5, 0.0, 0.0], [0.5, 0.5, 0.0, 0.0]]
+
+
+def test_glb_animations():
+    document, binary = parse_glb(glb(*walk_model()))
+    walk = document["animations"][0]
+    assert walk["name"] == "walk"
+    targets = [(document["nodes"][channel["target"]["node"]]["name"], channel["target"]["path"]) for channel in walk["channels"]]
+    assert sorted(targets) == [("arm", "rotation"), ("arm", "translation"), ("leg", "scale"), ("leg", "translation")]
+
+    samplers = {target: walk["samplers"][channel["sampler"]] for target, channel in zip(targets, walk["channels"])}
+    arm_position = samplers[("arm", "translation")]
+    assert document["accessors"][arm_position["input"]]["max"] == [2.0]
+    assert accessor_data(document, binary, arm_position["output"])[2].tolist() == [2.0, 4.0, 0.0]
+    assert accessor_data(document, binary, samplers[("leg", "scale")]["output"]).tolist() == [[2.0, 2.0, 2.0]]
+    # tangents of bezier controllers are dropped
+    assert accessor_data(document, binary, samplers[("leg", "translation")]["output"]).tolist() == [[1.0, 1.0, 1.0], [3.0, 3.0, 3.0]]
+
+
+def test_glb_library_shares_buffers():
+    models = [mdl.read_model_data(*model_data(box_model())) for index in range(2)]
+    file = io.BytesIO()
+    gltf.write_glb_library(file, models)
+    document, binary = parse_glb(file.getvalue())
+    assert len(document["scenes"]) == 2
+    assert document["scenes"][1]["nodes"] == [7]
+    assert document["nodes"][4]["children"] == [5, 6]
+    # both box nodes use the same mesh, the buffers are written once
+    assert document["nodes"][2]["mesh"] == document["nodes"][6]["mesh"] == 0
+    assert len(document["meshes"]) == 1
+    single, single_binary = parse_glb(glb(*model_data(box_model())))
+    assert len(binary) == len(single_binary)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+import kotor.model.base as base
+import kotor.model.mdl as mdl
+import kotor.tools as tools
+from .testutil import *
+import json
+import os
+import pytest
+import sys
+
+
+def box_model():
+    vertices = [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (1.0, 1.0, 0.0)]
+    faces = [((0, 1, 2), (0xFFFF, 1, 0xFFFF), 4), ((1, 3, 2), (0xFFFF, 0xFFFF, 0), 7)]
+    normals = [(0.0, 0.0, 1.0)] * 4
+    uvs = [(0.0, 0.0), (1.0, 0.0), (0.0, 1.0), (1.0, 1.0)]
+    box = NodeSpec("box", 0x21, position=(1.0, 2.0, 3.0), vertices=vertices, faces=faces, normals=normals, uvs=uvs)
+    return NodeSpec("box_model", children=[NodeSpec("dummy"), box])
+
+
+@pytest.fixture
+def model_file(tmp_path):
+    path = tmp_path / "box_model.mdl"
+    mdl, mdx = model_data(box_model())
+    path.write_bytes(mdl)
+    (tmp_path / "box_model.mdx").write_bytes(mdx)
+    return str(path)
+
+
+def test_read_model_file(model_file):
+    model = mdl.read_model_file(model_file, tools.Block("root", 0))
+    assert list(model.node_by_name.keys()) == ["box_model", "dummy", "box"]
+    assert model.geometry_header.name == "box_model"
+    assert model.node_by_name["box"].headers["HEADER"].position.z == 3.0
+
+
+def test_mesh_geometry_arrays(model_file):
+    mesh = mdl.read_model_file(model_file, tools.Block("root", 0)).node_by_name["box"].headers["MESH"]
+    assert len(mesh.vertices) == 4
+    assert mesh.vertices[1].x == 1.0
+    assert list(mesh.vertices.y) == [0.0, 0.0, 1.0, 1.0]
+    assert base.vectors(mesh.vertices).shape == (4, 3)
+
+    faces = mesh.faces.data
+    assert len(faces) == 2
+    assert list(faces[1].vertex_indices) == [1, 3, 2]
+    assert list(faces[0].adjected_faces) == [0xFFFF, 1, 0xFFFF]
+    assert list(faces.surface) == [4, 7]
+    assert faces[0].plane_normal.z == 1.0
+    assert faces.vertex_indices.shape == (2, 3)
+    assert list(mesh.vertex_indices) == [0, 1, 2, 1, 3, 2]
+
+
+def test_array_read_records():
+    file = SeekLoggingBytesIO(struct.pack("=3I", 12, 1, 2) + struct.pack("=6f", 1, 2, 3, 4, 5, 6))
+    array = base.Array(file)
+    array.read_records(file, base.VERTEX)
+    assert 12 in file.seeks
+    assert len(array.data) == 1
+    assert array.data[0].z == 3.0
+    assert file.tell() == 12 + 24
+
+
+def test_mesh_mdx_views(model_file):
+    mesh = mdl.read_model_file(model_file, tools.Block("root", 0)).node_by_name["box"].headers["MESH"]
+    assert mesh.mdx_structure_size == 32
+    assert mesh.normals.shape == (4, 3)
+    assert mesh.normals.strides == (32, 4)
+    assert (mesh.normals == [0.0, 0.0, 1.0]).all()
+    assert mesh.uvs.tolist() == [[0.0, 0.0], [1.0, 0.0], [0.0, 1.0], [1.0, 1.0]]
+    assert mesh.uvs2 is None
+
+
+def test_close_model_closes_mdx(model_file):
+    with mdl.read_model_file(model_file) as model:
+        mdx = model.mdx
+        assert model.node_by_name["box"].headers["MESH"].uvs.tolist()[1] == [1.0, 0.0]
+    assert model.mdx is None and not model.node_by_name
+    assert mdx.closed
+
+    # arrays which are still used keep the map open
+    model = mdl.read_model_file(model_file)
+    mdx = model.mdx
+    normals = model.node_by_name["box"].headers["MESH"].normals
+    model.close()
+    assert not mdx.closed
+    assert (normals == [0.0, 0.0, 1.0]).all()
+
+
+def test_mesh_without_mdx(model_file):
+    os.remove(os.path.splitext(model_file)[0] + ".mdx")
+    model = mdl.read_model_file(model_file, tools.Block("root", 0))
+    assert model.mdx is None
+    assert model.node_by_name["box"].headers["MESH"].normals is None
+
+
+def test_strided_view():
+    buffer = struct.pack("=8f", 1, 2, 3, 4, 5, 6, 7, 8)
+    view = base.strided_view(buffer, 4, 16, 2, 2)
+    assert view.tolist() == [[2.0, 3.0], [6.0, 7.0]]
+    with pytest.raises(ValueError):
+        base.strided_view(buffer, 4, 16, 2, 4)
+
+
+def test_load_headers_only(model_file):
+    model = mdl.read_model_file(model_file, tools.Block("root", 0), mdl.LOAD_HEADERS)
+    assert model.geometry_header.node_count == 3
+    assert model.root_node is None
+    assert not model.node_by_name
+
+
+def test_load_names_reads_payload_on_access(model_file):
+    model = mdl.read_model_file(model_file, tools.Block("root", 0), mdl.LOAD_NAMES)
+    assert list(model.node_by_name.keys()) == ["box_model", "dummy", "box"]
+    box = model.node_by_name["box"]
+    assert box.node_header.node_id == 2
+    assert box.pending_payload
+    mesh = box.headers["MESH"]
+    assert not box.pending_payload
+    assert len(mesh.vertices) == 4
+    assert mesh.normals is not None
+
+
+def test_load_geometry_reads_payload(model_file):
+    model = mdl.read_model_file(model_file, tools.Block("root", 0), mdl.LOAD_GEOMETRY)
+    assert all(not node.pending_payload for node in model.node_by_name.values())
+    assert model.model_header.animations == []
+
+
+def serialize_model(model):
+    return json.dumps([model.header, model.geometry_header, model.model_header, model.names_header, model.names_header.names,
+                       model.root_node], cls=tools.Encoder)
+
+
+def test_read_model_data_in_place_matches_stream():
+    root = box_model()
+    root.children[0].controllers = [(8, [0.0, 1.0], [(0.0, 0.0, 0.0), (1.0, 2.0, 3.0)])]
+    data, mdx = model_data(root)
+    in_place_block = tools.Block("root", 0)
+    stream_block = tools.Block("root", 0)
+    in_place = mdl.read_model_data(data, mdx, in_place_block)
+    stream = mdl.read_model_data(data, mdx, stream_block, stream=True)
+    assert serialize_model(in_place) == serialize_model(stream)
+    assert list(in_place.node_by_name["dummy"].headers["HEADER"].controller_data.data) == [0.0, 1.0, 0.0, 0.0, 0.0, 1.0, 2.0, 3.0]
+    assert [(block.name, block.start, block.end) for block in in_place_block.blocks] == [(block.name, block.start, block.end) for block in stream_block.blocks]
+
+
+def test_memory_reader():
+    reader = tools.MemoryReader(b"xx" + struct.pack("<If", 7, 2.5) + b"name\0rest", start=2)
+    assert reader.unpack(struct.Struct("<I")) == (7,)
+    assert reader.tell() == 4
+    assert list(reader.read_array('<f4', 1)) == [2.5]
+    assert reader.read_terminated(8) == b"name"
+    reader.seek(13)
+    assert reader.read() == b"rest"
+    assert reader.read(4) == b""
+    with pytest.raises(IOError):
+        reader.read_array('<u4', 1)
+
+
+def test_block_map_records_positions():
+    data, mdx = model_data(box_model())
+    root = tools.Block("root", 0)
+    mdl.read_model_data(data, mdx, root)
+    blocks = {block.name: block for block in root.blocks}
+    assert (blocks["Header"].start, blocks["Header"].end) == (0, 12)
+    assert (blocks["GeometryHeader"].start, blocks["GeometryHeader"].end) == (0, 80)
+    assert (blocks["ModelHeader"].start, blocks["ModelHeader"].end) == (80, 168)
+    mesh = next(block for block in root.blocks if block.name == "MeshHeader.vertex_array")
+    assert mesh.end - mesh.start == 4 * 12
+
+
+def test_null_block_records_nothing():
+    assert tools.NULL_BLOCK.block("foo") is tools.NULL_BLOCK
+    assert tools.NULL_BLOCK.start_block("foo", 12) is tools.NULL_BLOCK
+    data, mdx = model_data(box_model())
+    model = mdl.read_model_data(data, mdx)
+    assert model.node_by_name["box"].headers["MESH"].vertex_count == 4
+    assert tools.NULL_BLOCK.blocks == ()
+
+
+def test_load_model_from_cache(tmp_path, monkeypatch):
+    from kotor.cache import DiskCache
+    from .mdl_animation_test import walk_model
+    disk_cache = DiskCache(str(tmp_path / "cache"))
+    data, mdx = model_data(box_model())
+    parsed = mdl.load_model(data, mdx, cache=disk_cache)
+    assert disk_cache.size() > 0
+
+    def fail(*args, **kwargs):
+        raise AssertionError("model parsed again")
+    monkeypatch.setattr(mdl, "read_model_data", fail)
+    cached = mdl.load_model(data, mdx, cache=disk_cache)
+    assert list(cached.node_by_name.keys()) == list(parsed.node_by_name.keys())
+    assert cached.node_by_id[2] is cached.node_by_name["box"]
+    # the headers of the node types are loaded on first access
+    assert cached.node_by_name["box"].pending_headers is not None
+    mesh = cached.node_by_name["box"].headers["MESH"]
+    assert cached.node_by_name["box"].pending_headers is None
+    assert list(cached.node_by_name["box"].headers) == list(parsed.node_by_name["box"].headers)
+    assert cached.node_by_name["box"].headers["HEADER"] is cached.node_by_name["box"].node_header
+    assert mesh.vertices[1].x == 1.0
+    assert mesh.faces.data.vertex_indices.tolist() == [[0, 1, 2], [1, 3, 2]]
+    assert mesh.uvs.tolist() == parsed.node_by_name["box"].headers["MESH"].uvs.tolist()
+    assert mesh.parent_block is tools.NULL_BLOCK
+    assert cached.mdx is None
+    monkeypatch.undo()
+
+    # other content, load level or parser version get other entries
+    assert mdl.model_cache_key(data, mdx, mdl.LOAD_ALL) != mdl.model_cache_key(data, mdx, mdl.LOAD_GEOMETRY)
+    walk_data, walk_mdx = walk_model()
+    assert mdl.model_cache_key(data, mdx, mdl.LOAD_ALL) != mdl.model_cache_key(walk_data, walk_mdx, mdl.LOAD_ALL)
+    walk = mdl.load_model(walk_data, walk_mdx, cache=disk_cache)
+    cached_walk = mdl.load_model(walk_data, walk_mdx, cache=disk_cache)
+    controller = cached_walk.model_header.animations[0].animation_node.childs[0].node_header.controllers.data[0]
+    assert controller.values.tolist() == walk.model_header.animations[0].animation_node.childs[0].node_header.controllers.data[0].values.tolist()
+
+
+def test_read_model_file_with_cache(model_file, tmp_path):
+    from kotor.cache import DiskCache
+    disk_cache = DiskCache(str(tmp_path / "cache"))
+    mdl.read_model_file(model_file, cache=disk_cache)
+    model = mdl.read_model_file(model_file, cache=disk_cache)
+    assert model.node_by_name["box"].headers["MESH"].normals.shape == (4, 3)
+    # lazy loaded models are not cached
+    entries = len(disk_cache.entries())
+    mdl.read_model_file(model_file, level=mdl.LOAD_NAMES, cache=disk_cache)
+    assert len(disk_cache.entries()) == entries
+
+
+def test_read_deep_node_tree():
+    depth = 3000
+    root = NodeSpec("node0")
+    node = root
+    for index in range(1, depth):
+        child = NodeSpec("node{}".format(index))
+        node.children.append(child)
+        node = child
+    # the test writer is recursive, the reader is not
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(4 * depth + 1000)
+    try:
+        data, mdx = model_data(root)
+    finally:
+        sys.setrecursionlimit(limit)
+    model = mdl.read_model_data(data, mdx)
+    assert len(model.node_by_name) == depth
+    assert model.node_by_id[depth - 1].name == "node{}".format(depth - 1)
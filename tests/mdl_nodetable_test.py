@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import kotor.model.mdl as mdl
+import kotor.model.nodetable as nodetable
+from .testutil import *
+from .mdl_model_test import box_model
+import math
+import numpy
+
+
+def arm_model():
+    half_turn = math.sqrt(0.5)
+    # the shoulder is turned a quarter around z, so the x axis of its children points along y
+    hand = NodeSpec("hand", position=(1.0, 0.0, 0.0))
+    elbow = NodeSpec("elbow", position=(2.0, 0.0, 0.0), children=[hand])
+    shoulder = NodeSpec("shoulder", position=(0.0, 0.0, 1.0), rotation=(half_turn, 0.0, 0.0, half_turn), children=[elbow])
+    return NodeSpec("arm_model", children=[shoulder, box_model().children[1]])
+
+
+def arm_table():
+    data, mdx = model_data(arm_model())
+    return nodetable.NodeTable.from_model(mdl.read_model_data(data, mdx))
+
+
+def test_table_arrays():
+    table = arm_table()
+    assert len(table) == 5
+    assert table.names == ["arm_model", "shoulder", "elbow", "hand", "box"]
+    assert table.parents.tolist() == [-1, 0, 1, 2, 0]
+    assert table.depths.tolist() == [0, 1, 2, 3, 1]
+    assert table.node_ids.tolist() == [0, 1, 2, 3, 4]
+    assert numpy.allclose(table.rotations[1], [0.0, 0.0, math.sqrt(0.5), math.sqrt(0.5)])
+    assert [level.tolist() for level in table.levels] == [[1, 4], [2], [3]]
+
+
+def test_lookups():
+    table = arm_table()
+    assert table.find("elbow") == 2
+    assert table.find("foot") == -1
+    assert table.find_id(3) == 3
+    assert table.with_types("MESH").tolist() == [4]
+    assert table.with_types(0x1).tolist() == [0, 1, 2, 3, 4]
+    assert table.children(0).tolist() == [1, 4]
+
+
+def test_world_transforms():
+    table = arm_table()
+    positions = table.world_positions()
+    assert numpy.allclose(positions, [(0, 0, 0), (0, 0, 1), (0, 2, 1), (0, 3, 1), (1, 2, 3)])
+    # placed in an area: moved by (10, 0, 0)
+    root = nodetable.transform_matrices([10.0, 0.0, 0.0], [0.0, 0.0, 0.0, 1.0])
+    assert numpy.allclose(table.world_positions(root)[3], (10, 3, 1))
+    points = nodetable.transform_points(table.world_matrices()[2], numpy.array([[1.0, 0.0, 0.0]]))
+    assert numpy.allclose(points, [(0, 3, 1)])
+
+
+def test_single_pass_node_dictionaries():
+    data, mdx = model_data(arm_model())
+    model = mdl.read_model_data(data, mdx)
+    assert list(model.node_by_name) == ["arm_model", "shoulder", "elbow", "hand", "box"]
+    assert model.node_by_id[3] is model.node_by_name["hand"]
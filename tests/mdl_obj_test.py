@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import kotor.model.mdl as mdl
+import kotor.model.obj as obj
+from .testutil import *
+from .mdl_model_test import box_model
+import argparse
+import io
+import os
+
+
+def two_mesh_model():
+    root = box_model()
+    vertices = [(0.0, 0.0, 1.0), (1.0, 0.0, 1.0), (0.0, 1.0, 1.0)]
+    root.children.append(NodeSpec("plain", 0x21, vertices=vertices, faces=[((0, 1, 2), (0xFFFF,) * 3, 1)]))
+    return root
+
+
+def exported_lines(model, node_names=None):
+    file = io.StringIO()
+    obj.write_obj(file, model, node_names)
+    return file.getvalue().splitlines()
+
+
+def test_format_rows():
+    assert obj.format_rows("v %.1f %.1f\n", [[1, 2], [3, 4]]) == "v 1.0 2.0\nv 3.0 4.0\n"
+    assert obj.format_rows("v %.1f\n", []) == ""
+
+
+def test_write_obj_with_normals_and_uvs():
+    data, mdx = model_data(box_model())
+    lines = exported_lines(mdl.read_model_data(data, mdx))
+    assert lines[0:3] == ["# OBJ file", "o box", "v 0.0000 0.0000 0.0000"]
+    assert lines.count("vn 0.0000 0.0000 1.0000") == 4
+    assert "vt 1.0000 1.0000" in lines
+    assert [line for line in lines if line.startswith("f")] == ["f 1/1/1 2/2/2 3/3/3", "f 2/2/2 4/4/4 3/3/3"]
+
+
+def test_write_obj_counts_indices_per_element():
+    data, mdx = model_data(two_mesh_model())
+    lines = exported_lines(mdl.read_model_data(data, mdx))
+    assert lines[-5:] == ["o plain", "v 0.0000 0.0000 1.0000", "v 1.0000 0.0000 1.0000", "v 0.0000 1.0000 1.0000", "f 5 6 7"]
+
+
+def test_write_obj_selected_nodes():
+    data, mdx = model_data(two_mesh_model())
+    lines = exported_lines(mdl.read_model_data(data, mdx), ["plain", "dummy"])
+    assert lines[1] == "o plain"
+    assert lines[-1] == "f 1 2 3"
+
+
+def test_export_archive_model(tmp_path):
+    data, mdx = model_data(box_model())
+    archive = tmp_path / "models.bif"
+    archive.write_bytes(b"junk" + data + mdx)
+    task = ("box_model", (str(archive), 4, len(data)), (str(archive), 4 + len(data), len(mdx)), str(tmp_path))
+    assert mdl.export_archive_model(task) == ("box_model", len(data), None)
+    assert (tmp_path / "box_model.obj").read_text().count("\nf ") == 2
+
+    name, size, error = mdl.export_archive_model(("broken", (str(archive), 0, 16), None, str(tmp_path)))
+    assert error
+
+
+def test_batch_export(tmp_path, monkeypatch, capsys):
+    data, mdx = model_data(box_model())
+    archive = tmp_path / "models.bif"
+    archive.write_bytes(data + mdx)
+    models = [("box_model", (str(archive), 0, len(data)), (str(archive), len(data), len(mdx))),
+              ("c_other", (str(archive), 0, len(data)), None)]
+    monkeypatch.setattr(mdl, "find_bif_models", lambda key_file, bif_files: iter(models))
+    directory = tmp_path / "out"
+    mdl.batch_export(argparse.Namespace(key="chitin.key", bifFiles=["data/models.bif"], filter="box*", directory=str(directory), jobs=2, cache=None, cache_size=1024))
+    assert os.listdir(str(directory)) == ["box_model.obj"]
+    assert "1 models exported, 0 failed" in capsys.readouterr().out
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import kotor.model.gltf as gltf
+import kotor.model.mdl as mdl
+import kotor.model.obj as obj
+import kotor.model.optimize as optimize
+from .testutil import *
+from .mdl_gltf_test import accessor_data, parse_glb, skinned_model
+from .mdl_model_test import box_model
+from collections import OrderedDict
+import io
+import numpy
+
+
+def grid(size):
+    """Returns the vertices and faces of a grid of size x size quads."""
+    x, y = numpy.meshgrid(numpy.arange(size + 1), numpy.arange(size + 1), indexing="ij")
+    positions = numpy.column_stack([x.ravel(), y.ravel(), numpy.zeros(x.size)]).astype('<f4')
+    corner = (numpy.arange(size)[:, None] * (size + 1) + numpy.arange(size)[None, :]).ravel()
+    faces = numpy.concatenate([numpy.column_stack([corner, corner + size + 1, corner + 1]),
+                               numpy.column_stack([corner + 1, corner + size + 1, corner + size + 2])])
+    return positions, faces
+
+
+def triangle_soup(positions, faces):
+    """Returns a copy of each vertex for each face, as exporters without index buffers write them."""
+    return positions[faces.ravel()], numpy.arange(3 * len(faces)).reshape(-1, 3)
+
+
+def test_weld_vertices():
+    positions, faces = grid(4)
+    soup, indices = triangle_soup(positions, faces)
+    soup = soup + numpy.random.RandomState(1).uniform(-1e-7, 1e-7, soup.shape).astype('<f4')
+    welded, welded_indices, attributes = optimize.weld_vertices(soup, indices, tolerance=1e-5)
+    assert len(welded) == len(positions) and len(welded_indices) == len(faces)
+    assert numpy.allclose(welded[welded_indices], soup[indices], atol=1e-6)
+
+    # vertices with other texture coordinates are kept, i.e. at a texture seam
+    uvs = numpy.zeros((len(soup), 2), dtype='<f4')
+    uvs[numpy.nonzero(faces.ravel() == 6)[0][0]] = 0.5
+    welded, welded_indices, attributes = optimize.weld_vertices(soup, indices, OrderedDict([("uvs", uvs)]), 1e-5)
+    assert len(welded) == len(positions) + 1
+    assert numpy.array_equal(attributes["uvs"][welded_indices], uvs[indices])
+
+
+def test_weld_removes_collapsed_faces():
+    positions = numpy.array([(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (1.0, 0.0, 1e-7)], dtype='<f4')
+    welded, indices, attributes = optimize.weld_vertices(positions, numpy.array([(0, 1, 2), (0, 1, 3)]))
+    assert len(welded) == 3 and indices.tolist() == [[0, 1, 2]]
+
+
+def test_tipsify_reduces_cache_misses():
+    positions, faces = grid(32)
+    shuffled = faces[numpy.random.RandomState(2).permutation(len(faces))]
+    order = optimize.tipsify(shuffled, len(positions), 16)
+    assert sorted(order.tolist()) == list(range(len(faces)))
+    assert optimize.acmr(shuffled[order], 16) < 0.8 < optimize.acmr(shuffled, 16)
+
+
+def test_decimate():
+    positions, faces = grid(16)
+    decimated, indices, attributes = optimize.decimate(positions, faces, cells=4)
+    assert len(decimated) == 25
+    assert 0 < len(indices) <= 32
+    assert len(optimize.remove_degenerate_faces(indices)) == len(indices)
+    assert numpy.allclose(decimated.min(axis=0), [1.5, 1.5, 0.0]) and numpy.allclose(decimated.max(axis=0), [16.0, 16.0, 0.0])
+
+
+def test_remove_duplicate_faces():
+    faces = numpy.array([(0, 1, 2), (1, 2, 0), (0, 2, 1), (2, 3, 1)])
+    assert optimize.remove_duplicate_faces(faces).tolist() == [[0, 1, 2], [0, 2, 1], [2, 3, 1]]
+
+
+def test_mesh_optimizer_statistics():
+    positions, faces = grid(8)
+    soup, indices = triangle_soup(positions, faces[::-1])
+    optimizer = optimize.MeshOptimizer(cache_size=16)
+    optimized, optimized_indices, attributes = optimizer.optimize("grid", soup, indices)
+    # the vertices are ordered by their first use
+    assert optimized_indices.ravel()[:3].tolist() == [0, 1, 2]
+    row, = optimizer.statistics
+    assert (row["vertices_before"], row["vertices_after"], row["faces_before"], row["faces_after"]) == (384, 81, 128, 128)
+    assert row["acmr_before"] == 3.0 and row["acmr_after"] < 1.0
+    file = io.StringIO()
+    optimizer.print_statistics(file)
+    assert file.getvalue().splitlines()[-1].split()[:5] == ["total", "384", "81", "128", "128"]
+
+
+def test_export_optimized_meshes():
+    model = mdl.read_model_data(*model_data(box_model()))
+    file = io.StringIO()
+    obj.write_obj(file, model, optimizer=optimize.MeshOptimizer())
+    lines = file.getvalue().splitlines()
+    assert sum(line.startswith("v ") for line in lines) == 4 and sum(line.startswith("f ") for line in lines) == 2
+
+    model = mdl.read_model_data(*model_data(skinned_model()))
+    file = io.BytesIO()
+    gltf.write_glb(file, model, optimizer=optimize.MeshOptimizer())
+    document, binary = parse_glb(file.getvalue())
+    attributes = document["meshes"][0]["primitives"][0]["attributes"]
+    assert list(attributes) == ["POSITION", "JOINTS_0", "WEIGHTS_0"]
+    positions = accessor_data(document, binary, attributes["POSITION"])
+    weights = accessor_data(document, binary, attributes["WEIGHTS_0"])
+    # the weights stay with their vertex
+    assert numpy.allclose(weights[numpy.argmax(positions[:, 1])], [0.5, 0.5, 0.0, 0.0])
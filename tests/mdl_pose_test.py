@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import kotor.model.mdl as mdl
+import kotor.model.pose as pose
+from .testutil import *
+from .mdl_gltf_test import skinned_model
+import gc
+import math
+import numpy
+import pytest
+import weakref
+
+
+def animated_skin():
+    half_turn = math.sqrt(0.5)
+    pelvis = NodeSpec("pelvis", controllers=[
+        (8, [0.0, 1.0], [(0.0, 0.0, 1.0), (0.0, 0.0, 2.0)]),
+        # quarter turn around z at time 2
+        (20, [1.0, 2.0], [(0.0, 0.0, 0.0, 1.0), (0.0, 0.0, half_turn, half_turn)]),
+    ])
+    lift = AnimationSpec("lift", 2.0, NodeSpec("rig", children=[pelvis, NodeSpec("head")]))
+    data, mdx = model_data(skinned_model(), animations=[lift])
+    return mdl.read_model_data(data, mdx)
+
+
+@pytest.fixture
+def evaluator():
+    return pose.PoseEvaluator(animated_skin())
+
+
+def test_quaternion_matrices():
+    half_turn = math.sqrt(0.5)
+    matrices = pose.quaternion_matrices([[0.0, 0.0, 0.0, 1.0], [0.0, 0.0, half_turn, half_turn]])
+    assert numpy.allclose(matrices[0], numpy.identity(3))
+    assert numpy.allclose(matrices[1] @ [1.0, 0.0, 0.0], [0.0, 1.0, 0.0])
+
+
+def test_bone_node_ids():
+    model = animated_skin()
+    assert model.node_by_name["body"].headers["SKIN"].bone_node_ids().tolist() == [1, 2]
+
+
+def test_world_matrices(evaluator):
+    assert [node.name for node in evaluator.nodes] == ["rig", "pelvis", "head", "body"]
+    assert evaluator.parents.tolist() == [-1, 0, 0, 0]
+    animation = evaluator.model.model_header.animations[0]
+    world = evaluator.world_matrices(animation, 0.5)
+    assert numpy.allclose(world[1][:3, 3], [0.0, 0.0, 1.5])
+    # head has no controllers and keeps its rest pose
+    assert numpy.allclose(world[2], evaluator.rest_world[2])
+
+
+def test_samplers_by_animation_name(evaluator):
+    animations = evaluator.model.model_header.animations
+    animation = animations[0]
+    sampler = evaluator.sampler(animation)
+    assert evaluator.sampler(animation) is sampler
+    # the same animation parsed again gets a new sampler
+    parsed_again = animations.load(0)
+    assert evaluator.sampler(parsed_again) is not sampler
+    assert list(evaluator.samplers) == ["lift"]
+    # the samplers don't keep their animations alive
+    reference = weakref.ref(parsed_again)
+    del parsed_again
+    gc.collect()
+    assert reference() is None
+
+    evaluator.max_samplers = 2
+    for name in ["walk", "run", "lift"]:
+        renamed = animations.load(0)
+        renamed.geometry_header.name = name
+        evaluator.sampler(renamed)
+    assert list(evaluator.samplers) == ["run", "lift"]
+
+
+def test_samplers_of_animations_with_the_same_animroot():
+    lift = AnimationSpec("lift", 2.0, NodeSpec("rig", children=[NodeSpec("pelvis", controllers=[(8, [0.0], [(0.0, 0.0, 1.0)])])]))
+    drop = AnimationSpec("drop", 2.0, NodeSpec("rig", children=[NodeSpec("pelvis", controllers=[(8, [0.0], [(0.0, 0.0, -1.0)])])]))
+    data, mdx = model_data(skinned_model(), animations=[lift, drop])
+    evaluator = pose.PoseEvaluator(mdl.read_model_data(data, mdx))
+    first, second = evaluator.model.model_header.animations
+    assert first.name == second.name == "rig"
+    samplers = [evaluator.sampler(first), evaluator.sampler(second)]
+    # switching between the animations reuses their samplers
+    assert [evaluator.sampler(first), evaluator.sampler(second)] == samplers
+    assert samplers[0] is not samplers[1]
+    assert list(evaluator.samplers) == ["lift", "drop"]
+    assert evaluator.world_matrices(second, 0.0)[1][2, 3] == pytest.approx(-1.0)
+
+
+def test_rest_pose_keeps_vertices(evaluator):
+    vertices = evaluator.mesh_vertices()["body"]
+    assert numpy.allclose(vertices, [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0)])
+
+
+def test_skinned_vertices(evaluator):
+    animation = evaluator.model.model_header.animations[0]
+    # pelvis moved up by 1: full, half and half weight
+    vertices = evaluator.mesh_vertices(animation, 1.0)["body"]
+    assert numpy.allclose(vertices, [(0.0, 0.0, 1.0), (1.0, 0.0, 0.5), (0.0, 1.0, 0.5)])
+
+    # pelvis moved from (0, 0, 1) to (0, 0, 2) and turned around z: (1, 0, 0) is (1, 0, -1) relative to the pelvis,
+    # turned (0, 1, -1), moved (0, 1, 1) and blended half with the head
+    vertices = evaluator.mesh_vertices(animation, 2.0)["body"]
+    assert numpy.allclose(vertices[0], (0.0, 0.0, 1.0))
+    assert numpy.allclose(vertices[1], (0.5, 0.5, 0.5))
+
+    minimum, maximum = evaluator.bounding_box(animation, 1.0)
+    assert numpy.allclose(minimum, (0.0, 0.0, 0.5)) and numpy.allclose(maximum, (1.0, 1.0, 1.0))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import kotor.model.mdl as mdl
+import kotor.model.stats as stats
+import kotor.model.supermodel as supermodel
+from .testutil import *
+from .mdl_model_test import box_model
+from .mdl_pose_test import animated_skin
+from .mdl_supermodel_test import write_model
+import csv
+import io
+
+
+def test_model_statistics():
+    row = stats.model_statistics("rig", animated_skin())
+    assert (row["nodes"], row["header_nodes"], row["mesh_nodes"], row["skin_nodes"]) == (4, 4, 1, 1)
+    assert (row["vertices"], row["faces"]) == (3, 1)
+    assert (row["animations"], row["animation_nodes"], row["controllers"]) == (1, 3, 2)
+    assert row["unknown_controllers"] == "" and row["super_model"] == "null"
+
+
+def test_unknown_controllers_and_node_types():
+    root = box_model()
+    root.children[0].controllers = [(999, [0.0], [(1.0,)]), (999, [0.0], [(2.0,)]), (8, [0.0], [(0.0, 0.0, 0.0)])]
+    root.children[0].node_type = 0x1001
+    row = stats.model_statistics("box_model", mdl.read_model_data(*model_data(root, super_model="S_Base")))
+    assert row["unknown_controllers"] == "999:2"
+    assert row["unknown_node_types"] == "4096:1"
+    assert row["super_model"] == "s_base"
+    assert stats.parse_counts("999:2 8:1") == {999: 2, 8: 1}
+
+
+def test_scan_models(tmp_path):
+    write_model(tmp_path, "box_model", box_model())
+    write_model(tmp_path, "c_other", box_model(), super_model="box_model")
+    (tmp_path / "broken.mdl").write_bytes(b"\0" * 16)
+    source = supermodel.ModelSource()
+    source.add_directory(str(tmp_path))
+    rows, failed = stats.scan_models(source, jobs=2)
+    assert [row["name"] for row in rows] == ["box_model", "c_other"]
+    assert rows[0]["mdx_size"] > 0 and rows[0]["parse_seconds"] >= 0
+    assert [name for name, error in failed] == ["broken"]
+
+    file = io.StringIO()
+    stats.write_csv(file, rows)
+    table = list(csv.DictReader(io.StringIO(file.getvalue())))
+    assert list(table[0]) == stats.COLUMNS
+    assert table[1]["super_model"] == "box_model" and table[1]["vertices"] == "4"
+
+    totals, unknown_controllers, unknown_node_types, super_models = stats.summary(rows)
+    assert totals["mesh_nodes"] == 2 and totals["faces"] == 4
+    assert super_models == {"box_model": 1}
+    assert not unknown_controllers and not unknown_node_types
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import kotor.model.mdl as mdl
+import kotor.model.supermodel as supermodel
+from .testutil import *
+import pytest
+
+
+def write_model(directory, name, root, super_model="NULL", animations=()):
+    data, mdx = model_data(root, super_model=super_model, animations=animations)
+    (directory / (name + ".mdl")).write_bytes(data)
+    (directory / (name + ".mdx")).write_bytes(mdx)
+
+
+def animation(name, root_name, node_name):
+    return AnimationSpec(name, 1.0, NodeSpec(root_name, children=[NodeSpec(node_name, controllers=[(8, [0.0], [(1.0, 2.0, 3.0)])])]))
+
+
+@pytest.fixture
+def library(tmp_path):
+    write_model(tmp_path, "s_base", NodeSpec("s_base", children=[NodeSpec("torso"), NodeSpec("head")]),
+                animations=[animation("pause1", "s_base", "torso"), animation("walk", "s_base", "torso")])
+    write_model(tmp_path, "s_male", NodeSpec("s_male", children=[NodeSpec("head"), NodeSpec("torso")]), "s_base",
+                animations=[animation("walk", "s_male", "head")])
+    write_model(tmp_path, "c_bantha", NodeSpec("c_bantha", children=[NodeSpec("Torso"), NodeSpec("horns")]), "S_Male")
+    write_model(tmp_path, "c_other", NodeSpec("c_other", children=[NodeSpec("head")]), "s_male")
+    write_model(tmp_path, "c_lost", NodeSpec("c_lost"), "s_missing")
+    source = supermodel.ModelSource()
+    source.add_directory(str(tmp_path))
+    return supermodel.ModelLibrary(source)
+
+
+def test_model_source(tmp_path, library):
+    assert "C_BANTHA" in library.source
+    assert list(library.source.locations) == ["c_bantha", "c_lost", "c_other", "s_base", "s_male"]
+    data, mdx = library.source.read("s_male")
+    assert data == (tmp_path / "s_male.mdl").read_bytes()
+
+
+def test_chain(library):
+    assert library.chain_names("c_bantha") == ["c_bantha", "s_male", "s_base"]
+    assert [model.geometry_header.name for model in library.chain("c_bantha")] == ["c_bantha", "s_male", "s_base"]
+    assert library.chain_names("c_lost") == ["c_lost"]
+    assert library.chain_names("s_base") == ["s_base"]
+
+
+def test_super_models_are_loaded_once(library):
+    reads = []
+    read = library.source.read
+    library.source.read = lambda name: reads.append(name) or read(name)
+    first = library.chain("c_bantha")
+    second = library.chain("c_other")
+    assert first[1] is second[1]
+    assert sorted(reads) == ["c_bantha", "c_other", "s_base", "s_male"]
+
+
+def test_part_numbers(library):
+    # c_bantha: c_bantha 0, torso 1, horns 2. s_male: s_male 0, head 1, torso 2. s_base: s_base 0, torso 1, head 2.
+    assert library.chain_part_numbers("c_bantha").tolist() == [[0, 1, 2], [-1, 2, -1], [-1, 1, -1]]
+    assert library.part_numbers("c_bantha", "s_male") is library.part_numbers("C_Bantha", "S_MALE")
+
+
+def test_inherited_animations(library):
+    animations = library.animations("c_other")
+    assert list(animations) == ["walk", "pause1"]
+    walk, owner = animations["walk"]
+    assert owner.geometry_header.name == "s_male"
+    assert library.find_animation("c_other", "PAUSE1")[1].geometry_header.name == "s_base"
+    assert library.find_animation("c_other", "run") is None
+
+
+def test_find_animation_parses_only_the_animation(library):
+    assert list(library.animation_owners("c_bantha")) == ["walk", "pause1"]
+    animation, owner = library.find_animation("c_bantha", "pause1")
+    assert animation.animation_name == "pause1"
+    assert list(library.load("s_base").model_header.animations.loaded) == [0]
+    assert not library.load("s_male").model_header.animations.loaded
+
+
+def test_animations_below_load_animations(library):
+    library = supermodel.ModelLibrary(library.source, level=mdl.LOAD_GEOMETRY)
+    bantha = library.load("c_bantha")
+    library.chain("c_bantha")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("model parsed again")
+    parse = supermodel.load_model
+    supermodel.load_model = fail
+    try:
+        assert list(library.animation_owners("c_bantha")) == ["walk", "pause1"]
+    finally:
+        supermodel.load_model = parse
+    assert not library.load("s_male").model_header.animations.loaded
+    animation, owner = library.find_animation("c_bantha", "walk")
+    assert owner.geometry_header.name == "s_male"
+    assert animation.animation_node.childs[0].name == "head"
+    # the index is kept in the loaded models
+    assert library.load("c_bantha") is bantha
+    assert library.animation_index("s_male") is library.load("s_male").model_header.animations
+
+    # without node names
+    library = supermodel.ModelLibrary(library.source, level=mdl.LOAD_HEADERS)
+    assert list(library.animation_owners("s_male")) == ["walk", "pause1"]
+    assert library.find_animation("s_male", "pause1")[0].animation_node.childs[0].name == "torso"
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import kotor.lyt as lyt
+import kotor.navmesh as navmesh
+import kotor.wok as wok
+from .testutil import *
+import io
+import numpy
+import pytest
+
+
+LAYOUT = """# Exported
+beginlayout
+   roomcount 3
+      m01_a 0.0 0.0 0.0
+      m01_b 10.0 20.0 0.0
+      m01_c 0.0 0.0 0.0
+   trackcount 0
+   obstaclecount 0
+   doorhookcount 1
+      m01_a door_01 0 4.0 0.5 0.0 0.0 0.0 0.0 1.0
+donelayout
+"""
+
+
+def grid(x, y, width, height, material=1):
+    """Unit quads (two counter clockwise faces each) covering width x height cells starting at (x, y)."""
+    vertices = [(float(x + i), float(y + j), 0.0) for j in range(height + 1) for i in range(width + 1)]
+    faces = []
+    for j in range(height):
+        for i in range(width):
+            corner = j * (width + 1) + i
+            faces.append((corner, corner + 1, corner + width + 2))
+            faces.append((corner, corner + width + 2, corner + width + 1))
+    return vertices, faces, [material] * len(faces)
+
+
+def write_walkmesh(directory, name, vertices, faces, materials, position=(0.0, 0.0, 0.0)):
+    (directory / (name + ".wok")).write_bytes(wok_data(vertices, faces, materials, position))
+
+
+@pytest.fixture
+def area(tmp_path):
+    """L shaped corridor of two rooms and an island. room b is stored relative to its position (10, 20)."""
+    write_walkmesh(tmp_path, "m01_a", *grid(0, 0, 4, 1))
+    vertices, faces, materials = grid(-6, -20, 1, 5)
+    write_walkmesh(tmp_path, "m01_b", vertices, faces, materials)
+    island = grid(8, 8, 1, 1)
+    lava = grid(0, 1, 1, 1, material=15)
+    write_walkmesh(tmp_path, "m01_c", island[0] + lava[0], island[1] + [tuple(index + 4 for index in face) for face in lava[1]], island[2] + lava[2])
+    (tmp_path / "m01.lyt").write_text(LAYOUT)
+    return navmesh.load_area(str(tmp_path / "m01.lyt"))
+
+
+def test_read_lyt():
+    layout = lyt.read_lyt(io.StringIO(LAYOUT))
+    assert [room.name for room in layout.rooms] == ["m01_a", "m01_b", "m01_c"]
+    assert layout.rooms[1].position == (10.0, 20.0, 0.0)
+    assert layout.door_hooks[0].name == "door_01"
+    assert layout.door_hooks[0].orientation == (0.0, 0.0, 0.0, 1.0)
+
+
+def test_read_wok():
+    walkmesh = wok.read_wok(io.BytesIO(wok_data(*grid(0, 0, 2, 1), position=(1.0, 2.0, 3.0))))
+    assert walkmesh.walkmesh_type == 1
+    assert walkmesh.position == (1.0, 2.0, 3.0)
+    assert walkmesh.vertices.shape == (6, 3)
+    assert walkmesh.faces.tolist()[0] == [0, 1, 4]
+    assert walkmesh.normals[0].tolist() == [0.0, 0.0, 1.0]
+
+
+def test_read_wok_rejects_other_files():
+    with pytest.raises(ValueError):
+        wok.read_wok(io.BytesIO(bytes(136)))
+
+
+def test_navmesh_stitches_rooms(area):
+    # 8 + 10 + 2 walkable faces, the lava faces are skipped
+    assert len(area) == 20
+    assert len(numpy.unique(area.components)) == 2
+    # the corridor faces at the border of the rooms are adjacent
+    corner = area.locate([(3.5, 0.9, 0.0)])[0]
+    above = area.locate([(4.5, 1.1, 0.0)])[0]
+    assert area.face_rooms[corner] == 0 and area.face_rooms[above] == 1
+    assert area.components[corner] == area.components[above]
+
+
+def test_locate_and_heights(area):
+    faces = area.locate([(0.75, 0.25, 0.0), (0.25, 0.75, 0.0), (2.0, 3.0, 0.0), (0.5, 1.5, 0.0)])
+    assert faces[0] >= 0 and faces[1] >= 0 and faces[0] != faces[1]
+    # outside of the corridor and on lava
+    assert faces[2:].tolist() == [-1, -1]
+    assert area.heights([(1.5, 0.5)]).tolist() == [0.0]
+    assert numpy.isnan(area.heights([(2.0, 3.0)])[0])
+
+
+def test_reachable(area):
+    starts = [(0.5, 0.5, 0.0), (0.5, 0.5, 0.0), (0.5, 0.5, 0.0)]
+    goals = [(4.5, 4.5, 0.0), (8.5, 8.5, 0.0), (20.0, 20.0, 0.0)]
+    assert area.reachable(starts, goals).tolist() == [True, False, False]
+
+
+def test_find_path_around_corner(area):
+    path = area.find_path((0.5, 0.5, 0.0), (4.5, 4.5, 0.0))
+    assert path.points.tolist() == [[0.5, 0.5, 0.0], [4.0, 1.0, 0.0], [4.5, 4.5, 0.0]]
+    assert path.length() == pytest.approx(numpy.hypot(3.5, 0.5) + numpy.hypot(0.5, 3.5))
+    assert area.face_rooms[path.faces[0]] == 0 and area.face_rooms[path.faces[-1]] == 1
+
+
+def test_find_straight_path(area):
+    path = area.find_path((0.5, 0.5, 0.0), (3.5, 0.25, 0.0))
+    assert path.points.tolist() == [[0.5, 0.5, 0.0], [3.5, 0.25, 0.0]]
+
+
+def test_find_path_unreachable(area):
+    assert area.find_path((0.5, 0.5, 0.0), (8.5, 8.5, 0.0)) is None
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import io
+import struct
 
 class SeekLoggingBytesIO(io.BytesIO):
     def __init__(self,  data):
@@ -12,3 +13,259 @@ class SeekLoggingBytesIO(io.BytesIO):
         
     def tell(self):
         return super(SeekLoggingBytesIO,  self).tell()
+
+
+def tpc_data(width, height, encoding, texel_data, mipmaps=1, data_size=None, trailer=b""):
+    """Returns the bytes of a tpc file with the given texel data."""
+    if data_size is None:
+        data_size = len(texel_data)
+    header = struct.pack("=II HH BBH", data_size, 0, width, height, encoding, mipmaps, 0) + bytes(112)
+    return header + texel_data + trailer
+
+
+def erf_data(files):
+    """Returns the bytes of an erf file containing the files, a list of (name, type id, data) tuples."""
+    key_offset = 160
+    ressources_offset = key_offset + 24 * len(files)
+    data_offset = ressources_offset + 8 * len(files)
+    header = b"ERF V1.0" + struct.pack("=9I", 0, 0, len(files), key_offset, key_offset, ressources_offset, 100, 1, 0) + bytes(116)
+    keys = b""
+    ressources = b""
+    for index, (name, type_id, data) in enumerate(files):
+        keys += name.encode("utf-8").ljust(16, b"\0") + struct.pack("=IHH", index, type_id, 0)
+        ressources += struct.pack("=II", data_offset, len(data))
+        data_offset += len(data)
+    return header + keys + ressources + b"".join(data for name, type_id, data in files)
+
+
+class NodeSpec:
+    """Description of a model node for mdl_data."""
+
+    def __init__(self, name, node_type=0x1, position=(0.0, 0.0, 0.0), rotation=(1.0, 0.0, 0.0, 0.0), children=(),
+                 vertices=(), faces=(), controllers=(), normals=None, uvs=None, bone_map=None, bone_weights=None, bone_indices=None):
+        self.name = name
+        self.node_type = node_type
+        self.position = position
+        self.rotation = rotation
+        self.children = list(children)
+        # list of (x, y, z)
+        self.vertices = list(vertices)
+        # list of (vertex indices, adjected faces, surface)
+        self.faces = list(faces)
+        # list of (controller type, times, rows)
+        self.controllers = list(controllers)
+        # mdx data: lists of (x, y, z) and (u, v) per vertex
+        self.normals = normals
+        self.uvs = uvs
+        # skin (node type 0x40): bone index of each node id (-1 for no bone) and 4 weights and bone indices per vertex
+        self.bone_map = bone_map
+        self.bone_weights = bone_weights
+        self.bone_indices = bone_indices
+
+
+def face_plane(vertices, indices):
+    a, b, c = [vertices[index] for index in indices]
+    u = [b[i] - a[i] for i in range(3)]
+    v = [c[i] - a[i] for i in range(3)]
+    normal = [u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2], u[0] * v[1] - u[1] * v[0]]
+    length = sum(n * n for n in normal) ** 0.5 or 1.0
+    normal = [n / length for n in normal]
+    return normal, -sum(normal[i] * a[i] for i in range(3))
+
+
+class MdlWriter:
+    """Writes a minimal binary model file, see kotor.model.nodes for the layout."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.mdx = bytearray()
+
+    def alloc(self, data):
+        offset = len(self.data)
+        self.data += data
+        return offset
+
+    def array(self, offset, count):
+        return struct.pack("=3I", offset, count, count)
+
+    def write_aabb(self, node, faces):
+        """Writes an aabb tree over the faces, split at the median along the longest axis. Returns the offset of the root."""
+        corners = [node.vertices[index] for face in faces for index in node.faces[face][0]]
+        minimum = [min(corner[axis] for corner in corners) for axis in range(3)]
+        maximum = [max(corner[axis] for corner in corners) for axis in range(3)]
+        offset = self.alloc(bytes(40))
+        left = right = 0
+        leaf = faces[0]
+        if len(faces) > 1:
+            axis = max(range(3), key=lambda axis: maximum[axis] - minimum[axis])
+            faces = sorted(faces, key=lambda face: sum(node.vertices[index][axis] for index in node.faces[face][0]))
+            left = self.write_aabb(node, faces[:len(faces) // 2])
+            right = self.write_aabb(node, faces[len(faces) // 2:])
+            leaf = -1
+        struct.pack_into("=6fIIiI", self.data, offset, *minimum, *maximum, left, right, leaf, 0)
+        return offset
+
+    def write_node(self, node, parent_id, ids):
+        node_id = ids[node.name]
+        start = self.alloc(struct.pack("=H", node.node_type))
+        header_offset = self.alloc(bytes(78))
+        mesh_offset = self.alloc(bytes(340)) if node.node_type & 0x20 else None
+        skin_offset = self.alloc(bytes(100)) if node.node_type & 0x40 else None
+        aabb_offset = self.alloc(bytes(4)) if node.node_type & 0x200 else None
+
+        # controllers
+        controllers = b""
+        controller_data = []
+        # (type, times, rows) or (type, times, rows, column_count) for bezier or compressed controllers
+        for controller_type, times, rows, *column_count in node.controllers:
+            columns = column_count[0] if column_count else len(rows[0])
+            controllers += struct.pack("=I2sHHHB3s", controller_type, b"\xff\xff", len(times), len(controller_data),
+                                       len(controller_data) + len(times), columns, bytes(3))
+            controller_data += list(times)
+            for row in rows:
+                controller_data += list(row)
+        controllers_offset = self.alloc(controllers)
+        controller_data_offset = self.alloc(struct.pack("={}f".format(len(controller_data)), *controller_data))
+
+        if mesh_offset is not None:
+            faces = b""
+            for indices, adjected, surface in node.faces:
+                normal, distance = face_plane(node.vertices, indices)
+                faces += struct.pack("=4fI3H3H", *normal, distance, surface, *adjected, *indices)
+            faces_offset = self.alloc(faces)
+            vertex_count_offset = self.alloc(struct.pack("=I", 3 * len(node.faces)))
+            vertices_offset = self.alloc(b"".join(struct.pack("=3f", *vertex) for vertex in node.vertices))
+            indices_offset = self.alloc(b"".join(struct.pack("=3H", *indices) for indices, adjected, surface in node.faces))
+            vertex_offset_offset = self.alloc(struct.pack("=I", indices_offset))
+
+            # mdx records: position, normal (optional), uv (optional), bone weights and indices (skin only)
+            record_size = 12
+            normals_offset = 0xFFFFFFFF
+            uv_offset = -1
+            if node.normals is not None:
+                normals_offset = record_size
+                record_size += 12
+            if node.uvs is not None:
+                uv_offset = record_size
+                record_size += 8
+            bone_offsets = (record_size, record_size + 16)
+            if skin_offset is not None:
+                record_size += 32
+            mdx_offset = len(self.mdx)
+            for index, vertex in enumerate(node.vertices):
+                self.mdx += struct.pack("=3f", *vertex)
+                if node.normals is not None:
+                    self.mdx += struct.pack("=3f", *node.normals[index])
+                if node.uvs is not None:
+                    self.mdx += struct.pack("=2f", *node.uvs[index])
+                if skin_offset is not None:
+                    self.mdx += struct.pack("=4f4f", *node.bone_weights[index], *node.bone_indices[index])
+
+            mesh = bytearray(340)
+            struct.pack_into("=12s", mesh, 8, self.array(faces_offset, len(node.faces)))
+            struct.pack_into("=32s", mesh, 88, b"texture")
+            struct.pack_into("=12s12s", mesh, 176, self.array(vertex_count_offset, 1), self.array(vertex_offset_offset, 1))
+            struct.pack_into("=I", mesh, 252, record_size)
+            struct.pack_into("=I4sii", mesh, 264, normals_offset, bytes(4), uv_offset, -1)
+            struct.pack_into("=H", mesh, 304, len(node.vertices))
+            struct.pack_into("=II", mesh, 332, mdx_offset, vertices_offset)
+            self.data[mesh_offset:mesh_offset + 340] = mesh
+
+        if skin_offset is not None:
+            bone_map_offset = self.alloc(struct.pack("={}f".format(len(node.bone_map)), *node.bone_map))
+            struct.pack_into("=5III", self.data, skin_offset, 0, 0, 0, *bone_offsets, bone_map_offset, len(node.bone_map))
+
+        if aabb_offset is not None:
+            struct.pack_into("=I", self.data, aabb_offset, self.write_aabb(node, list(range(len(node.faces)))))
+
+        child_offsets = [self.write_node(child, node_id, ids) for child in node.children]
+        child_offsets_offset = self.alloc(struct.pack("={}I".format(len(child_offsets)), *child_offsets))
+        header = struct.pack("=HH6sI3f4f", parent_id, node_id, bytes(6), 0, *node.position, *node.rotation)
+        header += self.array(child_offsets_offset, len(child_offsets))
+        header += self.array(controllers_offset, len(node.controllers))
+        header += self.array(controller_data_offset, len(controller_data))
+        self.data[header_offset:header_offset + 78] = header
+        return start
+
+
+class AnimationSpec:
+    """
+        Description of an animation for model_data. The nodes of root must have the names of model nodes. The
+        animation header names the root node of the animation (animroot), the name of root by default.
+    """
+
+    def __init__(self, name, length, root, transition_time=0.25, events=(), animation_root=None):
+        self.name = name
+        self.length = length
+        self.root = root
+        self.animation_root = animation_root if animation_root is not None else root.name
+        self.transition_time = transition_time
+        # (time, name) tuples
+        self.events = list(events)
+
+    def write(self, writer, ids):
+        header_offset = writer.alloc(bytes(80 + 56))
+        events_offset = writer.alloc(b"".join(struct.pack("=f32s", time, name.encode("utf-8")) for time, name in self.events))
+        root_offset = writer.write_node(self.root, 0xFFFF, ids)
+        header = struct.pack("=8s32sII28sB3s", bytes(8), self.name.encode("utf-8"), root_offset, len(list(iterate_specs(self.root))), bytes(28), 5, bytes(3))
+        header += struct.pack("=ff32s12s4s", self.length, self.transition_time, self.animation_root.encode("utf-8"),
+                              writer.array(events_offset, len(self.events)), bytes(4))
+        writer.data[header_offset:header_offset + 80 + 56] = header
+        return header_offset
+
+
+def iterate_specs(node):
+    yield node
+    for child in node.children:
+        yield from iterate_specs(child)
+
+
+def mdl_data(root, **kwargs):
+    """Returns the bytes of a model file with the node tree root (a NodeSpec)."""
+    return model_data(root, **kwargs)[0]
+
+
+def model_data(root, super_model="NULL", classification=4, animations=()):
+    """Returns the bytes of the mdl and mdx file with the node tree root (a NodeSpec) and the animations (AnimationSpecs)."""
+    writer = MdlWriter()
+    writer.alloc(bytes(80 + 88 + 28))
+    nodes = list(iterate_specs(root))
+    ids = {node.name: index for index, node in enumerate(nodes)}
+    names = writer.alloc(b"".join(node.name.encode("utf-8") + b"\0" for node in nodes))
+    name_offsets = []
+    for node in nodes:
+        name_offsets.append(names)
+        names += len(node.name) + 1
+    names_offset_array = writer.alloc(struct.pack("={}I".format(len(name_offsets)), *name_offsets))
+    animation_offsets = writer.alloc(bytes(4 * len(animations)))
+    root_offset = writer.write_node(root, 0xFFFF, ids)
+    for index, animation in enumerate(animations):
+        struct.pack_into("=I", writer.data, animation_offsets + 4 * index, animation.write(writer, ids))
+
+    geometry_header = struct.pack("=8s32sII28sB3s", bytes(8), root.name.encode("utf-8"), root_offset, len(nodes), bytes(28), 2, bytes(3))
+    model_header = struct.pack("=HBB4s12s4s6fff32s", 1, classification, 0, bytes(4), writer.array(animation_offsets, len(animations)), bytes(4),
+                               -1, -1, -1, 1, 1, 1, 2.0, 1.0, super_model.encode("utf-8"))
+    names_header = struct.pack("=4I12s", root_offset, 0, 0, 0, writer.array(names_offset_array, len(nodes)))
+    writer.data[0:196] = geometry_header + model_header + names_header
+    return struct.pack("=3I", 0, len(writer.data), len(writer.mdx)) + bytes(writer.data), bytes(writer.mdx)
+
+
+def wok_data(vertices, faces, materials, position=(0.0, 0.0, 0.0), walkmesh_type=1):
+    """Returns the bytes of a binary walkmesh with the faces (triples of vertex indices). aabb tree and adjacency are left empty."""
+    data = bytearray(136)
+    vertex_offset = len(data)
+    data += b"".join(struct.pack("=3f", *vertex) for vertex in vertices)
+    faces_offset = len(data)
+    data += b"".join(struct.pack("=3I", *face) for face in faces)
+    materials_offset = len(data)
+    data += struct.pack("={}I".format(len(materials)), *materials)
+    normals_offset = len(data)
+    for face in faces:
+        normal, distance = face_plane(vertices, face)
+        data += struct.pack("=3f", *normal)
+    distances_offset = len(data)
+    data += b"".join(struct.pack("=f", face_plane(vertices, face)[1]) for face in faces)
+    struct.pack_into("=4s4sI15f16I", data, 0, b"BWM ", b"V1.0", walkmesh_type, *([0.0] * 12), *position,
+                     len(vertices), vertex_offset, len(faces), faces_offset, materials_offset, normals_offset, distances_offset,
+                     0, 0, 0, 0, 0, 0, 0, 0, 0)
+    return bytes(data)
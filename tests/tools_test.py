@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+from kotor.tools import *
+import pytest
+
+
+class TreeNode:
+
+    def __init__(self, name, children=()):
+        self.name = name
+        self.children = list(children)
+
+    def get_childs(self):
+        return self.children
+
+
+def sample_tree():
+    #       a
+    #     b   e
+    #    c d   f
+    return TreeNode("a", [TreeNode("b", [TreeNode("c"), TreeNode("d")]), TreeNode("e", [TreeNode("f")])])
+
+
+def chain(depth):
+    root = TreeNode("0")
+    node = root
+    for index in range(1, depth):
+        child = TreeNode(str(index))
+        node.children.append(child)
+        node = child
+    return root
+
+
+def names(nodes):
+    return [node.name for node in nodes]
+
+
+def test_iterate_tree():
+    assert names(iterate_tree(sample_tree(), TreeNode.get_childs)) == ["a", "b", "c", "d", "e", "f"]
+
+
+def test_visit_tree():
+    visited = []
+    visit_tree(sample_tree(), TreeNode.get_childs, lambda node, depth: visited.append((node.name, depth)), depth=1)
+    assert visited == [("a", 1), ("b", 2), ("c", 3), ("d", 3), ("e", 2), ("f", 3)]
+
+
+def test_walk_tree_orders():
+    def walk(order):
+        return [(node.name, depth) for node, depth in walk_tree(sample_tree(), TreeNode.get_childs, order)]
+    assert walk(PRE_ORDER) == [("a", 0), ("b", 1), ("c", 2), ("d", 2), ("e", 1), ("f", 2)]
+    assert walk(POST_ORDER) == [("c", 2), ("d", 2), ("b", 1), ("f", 2), ("e", 1), ("a", 0)]
+    assert walk(BREADTH_FIRST) == [("a", 0), ("b", 1), ("e", 1), ("c", 2), ("d", 2), ("f", 2)]
+    with pytest.raises(ValueError):
+        list(walk_tree(sample_tree(), TreeNode.get_childs, "in-order"))
+
+
+def test_filter_tree():
+    tree = sample_tree()
+    assert names(filter_tree(tree, TreeNode.get_childs, lambda node: node.name != "b")) == ["a", "c", "d", "e", "f"]
+    assert names(filter_tree(tree, TreeNode.get_childs, lambda node: node.name != "b", prune=True)) == ["a", "e", "f"]
+
+
+def test_deep_trees():
+    depth = 50000
+    assert sum(1 for _ in iterate_tree(chain(depth), TreeNode.get_childs)) == depth
+    first, last = None, None
+    for node, node_depth in walk_tree(chain(depth), TreeNode.get_childs, POST_ORDER):
+        first = first or (node.name, node_depth)
+        last = (node.name, node_depth)
+    assert first == (str(depth - 1), depth - 1) and last == ("0", 0)
+
+
+def test_block_sort():
+    root = Block("root", 0)
+    late = root.start_block("late", 10)
+    root.start_block("early", 0)
+    late.start_block("b", 15)
+    late.start_block("a", 12)
+    root.sort()
+    assert [block.name for block in iterate_tree(root, Block.get_childs)] == ["root", "early", "late", "a", "b"]
@@ -1,8 +1,15 @@
+import kotor.dxt as dxt
 import kotor.tpc as tpc
+from . import dxt_test
 from .testutil import *
 from kotor.tools import *
+import argparse
 import io
+import numpy
 import struct
+import pytest
+
+from PIL import Image
 
 
 def test_dx1_full_interpolate():
@@ -44,3 +51,210 @@ def test_dx1_interpolate_with_zero():
 
 
 
+def write_texture_pack(path):
+    dxt1 = struct.pack("=HH I", 0xF800, 0x001F, 0)
+    texture = tpc_data(4, 4, tpc.ENCODING_DXT_1, dxt1)
+    path.write_bytes(erf_data([("tex_red", 3007, texture), ("readme", 10, b"text"), ("tex_broken", 3007, b"short")]))
+    return str(path)
+
+
+def test_find_erf_textures(tmp_path):
+    erf_file = write_texture_pack(tmp_path / "textures.erf")
+    textures = list(tpc.find_erf_textures([erf_file]))
+    assert [texture[3] for texture in textures] == ["tex_red", "tex_broken"]
+    assert textures[0][0] == erf_file
+    assert textures[0][2] == 128 + 8
+
+
+def test_convert_archive_entry(tmp_path):
+    erf_file = write_texture_pack(tmp_path / "textures.erf")
+    texture = next(tpc.find_erf_textures([erf_file]))
+    name, size, pixels, error = tpc.convert_archive_entry(texture + (str(tmp_path), "png", False))
+    assert error is None
+    assert (name, size, pixels) == ("tex_red", 136, 16)
+    img = Image.open(str(tmp_path / "tex_red.png"))
+    assert img.getpixel((0, 0)) == (255, 0, 0, 255)
+
+
+def test_convert_archive_entry_reports_errors(tmp_path):
+    erf_file = write_texture_pack(tmp_path / "textures.erf")
+    texture = list(tpc.find_erf_textures([erf_file]))[1]
+    name, size, pixels, error = tpc.convert_archive_entry(texture + (str(tmp_path), "png", False))
+    assert name == "tex_broken"
+    assert error
+
+
+def test_convert_archive_entry_to_dds(tmp_path):
+    erf_file = write_texture_pack(tmp_path / "textures.erf")
+    texture = next(tpc.find_erf_textures([erf_file]))
+    name, size, pixels, error = tpc.convert_archive_entry(texture + (str(tmp_path), "dds", False))
+    assert error is None
+    assert (tmp_path / "tex_red.dds").read_bytes()[128:] == struct.pack("=HH I", 0xF800, 0x001F, 0)
+
+
+def test_mipmap_sizes():
+    header = tpc.Header(io.BytesIO(tpc_data(16, 8, tpc.ENCODING_DXT_5, b"", mipmaps=5, data_size=128)))
+    assert tpc.mipmap_sizes(header) == [8 * 16, 2 * 16, 16, 16, 16]
+
+
+def test_write_dds():
+    texels = bytes(range(32))
+    input = io.BytesIO(tpc_data(8, 4, tpc.ENCODING_DXT_1, texels, mipmaps=3, data_size=16, trailer=b"txi"))
+    output = io.BytesIO()
+    header = tpc.write_dds(input, output)
+    assert header.width == 8
+    dds = output.getvalue()
+    assert len(dds) == 128 + 32
+    magic, size, flags, height, width, linear_size, depth, mipmaps = struct.unpack_from("<4s7I", dds)
+    assert magic == b"DDS "
+    assert (size, height, width, linear_size, mipmaps) == (124, 4, 8, 16, 3)
+    assert flags & tpc.DDSD_MIPMAPCOUNT
+    assert dds[84:88] == b"DXT1"
+    assert dds[128:] == texels
+
+
+@pytest.mark.parametrize("encoding, width, height", [("dxt1", 16, 8), ("dxt5", 8, 16), ("dxt5", 8, 2), ("dxt1", 4, 1)])
+def test_write_dds_flips_like_png(encoding, width, height):
+    img = Image.fromarray(dxt_test.gradient_image(width, height, alpha=200), 'RGBA')
+    img.putpixel((1, 0), (255, 255, 255, 0))
+    tpc_file = io.BytesIO()
+    tpc.write_tpc(tpc_file, img, encoding)
+    tpc_file.seek(0)
+    dds = io.BytesIO()
+    header = tpc.write_dds(tpc_file, dds, flip=True)
+    offset = 128
+    for level, size in enumerate(tpc.mipmap_sizes(header)):
+        png = numpy.asarray(tpc.read_texture(io.BytesIO(tpc_file.getvalue()), mipmap=level))
+        decoded = dxt.decompress(dds.getvalue()[offset:offset + size], png.shape[1], png.shape[0], encoding)
+        assert (decoded == png).all()
+        offset += size
+    assert offset == len(dds.getvalue())
+
+
+def test_write_dds_rejects_inexact_flip():
+    tpc_file = io.BytesIO()
+    # the second mipmap of a texture with height 12 has height 6
+    tpc.write_tpc(tpc_file, Image.new('RGBA', (8, 12)), "dxt1")
+    tpc_file.seek(0)
+    with pytest.raises(ValueError):
+        tpc.write_dds(tpc_file, io.BytesIO(), flip=True)
+
+
+def test_write_dds_rejects_uncompressed():
+    input = io.BytesIO(tpc_data(1, 1, 1, b"\x00", data_size=0))
+    with pytest.raises(ValueError):
+        tpc.write_dds(input, io.BytesIO())
+
+
+def test_write_tpc():
+    img = Image.new('RGBA', (16, 8), color=(255, 0, 0, 255))
+    output = io.BytesIO()
+    assert tpc.write_tpc(output, img) == 5
+    output.seek(0)
+    header = tpc.Header(output)
+    assert (header.width, header.height, header.encoding, header.mipmaps) == (16, 8, tpc.ENCODING_DXT_1, 5)
+    assert header.data_size == 8 * 8
+    assert len(output.getvalue()) == 128 + sum(tpc.mipmap_sizes(header))
+    output.seek(0)
+    assert tpc.read_texture(output).getpixel((3, 5)) == (255, 0, 0, 255)
+
+
+def test_write_tpc_selects_dxt5_for_transparent_images():
+    img = Image.new('RGBA', (4, 4), color=(0, 255, 0, 128))
+    output = io.BytesIO()
+    tpc.write_tpc(output, img)
+    output.seek(0)
+    assert tpc.Header(output).encoding == tpc.ENCODING_DXT_5
+
+
+def test_read_texture_dxt5():
+    img = Image.new('RGBA', (8, 4), color=(0, 255, 0, 128))
+    img.putpixel((1, 0), (0, 255, 0, 0))
+    output = io.BytesIO()
+    tpc.write_tpc(output, img, "dxt5")
+    output.seek(0)
+    decoded = tpc.read_texture(output)
+    assert decoded.getpixel((5, 3)) == (0, 255, 0, 128)
+    assert decoded.getpixel((1, 0)) == (0, 255, 0, 0)
+
+
+def test_mipmap_sizes_uncompressed():
+    header = tpc.Header(io.BytesIO(tpc_data(4, 2, tpc.ENCODING_RGB, b"", mipmaps=3, data_size=0)))
+    assert not header.is_compressed()
+    assert tpc.mipmap_sizes(header) == [24, 6, 3]
+
+
+def test_read_texture_grayscale():
+    # two rows, stored bottom up
+    input = io.BytesIO(tpc_data(2, 2, tpc.ENCODING_GRAYSCALE, bytes([10, 20, 30, 40]), data_size=0))
+    img = tpc.read_texture(input)
+    assert img.mode == 'RGBA'
+    assert img.getpixel((0, 0)) == (30, 30, 30, 255)
+    assert img.getpixel((1, 1)) == (20, 20, 20, 255)
+
+
+def test_read_texture_rgba():
+    input = io.BytesIO(tpc_data(1, 2, tpc.ENCODING_RGBA, bytes([1, 2, 3, 4, 5, 6, 7, 8]), data_size=0))
+    img = tpc.read_texture(input)
+    assert img.getpixel((0, 0)) == (5, 6, 7, 8)
+    assert img.getpixel((0, 1)) == (1, 2, 3, 4)
+
+
+def test_read_texture_txi():
+    texels = bytes([1, 2, 3]) + bytes([4, 5, 6])
+    input = io.BytesIO(tpc_data(1, 1, tpc.ENCODING_RGB, texels, mipmaps=2, data_size=0, trailer=b"mipmap 0\r\nblending additive\r\n\0"))
+    img = tpc.read_texture(input)
+    assert img.getpixel((0, 0)) == (1, 2, 3, 255)
+    assert img.info["txi"] == "mipmap 0\r\nblending additive\r\n"
+
+
+def test_read_texture_unsupported_encoding():
+    input = io.BytesIO(tpc_data(1, 1, 12, bytes(4), data_size=0))
+    with pytest.raises(ValueError):
+        tpc.read_texture(input)
+
+
+def test_read_texture_mipmap():
+    texels = bytes([1, 2, 3, 4, 5, 6]) + bytes([7, 8, 9])
+    input = io.BytesIO(tpc_data(2, 1, tpc.ENCODING_RGB, texels, mipmaps=2, data_size=0))
+    img = tpc.read_texture(input, mipmap=1)
+    assert img.size == (1, 1)
+    assert img.getpixel((0, 0)) == (7, 8, 9, 255)
+    with pytest.raises(ValueError):
+        tpc.read_texture(io.BytesIO(input.getvalue()), mipmap=2)
+
+
+def test_load_texture_uses_cache(tmp_path, monkeypatch):
+    data = tpc_data(1, 2, tpc.ENCODING_RGBA, bytes([1, 2, 3, 4, 5, 6, 7, 8]), data_size=0, trailer=b"decal 1")
+    cache = tpc.DiskCache(str(tmp_path))
+    img = tpc.load_texture(data, cache=cache)
+    assert cache.size() > 0
+
+    monkeypatch.setattr(tpc, "read_texture", None)
+    cached = tpc.load_texture(data, cache=cache)
+    assert cached.tobytes() == img.tobytes()
+    assert cached.info["txi"] == "decal 1"
+    # other decode options are different cache entries
+    with pytest.raises(TypeError):
+        tpc.load_texture(data, flip=False, cache=cache)
+
+
+def test_batch_convert_scans_cache_once_per_worker(tmp_path, monkeypatch):
+    textures = [("tex_{}".format(index), 3007, tpc_data(4, 4, tpc.ENCODING_DXT_1, struct.pack("=HH I", index, 0x001F, 0))) for index in range(12)]
+    (tmp_path / "textures.erf").write_bytes(erf_data(textures))
+    scans = tmp_path / "scans.txt"
+    entries = tpc.DiskCache.entries
+
+    def logged_entries(self):
+        # the workers are forked, they append to the file
+        with open(str(scans), "a") as file:
+            file.write("scan\n")
+        return entries(self)
+
+    monkeypatch.setattr(tpc.DiskCache, "entries", logged_entries)
+    parsed = argparse.Namespace(key=None, filter=None, directory=str(tmp_path / "png"), format="png", flip_dds=False,
+                                cache=str(tmp_path / "cache"), cache_size=1, jobs=2)
+    tpc.batch_convert(parsed, [str(tmp_path / "textures.erf")])
+    assert len(list((tmp_path / "png").iterdir())) == 12
+    assert len(list((tmp_path / "cache").glob("*/*.bin"))) == 12
+    assert len(scans.read_text().split()) <= 2